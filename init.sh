@@ -1,2 +1,2 @@
 apt-get update && apt-get upgrade -y
-docker-compose -f docker-compose.filler-init.yml up -d --build && docker-compose exec filler alembic revision --autogenerate -m "init"  && docker-compose exec filler alembic upgrade head
\ No newline at end of file
+docker-compose -f docker-compose.filler-init.yml up -d --build && docker-compose exec filler alembic upgrade heads
\ No newline at end of file
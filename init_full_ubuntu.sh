@@ -6,4 +6,4 @@ apt-get update && apt-get install docker-ce docker-ce-cli containerd.io -y
 curl -L "https://github.com/docker/compose/releases/download/1.29.2/docker-compose-$(uname -s)-$(uname -m)" -o /usr/local/bin/docker-compose
 chmod +x /usr/local/bin/docker-compose
 ln -s /usr/local/bin/docker-compose /usr/bin/docker-compose
-docker-compose -f docker-compose.filler-init.yml up -d --build && docker-compose exec filler alembic revision --autogenerate -m "init"  && docker-compose exec filler alembic upgrade head
\ No newline at end of file
+docker-compose -f docker-compose.filler-init.yml up -d --build && docker-compose exec filler alembic upgrade heads
\ No newline at end of file
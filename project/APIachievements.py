@@ -1,19 +1,18 @@
-import os
 import time
 
-import aioredis
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
-from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from sqlalchemy.orm.session import Session
-from sqlmodel import Session, select
+from sqlalchemy.orm import joinedload
+from sqlmodel import select
 
+import avstats
 import config
-from db import engine
+import feed
+from admission import ClientMiddleware, admitted
+from apicache import cached
+from db import FieldError, read_session
+from httpcache import HttpCacheMiddleware
 from models import Achievement, Railroader
 
 app = FastAPI(
@@ -30,28 +29,41 @@ app.add_middleware(
     allow_origins=origins,
     allow_methods=["GET"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(HttpCacheMiddleware)
+app.add_middleware(ClientMiddleware)
 
 
-@app.on_event("startup")
-def on_startup():
-
-    redis = aioredis.from_url(
-        os.environ.get("CELERY_RESULT_BACKEND", "redis://redis:6379"), encoding="utf8", decode_responses=True
-    )
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
-    print("redis cache success")
+@app.exception_handler(FieldError)
+async def field_error_handler(request: Request, exc: FieldError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
 
 
 @app.get("/status", tags=["status"])
-@cache(expire=10)
+@cached(soft=10, hard=120)
 async def get_info_and_api_status():
     start = time.perf_counter()
     return {"query_time": time.perf_counter() - start, "data": {"hi": "ho"}}
 
 
+def format_achievement(achiev, railroader: str) -> dict:
+    return {
+        "id": achiev.id,
+        "achv_id": achiev.achv_id or config.achv_ids.get((achiev.name, achiev.tier)),
+        "railroader": railroader,
+        "type": achiev.type,
+        "criteria": achiev.criteria,
+        "tier": achiev.tier,
+        "value": achiev.value,
+        "name": achiev.name,
+        "reached_date_timestamp": achiev.reached_date_timestamp,
+    }
+
+
 @app.get("/roader", tags=["achievements"])
-@cache(expire=5)
+@cached(soft=60, hard=600, tables=("logrun", "npcencounter"))
+@admitted("cheap")
 async def fetch_roaders(
     railroader: str = None,
     limit: int = Query(default=1000, le=1000),
@@ -60,7 +72,7 @@ async def fetch_roaders(
 ):
     start = time.perf_counter()
 
-    with Session(engine) as session:
+    async with read_session() as session:
         query = select(Railroader)
         if railroader:
             query = query.where(Railroader.name == railroader)
@@ -70,25 +82,14 @@ async def fetch_roaders(
         else:
             query = query.order_by(Railroader.total_runs)
 
-        roaders = session.exec(query.offset(offset).limit(limit).options(selectinload(Railroader.achievements))).all()
+        # One query, the page of railroaders is joined to their achievements
+        query = query.offset(offset).limit(limit).options(joinedload(Railroader.achievements))
+        roaders = (await session.execute(query)).unique().scalars().all()
 
         out = [
             {
                 "roader_meta": roader,
-                "achievements": [
-            {
-                "id":achiev.id,
-                "achv_id": config.achv_mapped[f"{achiev.name} {achiev.tier}"],
-                "railroader":achiev.railroader.name,
-                "type":achiev.type,
-                "criteria": achiev.criteria,
-                "tier":  achiev.tier,
-                "value": achiev.value,
-                "name":achiev.name,
-                "reached_date_timestamp": achiev.reached_date_timestamp,
-                }
-            for achiev in roader.achievements
-        ]
+                "achievements": [format_achievement(achiev, roader.name) for achiev in roader.achievements],
             }
             for roader in roaders
         ]
@@ -97,7 +98,8 @@ async def fetch_roaders(
 
 
 @app.get("/avs", tags=["achievements"])
-@cache(expire=10)
+@cached(soft=60, hard=600, tables=("logrun", "npcencounter"))
+@admitted("medium")
 async def fetch_avs(
     railroader: str = None,
     achv_id: int = None,
@@ -112,11 +114,13 @@ async def fetch_avs(
     order: config.OrderChoose = config.OrderChoose.desc,
 ):
     start = time.perf_counter()
-    with Session(engine) as session:
-        query = select(Achievement)
+    async with read_session() as session:
+        query = select(Achievement, Railroader.name).join(Railroader, Achievement.railroader_id == Railroader.id)
 
         if railroader:
-            query = query.where(Achievement.railroader.name == railroader)
+            query = query.where(Railroader.name == railroader)
+        if achv_id:
+            query = query.where(Achievement.achv_id == achv_id)
         if type:
             query = query.where(Achievement.type == type)
         if criteria:
@@ -130,47 +134,36 @@ async def fetch_avs(
         if before:
             query = query.where(Achievement.reached_date_timestamp < before)
 
-        if achv_id:
-            named = list(config.achv_mapped.keys())[list(config.achv_mapped.values()).index(achv_id)].split(" ")
-            query = query.where(Achievement.name == " ".join(named[:-1])).where(Achievement.tier == int(named[-1]))
-
         if order.value == "desc":
             query = query.order_by(Achievement.reached_date_timestamp.desc())
         else:
             query = query.order_by(Achievement.reached_date_timestamp)
 
-        achievs = session.exec(query.offset(offset).limit(limit)).all()
-        
-        out = [
-            {
-                "id":achiev.id,
-                "achv_id": config.achv_mapped[f"{achiev.name} {achiev.tier}"],
-                "railroader":achiev.railroader.name,
-                "type":achiev.type,
-                "criteria": achiev.criteria,
-                "tier":  achiev.tier,
-                "value": achiev.value,
-                "name":achiev.name,
-                "reached_date_timestamp": achiev.reached_date_timestamp,
-                }
-            for achiev in achievs
-        ]
+        rows = (await session.execute(query.offset(offset).limit(limit))).all()
+        out = [format_achievement(achiev, roader) for achiev, roader in rows]
 
     return {"query_time": time.perf_counter() - start, "data": out}
 
 
-def format_achievements(achievs):
-    return [
-        {
-            "id": achiev.id,
-            "achv_id": config.achv_mapped[f"{achiev.name} {achiev.tier}"],
-            "railroader": achiev.railroader.name,
-            "type": achiev.type,
-            "criteria": achiev.criteria,
-            "tier": achiev.tier,
-            "value": achiev.value,
-            "name": achiev.name,
-            "reached_date_timestamp": achiev.reached_date_timestamp,
-        }
-        for achiev in achievs
-    ]
+@app.get("/avs/stats", tags=["achievements"])
+@cached(soft=30, hard=300, tables=("logrun", "npcencounter"))
+@admitted("cheap")
+async def fetch_avs_stats(histogram: bool = False):
+    # Holders and first/last reach per achv_id from the writer's counters, histogram adds the daily reach counts.
+    # seeded is false until the RebuildAvStats backfill ran, the counters then only cover recent achievements.
+    start = time.perf_counter()
+    out = await avstats.rarity(histogram)
+    seeded = await avstats.seeded()
+    return {"query_time": time.perf_counter() - start, "seeded": seeded, "count": len(out), "data": out}
+
+
+@app.get("/stream", tags=["achievements"])
+async def stream_events(
+    request: Request,
+    type: str = Query(default=None, description="comma separated, any of logrun, npcencounter, logtip, achievement"),
+    railroader: str = None,
+    station: str = None,
+    century: str = None,
+    last_event_id: str = None,
+):
+    return feed.response(request, type, railroader, station, century, last_event_id)
@@ -1,24 +1,30 @@
-import os
+import csv
+import io
 import time
-from collections import Counter
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 
-import aioredis
-from fastapi import Depends, FastAPI, Query
+import orjson
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
-from sqlalchemy import String, cast, desc, func
-from sqlalchemy.dialects.postgresql import array
-from sqlalchemy.future import select
-from sqlalchemy.orm import lazyload, joinedload, selectinload
-from sqlalchemy.orm.session import Session
-from sqlmodel import Session, select
+from sqlalchemy import desc, func, text
+from sqlalchemy.orm import joinedload, load_only, noload, selectinload
+from sqlmodel import select
 
+import archive
+import atomic
 import config
-from db import engine, get_session, query_raw
-from models import Asset, Buyfuel, Logrun, Logtip, Npcencounter, Template, Usefuel
+import feed
+import leaderboard
+import partials
+import warmer
+from admission import ClientMiddleware, admitted, admitted_stream
+from apicache import cached, conditional_response, encode
+from cachetool import abroker, aconn
+from db import CursorError, FieldError, keyset, next_cursor, parse_fields, query_raw, read_session, stream_raw
+from hotwindow import window
+from httpcache import HttpCacheMiddleware, etag_of
+from models import Buyfuel, Logrun, LogrunTipsLink, Logtip, Npcencounter, Template, Usefuel
 
 app = FastAPI(
     title="Train Century History API",
@@ -34,174 +40,317 @@ app.add_middleware(
     allow_origins=origins,
     allow_methods=["GET"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(HttpCacheMiddleware)
+app.add_middleware(ClientMiddleware)
 
 
 @app.on_event("startup")
-def on_startup():
+async def start_cache_warmer():
+    warmer.start(app)
+    window.start()
+
+
+@app.exception_handler(CursorError)
+async def cursor_error_handler(request: Request, exc: CursorError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(FieldError)
+async def field_error_handler(request: Request, exc: FieldError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+def by_timeframe(params: dict) -> str:
+    # All-time aggregates scan whole tables, or the whole archive
+    return "heavy" if params.get("timeframe") == 0 else "medium"
 
-    redis = aioredis.from_url(
-        os.environ.get("CELERY_RESULT_BACKEND", "redis://redis:6379"), encoding="utf8", decode_responses=True
-    )
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
-    print("redis cache success")
+
+def by_limit(params: dict) -> str:
+    return "medium" if params["limit"] > 1000 else "cheap"
+
+
+def logrun_cost(params: dict) -> str:
+    if not params["simple"] or params["include"] is not None:
+        return "heavy" if params["limit"] > 25 else "medium"
+    return by_limit(params)
 
 
 @app.get("/status", tags=["status"])
-@cache(expire=20)
-async def get_info_and_api_status():
+@cached(soft=5, hard=60)
+async def get_info_and_api_status(estimate: bool = False):
     start = time.perf_counter()
-    query = select([func.count()])
-    with Session(engine) as session:
-        posrrr = session.query(Logrun).order_by(Logrun.action_seq.desc()).first()
-        posmr = session.query(Usefuel).order_by(Usefuel.action_seq.desc()).first()
-        countl = session.query(Logrun).count()
-        countu = session.query(Usefuel).count()
+    now = int(time.time())
+    tables = [table for tables in config.account_tables.values() for table in tables]
+
+    # Everything comes from what the writer and filler keep in redis, no scans over the action tables
+    pipe = aconn.pipeline(transaction=False)
+    for table in tables:
+        pipe.hgetall(f"watermark:{table}")
+        pipe.get(f"count:{table}")
+        pipe.get(f"count:{table}:seeded")
+    for account in config.account_tables:
+        pipe.hgetall(f"ingest:{account}")
+    state = await pipe.execute()
+    marks = {table: {k.decode(): int(v) for k, v in state[3 * i].items()} for i, table in enumerate(tables)}
+    # The writer counts from deploy on, a counter is only the table's size once SeedCounters has run
+    counts = {table: int(state[3 * i + 1] or 0) if state[3 * i + 2] else None for i, table in enumerate(tables)}
+    heads = {
+        account: {k.decode(): v.decode() for k, v in head.items()}
+        for account, head in zip(config.account_tables, state[3 * len(tables) :])
+    }
 
-    filler_info = {
-        "online": True,
-        "last_logrun": posrrr.block_time if posrrr else "None",
-        "last_usefuel": posmr.block_time if posmr else "None",
+    if estimate or None in counts.values():
+        async with read_session() as session:
+            rows = (
+                await session.execute(
+                    text("SELECT relname, reltuples::bigint FROM pg_class WHERE relname = ANY(:tables)"),
+                    {"tables": tables},
+                )
+            ).all()
+        estimates = dict(rows)
+    else:
+        estimates = {}
+
+    per_table = {
+        table: {
+            "count": counts[table],
+            "estimated_count": estimates.get(table),
+            "last_action_seq": marks[table].get("action_seq"),
+            "last_block_time": last_block_time(marks[table]),
+        }
+        for table in tables
     }
     db_info = {
-        "logrun_count": countl,
-        "logrun_last_action_seq": posrrr.action_seq if posrrr else "None",
-        "usefuel_count": countu,
-        "usefuel_last_action_seq": posmr.action_seq if posmr else "None",
+        "logrun_count": counts["logrun"] if counts["logrun"] is not None else estimates.get("logrun"),
+        "logrun_last_action_seq": marks["logrun"].get("action_seq", "None"),
+        "usefuel_count": counts["usefuel"] if counts["usefuel"] is not None else estimates.get("usefuel"),
+        "usefuel_last_action_seq": marks["usefuel"].get("action_seq", "None"),
+        "tables": per_table,
+    }
+
+    ingestion = {}
+    for account, head in heads.items():
+        committed = max((marks[table].get("block_timestamp", 0) for table in config.account_tables[account]), default=0)
+        fetched = head.get("block_time")
+        ingestion[account] = {
+            "position": int(head["pos"]) if "pos" in head else None,
+            "last_fetched_block_time": fetched,
+            "fetch_lag": now - int(datetime.fromisoformat(fetched).replace(tzinfo=timezone.utc).timestamp())
+            if fetched
+            else None,
+            "commit_lag": now - committed if committed else None,
+            "last_poll": now - int(head["polled_at"]) if "polled_at" in head else None,
+        }
+
+    filler_info = {
+        "online": bool(heads) and all("polled_at" in head for head in heads.values()),
+        "last_logrun": per_table["logrun"]["last_block_time"] or "None",
+        "last_usefuel": per_table["usefuel"]["last_block_time"] or "None",
+    }
+    queue = {"celery": await abroker.llen("celery")}
+    return {
+        "query_time": time.perf_counter() - start,
+        "data": {"filler_state": filler_info, "db_state": db_info, "ingestion": ingestion, "queue": queue},
     }
-    return {"query_time": time.perf_counter() - start, "data": {"filler_state": filler_info, "db_state": db_info}}
+
+
+def last_block_time(mark: dict):
+    if "block_timestamp" not in mark:
+        return None
+    return datetime.utcfromtimestamp(mark["block_timestamp"]).isoformat()
+
+
+@app.get("/stream", tags=["status"])
+async def stream_events(
+    request: Request,
+    type: str = Query(default=None, description="comma separated, any of logrun, npcencounter, logtip, achievement"),
+    railroader: str = None,
+    station: str = None,
+    century: str = None,
+    last_event_id: str = None,
+):
+    return feed.response(request, type, railroader, station, century, last_event_id)
+
+
+def window_start(timeframe: int) -> str:
+    return datetime.utcfromtimestamp(partials.window_floor(timeframe)).isoformat(timespec="milliseconds")
+
+
+async def group_counts(session, key, conds, limit: int = None):
+    # (key, count) pairs computed in postgres, transfer scales with distinct keys instead of runs.
+    query = select(key, func.count().label("total")).where(*conds).group_by(key).order_by(desc("total"))
+    if limit:
+        query = query.limit(limit)
+    return {k: total for k, total in (await session.execute(query)).all()}
+
+
+async def grouped_counts(session, group, key, conds):
+    query = select(group, key, func.count().label("total")).where(*conds).group_by(group, key).order_by(desc("total"))
+    out = {}
+    for g, k, total in (await session.execute(query)).all():
+        out.setdefault(g, {})[k] = total
+    return out
 
 
 @app.get("/station", tags=["stations"])
-@cache(expire=10)
+@cached(soft=30, hard=300, tables=("logrun",))
+@admitted(by_timeframe)
 async def station_owner_dashboard_query_v3(
     station: str,
     timeframe: int = 24,
 ):
     start = time.perf_counter()
+    if window.covers(timeframe):
+        out = window.station(station, timeframe)
+        return {"query_time": time.perf_counter() - start, "data": out or []}
+
     q2 = None
     q3 = None
-    with Session(engine) as session:
+    conds = [Logrun.arrive_station == station]
+    if timeframe != 0:
+        conds.append(Logrun.block_time >= window_start(timeframe))
+
+    async with read_session() as session:
 
-        qry = session.query(
+        qry = select(
             Logrun.arrive_station.label("station"),
-            func.array_agg(Logrun.station_owner).label("owner"),
             func.count(Logrun.arrive_station).label("total_transports"),
             func.sum(Logrun.station_owner_reward).label("total_reward"),
             (func.sum(Logrun.station_owner_reward) / func.count(Logrun.arrive_station)).label("avg_reward"),
-            func.array_agg(
-                array(
-                    [cast(Logrun.station_owner_reward, String), cast(Logrun.block_timestamp, String), Logrun.railroader]
-                )
-            ).label("comissions_list"),
-            func.array_agg(Logrun.railroader).label("unique_visitors"),
-            func.array_agg(Logrun.depart_station).label("refering_stations"),
-        ).filter(Logrun.arrive_station == station)
+        ).where(*conds)
+        q = (await session.execute(qry.group_by(Logrun.arrive_station))).mappings().first()
+        if not q:
+            return {"query_time": time.perf_counter() - start, "data": []}
 
-        if timeframe != 0:
-            qry = qry.filter(Logrun.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3])
+        owner = (
+            await session.execute(
+                select(Logrun.station_owner).where(*conds).order_by(Logrun.block_timestamp.desc()).limit(1)
+            )
+        ).scalar()
 
         if timeframe < 51 and timeframe > 0:
-            qry2 = session.query(
+            qry2 = select(
                 Logrun.hour_handlestamp.label("hour"),
                 func.count(Logrun.arrive_station).label("hr_transports"),
                 func.sum(Logrun.station_owner_reward).label("hr_reward"),
-                func.array_agg(Logrun.railroader).label("unique_visitors"),
-            ).filter(Logrun.arrive_station == station)
-
-            qry2 = qry2.filter(Logrun.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3])
-            q2 = qry2.group_by(Logrun.hour_handlestamp).order_by(desc("hour")).limit(2000).distinct()
+                func.count(Logrun.railroader.distinct()).label("unique_visitors"),
+            ).where(*conds)
+            qry2 = qry2.group_by(Logrun.hour_handlestamp).order_by(desc("hour")).limit(2000)
+            q2 = (await session.execute(qry2)).mappings().all()
 
         if timeframe > 50 or timeframe == 0:
-
-            qry3 = session.query(
+            qry3 = select(
                 Logrun.day_handlestamp.label("day"),
                 func.count(Logrun.arrive_station).label("day_transports"),
                 func.sum(Logrun.station_owner_reward).label("day_reward"),
-                func.array_agg(Logrun.railroader).label("unique_visitors"),
-            ).filter(Logrun.arrive_station == station)
-
-            if timeframe != 0:
-                qry3 = qry3.filter(
-                    Logrun.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3]
-                )
-            q3 = qry3.group_by(Logrun.day_handlestamp).order_by(desc("day")).limit(1000).distinct()
-
-        q = qry.group_by(Logrun.arrive_station).order_by(desc("total_transports")).first()
+                func.count(Logrun.railroader.distinct()).label("unique_visitors"),
+            ).where(*conds)
+            qry3 = qry3.group_by(Logrun.day_handlestamp).order_by(desc("day")).limit(1000)
+            q3 = (await session.execute(qry3)).mappings().all()
+
+        comissions = (
+            await session.execute(
+                select(Logrun.station_owner_reward, Logrun.block_timestamp, Logrun.railroader)
+                .where(*conds)
+                .order_by(Logrun.block_timestamp.desc())
+                .limit(config.dashboard_top_k)
+            )
+        ).all()
 
-        if q:
-            out = {
-                "station": q["station"],
-                "owner": q["owner"][-1],
-                "total_transports": q["total_transports"],
-                "total_comission": q["total_reward"] / 10000,
-                "avg_comission": q["avg_reward"] / 10000,
-                "top_visitors": Counter(q["unique_visitors"]),
-                "refering_stations": Counter(q["refering_stations"]),
-                "days": [
-                    {
-                        "day": hr["day"],
-                        "tocium": hr["day_reward"],
-                        "unique_visitors": len(set(hr["unique_visitors"])),
-                        "total_visitors": hr["day_transports"],
-                    }
-                    for hr in q3
-                ]
-                if q3
-                else [],
-                "hours": [
-                    {
-                        "hour": hr["hour"],
-                        "tocium": hr["hr_reward"],
-                        "unique_visitors": len(set(hr["unique_visitors"])),
-                        "total_visitors": hr["hr_transports"],
-                    }
-                    for hr in q2
-                ]
-                if q2
-                else [],
-                "comissions_list": [(int(c[0]), int(c[1]), c[2]) for c in q["comissions_list"]],
-            }
-        else:
-            return {"query_time": time.perf_counter() - start, "data": []}
+        out = {
+            "station": q["station"],
+            "owner": owner,
+            "total_transports": q["total_transports"],
+            "total_comission": q["total_reward"] / 10000,
+            "avg_comission": q["avg_reward"] / 10000,
+            "top_visitors": await group_counts(session, Logrun.railroader, conds, config.dashboard_top_k),
+            "refering_stations": await group_counts(session, Logrun.depart_station, conds, config.dashboard_top_k),
+            "days": [
+                {
+                    "day": hr["day"],
+                    "tocium": hr["day_reward"],
+                    "unique_visitors": hr["unique_visitors"],
+                    "total_visitors": hr["day_transports"],
+                }
+                for hr in q3
+            ]
+            if q3
+            else [],
+            "hours": [
+                {
+                    "hour": hr["hour"],
+                    "tocium": hr["hr_reward"],
+                    "unique_visitors": hr["unique_visitors"],
+                    "total_visitors": hr["hr_transports"],
+                }
+                for hr in q2
+            ]
+            if q2
+            else [],
+            "comissions_list": [(int(c[0]), int(c[1]), c[2]) for c in comissions],
+        }
 
     return {"query_time": time.perf_counter() - start, "data": out}
 
 
 @app.get("/stations", tags=["stations"])
-@cache(expire=10)
+@cached(soft=30, hard=300, tables=("logrun",))
+@admitted(by_timeframe)
 async def get_station_aggregated_and_ordered(
     owner: str = None, timeframe: int = 24, limit: int = Query(default=1000, le=1000)
 ):
     start = time.perf_counter()
-    with Session(engine) as session:
-
-        qry = session.query(
+    if timeframe == 0 and archive.available("logrun"):
+        out = await archive.alltime_stations(owner=owner, limit=limit)
+        return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
+    if window.covers(timeframe):
+        out = window.stations_board(owner, timeframe, limit)
+        return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
+
+    conds = []
+    if owner:
+        conds.append(Logrun.station_owner == owner)
+    if timeframe != 0:
+        conds.append(Logrun.block_time >= window_start(timeframe))
+
+    async with read_session() as session:
+
+        qry = select(
             Logrun.arrive_station.label("station"),
-            func.array_agg(Logrun.station_owner).label("owner"),
             func.count(Logrun.arrive_station).label("total_transports"),
             func.sum(Logrun.station_owner_reward).label("total_reward"),
             (func.sum(Logrun.station_owner_reward) / func.count(Logrun.arrive_station)).label("avg_reward"),
             func.sum(Logrun.weight).label("total_weight"),
             (func.sum(Logrun.weight) / func.count(Logrun.arrive_station)).label("avg_weight"),
-            func.array_agg(Logrun.railroader).label("roaders"),
-        )
-        if owner:
-            qry = qry.filter(Logrun.station_owner == owner)
-        if timeframe != 0:
-            qry = qry.filter(Logrun.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3])
+        ).where(*conds)
+        qry = qry.group_by(Logrun.arrive_station).order_by(desc("total_transports")).limit(limit)
+        qry = (await session.execute(qry)).mappings().all()
+
+        stations = [q["station"] for q in qry]
+        station_conds = conds + [Logrun.arrive_station.in_(stations)]
+        owners = (
+            await session.execute(
+                select(Logrun.arrive_station, Logrun.station_owner)
+                .where(*station_conds)
+                .distinct(Logrun.arrive_station)
+                .order_by(Logrun.arrive_station, Logrun.block_timestamp.desc())
+            )
+        ).all()
+        owners = dict(owners)
+        visitors = await grouped_counts(session, Logrun.arrive_station, Logrun.railroader, station_conds)
 
-        qry = qry.group_by(Logrun.arrive_station).order_by(desc("total_transports")).limit(limit).distinct()
         out = [
             {
                 "station": q["station"],
-                "owner": q["owner"][-1],
+                "owner": owners.get(q["station"]),
                 "total_transports": q["total_transports"],
                 "total_comission": q["total_reward"] / 10000,
                 "avg_comission": q["avg_reward"] / 10000,
                 "total_weight": q["total_weight"],
                 "avg_weight": q["avg_weight"],
-                "visitors": Counter(q["roaders"]),
+                "visitors": visitors.get(q["station"], {}),
             }
             for q in qry
         ]
@@ -209,117 +358,167 @@ async def get_station_aggregated_and_ordered(
     return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
 
 
+def railroader_totals():
+    return select(
+        Logrun.railroader.label("name"),
+        func.count(Logrun.arrive_station).label("total_transports"),
+        func.sum(Logrun.railroader_reward).label("total_reward"),
+        func.sum(Logrun.distance).label("total_distance"),
+        (func.sum(Logrun.railroader_reward) / func.count(Logrun.arrive_station)).label("avg_reward"),
+        func.sum(Logrun.weight).label("total_weight"),
+        (func.sum(Logrun.weight) / func.count(Logrun.arrive_station)).label("avg_weight"),
+        func.sum(Logrun.quantity).filter(Logrun.fuel_type == "DIESEL").label("total_diesel"),
+        func.sum(Logrun.quantity).filter(Logrun.fuel_type == "COAL").label("total_coal"),
+    )
+
+
+def format_railroader(q, stations):
+    return {
+        "name": q["name"],
+        "total_transports": q["total_transports"],
+        "total_distance": q["total_distance"],
+        "total_reward": q["total_reward"] / 10000,
+        "avg_reward": q["avg_reward"] / 10000,
+        "total_weight": q["total_weight"],
+        "avg_weight": q["avg_weight"],
+        "total_coal": round(q["total_coal"], 2) if q["total_coal"] else 0,
+        "avg_coal": round(q["total_coal"] / q["total_transports"], 2) if q["total_coal"] else 0,
+        "total_diesel": round(q["total_diesel"], 2) if q["total_diesel"] else 0,
+        "avg_diesel": round(q["total_diesel"] / q["total_transports"], 2) if q["total_diesel"] else 0,
+        "visited_stations": stations.get(q["name"], {}),
+    }
+
+
 @app.get("/railroader", tags=["railroaders"])
-@cache(expire=10)
+@cached(soft=30, hard=300, tables=("logrun",))
+@admitted(by_timeframe)
 async def get_railroader_dashboard(
     railroader: str = None, train: str = None, before: str = None, after: str = None, timeframe: int = 24
 ):
     start = time.perf_counter()
+    if timeframe == 0 and not before and not after and archive.available("logrun"):
+        out = await archive.alltime_railroader(railroader=railroader, train=train)
+        return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
+    if window.covers(timeframe) and not before and not after:
+        totals, stations = window.railroader(railroader, train, timeframe)
+        out = [format_railroader(q, stations) for q in totals]
+        return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
+
+    conds = []
+    if railroader:
+        conds.append(Logrun.railroader == railroader)
+    if train:
+        conds.append(Logrun.train_name == train)
+    if before:
+        conds.append(Logrun.block_time <= before)
+    if after:
+        conds.append(Logrun.block_time > after)
+    if timeframe != 0:
+        conds.append(Logrun.block_time >= window_start(timeframe))
 
-    with Session(engine) as session:
-        qry = session.query(
-            Logrun.railroader.label("name"),
-            func.count(Logrun.arrive_station).label("total_transports"),
-            func.sum(Logrun.railroader_reward).label("total_reward"),
-            func.sum(Logrun.distance).label("total_distance"),
-            (func.sum(Logrun.railroader_reward) / func.count(Logrun.arrive_station)).label("avg_reward"),
-            func.sum(Logrun.weight).label("total_weight"),
-            (func.sum(Logrun.weight) / func.count(Logrun.arrive_station)).label("avg_weight"),
-            func.array_agg(Logrun.arrive_station).label("stations"),
-            func.sum(Logrun.quantity).filter(Logrun.fuel_type == "DIESEL").label("total_diesel"),
-            func.sum(Logrun.quantity).filter(Logrun.fuel_type == "COAL").label("total_coal"),
-        )
-        if railroader:
-            qry = qry.filter(Logrun.railroader == railroader)
-        if train:
-            qry = qry.filter(Logrun.train_name == train)
-        if before:
-            qry = qry.filter(Logrun.block_time <= before)
-        if after:
-            qry = qry.filter(Logrun.block_time > after)
-        if timeframe != 0:
-            qry = qry.filter(Logrun.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3])
-
-        qry = qry.group_by(Logrun.railroader).order_by(desc("total_transports")).distinct()
+    async with read_session() as session:
+        qry = railroader_totals().where(*conds).group_by(Logrun.railroader).order_by(desc("total_transports"))
+        qry = (await session.execute(qry)).mappings().all()
+        stations = await grouped_counts(session, Logrun.railroader, Logrun.arrive_station, conds)
 
-        out = [
-            {
-                "name": q["name"],
-                "total_transports": q["total_transports"],
-                "total_distance": q["total_distance"],
-                "total_reward": q["total_reward"] / 10000,
-                "avg_reward": q["avg_reward"] / 10000,
-                "total_weight": q["total_weight"],
-                "avg_weight": q["avg_weight"],
-                "total_coal": round(q["total_coal"], 2) if q["total_coal"] else 0,
-                "avg_coal": round(q["total_coal"] / q["total_transports"], 2) if q["total_coal"] else 0,
-                "total_diesel": round(q["total_diesel"], 2) if q["total_diesel"] else 0,
-                "avg_diesel": round(q["total_diesel"] / q["total_transports"], 2) if q["total_diesel"] else 0,
-                "visited_stations": Counter(q["stations"]),
-            }
-            for q in qry
-        ]
+        out = [format_railroader(q, stations) for q in qry]
 
     return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
 
 
 @app.get("/railroaders", tags=["railroaders"])
-@cache(expire=10)
+@cached(soft=30, hard=300, tables=("logrun",))
+@admitted("medium")
 async def get_railroader_aggregated_and_ordered(
     before: str = None, after: str = None, limit: int = Query(default=1000, le=1000)
 ):
     start = time.perf_counter()
+    if window.covers(24) and not before and not after:
+        totals, stations = window.railroaders(limit)
+        out = [format_railroader(q, stations) for q in totals]
+        return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
 
-    with Session(engine) as session:
-        qry = session.query(
-            Logrun.railroader.label("name"),
-            func.count(Logrun.arrive_station).label("total_transports"),
-            func.sum(Logrun.railroader_reward).label("total_reward"),
-            func.sum(Logrun.distance).label("total_distance"),
-            (func.sum(Logrun.railroader_reward) / func.count(Logrun.arrive_station)).label("avg_reward"),
-            func.sum(Logrun.weight).label("total_weight"),
-            (func.sum(Logrun.weight) / func.count(Logrun.arrive_station)).label("avg_weight"),
-            func.array_agg(Logrun.arrive_station).label("stations"),
-            func.sum(Logrun.quantity).filter(Logrun.fuel_type == "DIESEL").label("total_diesel"),
-            func.sum(Logrun.quantity).filter(Logrun.fuel_type == "COAL").label("total_coal"),
-        )
-        if before:
-            qry = qry.filter(Logrun.block_time <= before)
-        if after:
-            qry = qry.filter(Logrun.block_time > after)
-        else:
-            qry = qry.filter(Logrun.block_time >= (datetime.utcnow() - timedelta(hours=24)).isoformat()[:-3])
+    conds = []
+    if before:
+        conds.append(Logrun.block_time <= before)
+    if after:
+        conds.append(Logrun.block_time > after)
+    else:
+        conds.append(Logrun.block_time >= window_start(24))
 
-        qry = qry.group_by(Logrun.railroader).order_by(desc("total_transports")).limit(limit).distinct()
+    async with read_session() as session:
+        qry = railroader_totals().where(*conds)
+        qry = qry.group_by(Logrun.railroader).order_by(desc("total_transports")).limit(limit)
+        qry = (await session.execute(qry)).mappings().all()
+        roader_conds = conds + [Logrun.railroader.in_([q["name"] for q in qry])]
+        stations = await grouped_counts(session, Logrun.railroader, Logrun.arrive_station, roader_conds)
 
-        out = [
-            {
-                "name": q["name"],
-                "total_transports": q["total_transports"],
-                "total_distance": q["total_distance"],
-                "total_reward": q["total_reward"] / 10000,
-                "avg_reward": q["avg_reward"] / 10000,
-                "total_weight": q["total_weight"],
-                "avg_weight": q["avg_weight"],
-                "total_coal": round(q["total_coal"], 2) if q["total_coal"] else 0,
-                "avg_coal": round(q["total_coal"] / q["total_transports"], 2) if q["total_coal"] else 0,
-                "total_diesel": round(q["total_diesel"], 2) if q["total_diesel"] else 0,
-                "avg_diesel": round(q["total_diesel"] / q["total_transports"], 2) if q["total_diesel"] else 0,
-                "visited_stations": Counter(q["stations"]),
-            }
-            for q in qry
-        ]
+        out = [format_railroader(q, stations) for q in qry]
 
     return {"query_time": time.perf_counter() - start, "count": len(out), "data": out}
 
 
-@app.get("/admin_dash", tags=["admin"])
-@cache(expire=20)
-async def get_railroader_dashboard(century: str = None, before: str = None, after: str = None, timeframe: int = 24):
+@app.get("/leaderboard", tags=["railroaders"])
+@cached(soft=5, hard=60)
+@admitted("cheap")
+async def get_leaderboard_top(
+    metric: config.LeaderboardMetric = config.LeaderboardMetric.runs,
+    timeframe: int = Query(default=0, ge=0, le=config.leaderboard_hours),
+    offset: int = 0,
+    limit: int = Query(default=100, le=1000),
+):
     start = time.perf_counter()
+    out = await leaderboard.top(metric.value, timeframe, int(time.time()), offset, limit)
+    seeded = await leaderboard.seeded()
+    return {"query_time": time.perf_counter() - start, "seeded": seeded, "count": len(out), "data": out}
+
+
+@app.get("/leaderboard/rank", tags=["railroaders"])
+@cached(soft=5, hard=60)
+@admitted("cheap")
+async def get_leaderboard_rank(
+    railroader: str,
+    metric: config.LeaderboardMetric = config.LeaderboardMetric.runs,
+    timeframe: int = Query(default=0, ge=0, le=config.leaderboard_hours),
+):
+    start = time.perf_counter()
+    out = await leaderboard.rank_of(metric.value, timeframe, int(time.time()), railroader)
+    seeded = await leaderboard.seeded()
+    return {"query_time": time.perf_counter() - start, "seeded": seeded, "data": out}
+
+
+@app.get("/leaderboard/around", tags=["railroaders"])
+@cached(soft=5, hard=60)
+@admitted("cheap")
+async def get_leaderboard_around(
+    railroader: str,
+    metric: config.LeaderboardMetric = config.LeaderboardMetric.runs,
+    timeframe: int = Query(default=0, ge=0, le=config.leaderboard_hours),
+    size: int = Query(default=5, le=50),
+):
+    start = time.perf_counter()
+    out = await leaderboard.around(metric.value, timeframe, int(time.time()), railroader, size)
+    seeded = await leaderboard.seeded()
+    return {"query_time": time.perf_counter() - start, "seeded": seeded, "count": len(out), "data": out}
+
 
-    with Session(engine) as session:
-        qry = session.query(
+@app.get("/admin_dash", tags=["admin"])
+@cached(soft=30, hard=300, tables=("logrun",))
+@admitted(by_timeframe)
+async def get_admin_dashboard(century: str = None, before: str = None, after: str = None, timeframe: int = 24):
+    start = time.perf_counter()
+    if timeframe == 0 and not before and not after and archive.available("logrun"):
+        out = await archive.alltime_admin_dash(century=century)
+        return {"query_time": time.perf_counter() - start, "data": out}
+    if window.covers(timeframe) and not before and not after:
+        out = window.admin_dash(century, timeframe)
+        return {"query_time": time.perf_counter() - start, "data": out}
+    if timeframe != 0 and not before and not after:
+        out = await partials.admin_dash(century, timeframe)
+        return {"query_time": time.perf_counter() - start, "data": out}
+
+    async with read_session() as session:
+        qry = select(
             func.count(Logrun.arrive_station).label("total_transports"),
             func.sum(Logrun.railroader_reward).label("total_reward"),
             func.sum(Logrun.distance).label("total_distance"),
@@ -328,20 +527,20 @@ async def get_railroader_dashboard(century: str = None, before: str = None, afte
             (func.sum(Logrun.weight) / func.count(Logrun.arrive_station)).label("avg_weight"),
             func.sum(Logrun.quantity).filter(Logrun.fuel_type == "DIESEL").label("total_diesel"),
             func.sum(Logrun.quantity).filter(Logrun.fuel_type == "COAL").label("total_coal"),
-            func.array_agg(Logrun.railroader).label("unique_roaders"),
-            func.array_agg(Logrun.train_name).label("unique_trains"),
+            func.count(Logrun.railroader.distinct()).label("unique_roaders"),
+            func.count(Logrun.train_name.distinct()).label("unique_trains"),
         )
         if before:
-            qry = qry.filter(Logrun.block_time <= before)
+            qry = qry.where(Logrun.block_time <= before)
         if after:
-            qry = qry.filter(Logrun.block_time > after)
+            qry = qry.where(Logrun.block_time > after)
 
         if century:
             qry = qry.where(Logrun.century == century)
         if timeframe != 0:
-            qry = qry.filter(Logrun.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3])
+            qry = qry.where(Logrun.block_time >= window_start(timeframe))
 
-        q = qry.first()
+        q = (await session.execute(qry)).mappings().first()
 
         out = {
             "total_transports": q["total_transports"],
@@ -354,29 +553,30 @@ async def get_railroader_dashboard(century: str = None, before: str = None, afte
             "avg_coal": round(q["total_coal"] / q["total_transports"], 2) if q["total_coal"] else 0,
             "total_diesel": round(q["total_diesel"], 2) if q["total_diesel"] else 0,
             "avg_diesel": round(q["total_diesel"] / q["total_transports"], 2) if q["total_diesel"] else 0,
-            "active_railroaders": len(set(q["unique_roaders"])),
-            "active_trains": len(set(q["unique_trains"])),
+            "active_railroaders": q["unique_roaders"],
+            "active_trains": q["unique_trains"],
         }
 
     return {"query_time": time.perf_counter() - start, "data": out}
 
 
 @app.get("/buyfuel_aggregate", tags=["admin"])
-@cache(expire=10)
+@cached(soft=30, hard=300, tables=("buyfuel",))
+@admitted(by_timeframe)
 async def get_aggregated_buyfuels(timeframe: int = 24, simple: bool = True):
     start = time.perf_counter()
     qry2 = None
 
-    with Session(engine) as session:
+    async with read_session() as session:
 
-        qry = session.query(
+        qry = select(
             Buyfuel.fuel_type.label("type"),
             func.count(Buyfuel.railroader).label("total_buys"),
             func.sum(Buyfuel.quantity).label("total_quantity"),
             func.sum(Buyfuel.tocium_payed).label("total_tocium_spent"),
         )
         if not simple:
-            qry2 = session.query(
+            qry2 = select(
                 Buyfuel.railroader.label("railroader"),
                 func.count(Buyfuel.railroader).filter(Buyfuel.fuel_type == "COAL").label("total_buys_coal"),
                 func.sum(Buyfuel.quantity).filter(Buyfuel.fuel_type == "COAL").label("total_coal"),
@@ -385,16 +585,13 @@ async def get_aggregated_buyfuels(timeframe: int = 24, simple: bool = True):
                 func.sum(Buyfuel.quantity).filter(Buyfuel.fuel_type == "DIESEL").label("total_diesel"),
                 func.sum(Buyfuel.tocium_payed).filter(Buyfuel.fuel_type == "DIESEL").label("total_tocium_for_diesel"),
             )
-            qry2 = (
-                qry2.filter(Buyfuel.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3])
-                .group_by(Buyfuel.railroader)
-                .all()
-            )
+            qry2 = qry2.where(Buyfuel.block_time >= window_start(timeframe)).group_by(Buyfuel.railroader)
+            qry2 = (await session.execute(qry2)).all()
 
         if timeframe != 0:
-            qry = qry.filter(Buyfuel.block_time >= (datetime.utcnow() - timedelta(hours=timeframe)).isoformat()[:-3])
+            qry = qry.where(Buyfuel.block_time >= window_start(timeframe))
 
-        qry = qry.group_by(Buyfuel.fuel_type).all()
+        qry = (await session.execute(qry.group_by(Buyfuel.fuel_type))).all()
 
         out = {"totals": qry, "railroaders": qry2 if simple else None}
 
@@ -459,8 +656,119 @@ def buildCar(car):
     return build
 
 
+logrun_simple_columns = {
+    "trx_id": Logrun.trx_id,
+    "block_time": Logrun.block_time,
+    "block_timestamp": Logrun.block_timestamp,
+    "railroader": Logrun.railroader,
+    "railroader_reward": Logrun.railroader_reward,
+    "total_tips": func.coalesce(
+        select(Logtip.total_tips)
+        .join(LogrunTipsLink, LogrunTipsLink.logtips_id == Logtip.id)
+        .where(LogrunTipsLink.logrun_id == Logrun.id)
+        .limit(1)
+        .scalar_subquery(),
+        0,
+    ).label("total_tips"),
+    "run_complete": Logrun.run_complete,
+    "run_start": Logrun.run_start,
+    "station_owner": Logrun.station_owner,
+    "station_owner_reward": Logrun.station_owner_reward,
+    "arrive_station": Logrun.arrive_station,
+    "depart_station": Logrun.depart_station,
+    "train_name": Logrun.train_name,
+    "weight": Logrun.weight,
+    "century": Logrun.century,
+    "distance": Logrun.distance,
+    "last_run_time": Logrun.last_run_time,
+    "last_run_tx": Logrun.last_run_tx,
+    "fuel_type": Logrun.fuel_type,
+    "quantity": Logrun.quantity,
+}
+logrun_simple_fields = list(logrun_simple_columns)
+
+
+logrun_full_fields = [
+    "trx_id",
+    "block_time",
+    "block_timestamp",
+    "railroader",
+    "railroader_reward",
+    "run_complete",
+    "run_start",
+    "station_owner",
+    "station_owner_reward",
+    "arrive_station",
+    "depart_station",
+    "train_name",
+    "weight",
+    "century",
+    "distance",
+    "last_run_time",
+    "last_run_tx",
+    "fuel_type",
+    "quantity",
+]
+logrun_relations = {
+    "cars": (Logrun.cars, joinedload(Logrun.cars)),
+    "locomotives": (Logrun.locomotives, joinedload(Logrun.locomotives)),
+    "conductors": (Logrun.conductors, joinedload(Logrun.conductors)),
+    "logtip": (Logrun.logtips, joinedload(Logrun.logtips)),
+    "npcencounter": (Logrun.npcs, selectinload(Logrun.npcs)),
+}
+
+
+def buildLogrun(trans, fields, relations):
+    build = {field: getattr(trans, field) for field in fields}
+    if "cars" in relations:
+        build["cars"] = [buildCar(car) for car in trans.cars]
+    if "locomotives" in relations:
+        build["locomotives"] = [
+            {
+                "name": loc.template.name,
+                "asset_id": loc.asset_id,
+                "cardid": loc.template.cardid,
+                "speed": loc.template.speed,
+                "distance": loc.template.distance,
+                "composition": loc.template.composition,
+                "rarity": loc.template.rarity,
+                "hauling_power": loc.template.hauling_power,
+                "conductor_threshold": loc.template.conductor_threshold,
+            }
+            for loc in trans.locomotives
+        ]
+    if "conductors" in relations:
+        build["conductors"] = [
+            {
+                "name": con.template.name,
+                "asset_id": con.asset_id,
+                "cardid": con.template.cardid,
+                "conductor_level": con.template.conductor_level,
+                "perk": con.template.perk,
+                "perk_boost": con.template.perk_boost,
+                "perk2": con.template.perk2,
+                "perk_boost2": con.template.perk_boost2,
+            }
+            for con in trans.conductors
+        ]
+    if "logtip" in relations:
+        build["logtip"] = (
+            {
+                "total_tips": trans.logtips[0].total_tips,
+                "before_tips": trans.logtips[0].before_tips,
+                "tips": trans.logtips[0].tips,
+            }
+            if len(trans.logtips) > 0
+            else {}
+        )
+    if "npcencounter" in relations:
+        build["npcencounter"] = trans.npcs
+    return build
+
+
 @app.get("/logrun", tags=["admin"], response_model_exclude_defaults=True)
-@cache(expire=15)
+@cached(soft=120, hard=900, tables=("logrun", "logtip"))
+@admitted(logrun_cost)
 async def get_raw_logrun_actions(
     railroader: str = None,
     arrive_station: str = None,
@@ -477,11 +785,27 @@ async def get_raw_logrun_actions(
     limit: int = Query(default=100, le=5000),
     simple: bool = True,
     order: config.OrderChoose = config.OrderChoose.desc,
+    cursor: str = None,
     resource_key: str = None,
-    session: Session = Depends(get_session),
+    fields: str = None,
+    include: str = None,
 ):
     start = time.perf_counter()
-    query = select(Logrun)
+    if include is not None:
+        simple = False
+    if simple:
+        wanted = parse_fields(fields, logrun_simple_fields)
+        query = select(
+            Logrun.id, Logrun.block_timestamp.label("cursor_timestamp"), *[logrun_simple_columns[f] for f in wanted]
+        )
+    else:
+        wanted = parse_fields(fields, logrun_full_fields)
+        relations = parse_fields(include, logrun_relations)
+        # Only the asked for columns and relationships are read, the rest are never loaded
+        query = select(Logrun).options(
+            load_only(*[getattr(Logrun, field) for field in {*wanted, "block_timestamp"}]),
+            *[loader if name in relations else noload(attr) for name, (attr, loader) in logrun_relations.items()],
+        )
     if depart_station:
         query = query.where(Logrun.depart_station == depart_station)
     if arrive_station:
@@ -506,133 +830,33 @@ async def get_raw_logrun_actions(
     if after_timestamp:
         query = query.where(Logrun.block_timestamp > after_timestamp)
 
-    if order.value == "desc":
-        query = query.order_by(Logrun.block_time.desc())
-    else:
-        query = query.order_by(Logrun.block_time)
-
-    
+    query = keyset(query, Logrun, cursor, order)
 
     if simple:
-        transports = session.exec(
-            query.options(lazyload('cars'))
-            .options(lazyload('locomotives'))
-            .options(lazyload('conductors'))
-            .options(selectinload(Logrun.logtips))
-            .offset(offset)
-            .limit(limit)
-        ).unique()
-
-        out = [
-            {
-                "trx_id": trans.trx_id,
-                # "action_seq": trans.action_seq,
-                "block_time": trans.block_time,
-                "block_timestamp": trans.block_timestamp,
-                "railroader": trans.railroader,
-                "railroader_reward": trans.railroader_reward,
-                "total_tips": trans.logtips[0].total_tips if len(trans.logtips) > 0 else 0,
-                "run_complete": trans.run_complete,
-                "run_start": trans.run_start,
-                "station_owner": trans.station_owner,
-                "station_owner_reward": trans.station_owner_reward,
-                "arrive_station": trans.arrive_station,
-                "depart_station": trans.depart_station,
-                "train_name": trans.train_name,
-                "weight": trans.weight,
-                "century": trans.century,
-                "distance": trans.distance,
-                "last_run_time": trans.last_run_time,
-                "last_run_tx": trans.last_run_tx,
-                "fuel_type": trans.fuel_type,
-                "quantity": trans.quantity,
-            }
-            for trans in transports
-        ]
+        async with read_session() as session:
+            transports = (await session.execute(query.offset(offset).limit(limit))).all()
+        out = [dict(zip(wanted, trans[2:])) for trans in transports]
+        page = next_cursor(transports, limit, timestamp="cursor_timestamp")
 
     else:
         # if resource_key == config.resource_key:
         if limit > 100:
             limit = 100
 
-        transports = session.exec(
-            query.options(joinedload(Logrun.cars))
-            .options(joinedload(Logrun.locomotives))
-            .options(joinedload(Logrun.conductors))
-            .options(joinedload(Logrun.logtips))
-            .offset(offset)
-            .limit(limit)
-        ).unique()
+        async with read_session() as session:
+            transports = (await session.execute(query.offset(offset).limit(limit))).scalars().unique().all()
 
-        out = [
-            {
-                "trx_id": trans.trx_id,
-                # "action_seq": trans.action_seq,
-                "block_time": trans.block_time,
-                "block_timestamp": trans.block_timestamp,
-                "railroader": trans.railroader,
-                "cars": [buildCar(car) for car in trans.cars],
-                "locomotives": [
-                    {
-                        "name": loc.template.name,
-                        "asset_id": loc.asset_id,
-                        "cardid": loc.template.cardid,
-                        "speed": loc.template.speed,
-                        "distance": loc.template.distance,
-                        "composition": loc.template.composition,
-                        "rarity": loc.template.rarity,
-                        "hauling_power": loc.template.hauling_power,
-                        "conductor_threshold": loc.template.conductor_threshold,
-                    }
-                    for loc in trans.locomotives
-                ],
-                "conductors": [
-                    {
-                        "name": con.template.name,
-                        "asset_id": con.asset_id,
-                        "cardid": con.template.cardid,
-                        "conductor_level": con.template.conductor_level,
-                        "perk": con.template.perk,
-                        "perk_boost": con.template.perk_boost,
-                        "perk2": con.template.perk2,
-                        "perk_boost2": con.template.perk_boost2,
-                    }
-                    for con in trans.conductors
-                ],
-                "logtip": {
-                    "total_tips": trans.logtips[0].total_tips,
-                    "before_tips": trans.logtips[0].before_tips,
-                    "tips": trans.logtips[0].tips,
-                }
-                if len(trans.logtips) > 0
-                else {},
-                "npcencounter": trans.npcs,
-                "railroader_reward": trans.railroader_reward,
-                "run_complete": trans.run_complete,
-                "run_start": trans.run_start,
-                "station_owner": trans.station_owner,
-                "station_owner_reward": trans.station_owner_reward,
-                "arrive_station": trans.arrive_station,
-                "depart_station": trans.depart_station,
-                "train_name": trans.train_name,
-                "weight": trans.weight,
-                "century": trans.century,
-                "distance": trans.distance,
-                "last_run_time": trans.last_run_time,
-                "last_run_tx": trans.last_run_tx,
-                "fuel_type": trans.fuel_type,
-                "quantity": trans.quantity,
-            }
-            for trans in transports
-        ]
+        out = [buildLogrun(trans, wanted, relations) for trans in transports]
+        page = next_cursor(transports, limit)
     # else:
     #     return {"query_time":time.perf_counter()-start,"success":False,"error":"Invalid resource_key!"}
 
-    return {"query_time": time.perf_counter() - start, "data": out}
+    return {"query_time": time.perf_counter() - start, "next_cursor": page, "data": out}
 
 
 @app.get("/usefuel", tags=["admin"])
-@cache(expire=15)
+@cached(soft=120, hard=900, tables=("usefuel",))
+@admitted(by_limit)
 async def get_raw_usefuel_actions(
     railroader: str = None,
     trx_id: str = None,
@@ -644,10 +868,12 @@ async def get_raw_usefuel_actions(
     offset: int = 0,
     limit: int = Query(default=1000, le=5000),
     order: config.OrderChoose = config.OrderChoose.desc,
+    cursor: str = None,
+    fields: str = None,
 ):
     start = time.perf_counter()
 
-    fueluses = query_raw(
+    fueluses, next_page = await query_raw(
         Usefuel,
         railroader=railroader,
         trx_id=trx_id,
@@ -659,13 +885,16 @@ async def get_raw_usefuel_actions(
         offset=offset,
         limit=limit,
         order=order,
+        cursor=cursor,
+        fields=fields,
     )
 
-    return {"query_time": time.perf_counter() - start, "data": fueluses}
+    return {"query_time": time.perf_counter() - start, "next_cursor": next_page, "data": fueluses}
 
 
 @app.get("/buyfuel", tags=["admin"])
-@cache(expire=10)
+@cached(soft=120, hard=900, tables=("buyfuel",))
+@admitted(by_limit)
 async def get_raw_buyfuel_actions(
     railroader: str = None,
     trx_id: str = None,
@@ -677,10 +906,12 @@ async def get_raw_buyfuel_actions(
     offset: int = 0,
     limit: int = Query(default=1000, le=10000),
     order: config.OrderChoose = config.OrderChoose.desc,
+    cursor: str = None,
+    fields: str = None,
 ):
     start = time.perf_counter()
 
-    buyfuel = query_raw(
+    buyfuel, next_page = await query_raw(
         Buyfuel,
         railroader=railroader,
         trx_id=trx_id,
@@ -692,13 +923,16 @@ async def get_raw_buyfuel_actions(
         offset=offset,
         limit=limit,
         order=order,
+        cursor=cursor,
+        fields=fields,
     )
 
-    return {"query_time": time.perf_counter() - start, "data": buyfuel}
+    return {"query_time": time.perf_counter() - start, "next_cursor": next_page, "data": buyfuel}
 
 
 @app.get("/npcencounter", tags=["admin"])
-@cache(expire=10)
+@cached(soft=120, hard=900, tables=("npcencounter",))
+@admitted(by_limit)
 async def get_raw_npcecnounter_actions(
     railroader: str = None,
     train: str = None,
@@ -712,10 +946,12 @@ async def get_raw_npcecnounter_actions(
     offset: int = 0,
     limit: int = Query(default=1000, le=5000),
     order: config.OrderChoose = config.OrderChoose.desc,
+    cursor: str = None,
+    fields: str = None,
 ):
     start = time.perf_counter()
 
-    npcs = query_raw(
+    npcs, next_page = await query_raw(
         Npcencounter,
         railroader=railroader,
         trx_id=trx_id,
@@ -729,14 +965,19 @@ async def get_raw_npcecnounter_actions(
         offset=offset,
         limit=limit,
         order=order,
+        cursor=cursor,
+        fields=fields,
     )
-    return {"query_time": time.perf_counter() - start, "data": npcs}
+    return {"query_time": time.perf_counter() - start, "next_cursor": next_page, "data": npcs}
+
+
+logtip_fields = ["railroader", "total_tips", "before_tips", "century", "train", "tips", "block_time", "block_timestamp"]
 
 
 @app.get("/logtips", tags=["admin"])
-@cache(expire=20)
+@cached(soft=120, hard=900, tables=("logtip",))
+@admitted(by_limit)
 async def get_raw_logtips_actions(
-    session: Session = Depends(get_session),
     railroader: str = None,
     train: str = None,
     century: str = None,
@@ -748,9 +989,15 @@ async def get_raw_logtips_actions(
     offset: int = 0,
     limit: int = Query(default=1000, le=5000),
     order: config.OrderChoose = config.OrderChoose.desc,
+    cursor: str = None,
+    fields: str = None,
 ):
     start = time.perf_counter()
-    query = select(Logtip)
+    wanted = parse_fields(fields, logtip_fields)
+    query = select(Logtip).options(
+        load_only(*[getattr(Logtip, field) for field in {*wanted, "block_timestamp"} if field != "tips"]),
+        selectinload(Logtip.tips) if "tips" in wanted else noload(Logtip.tips),
+    )
     if trx_id:
         query = query.where(Logtip.trx_id == trx_id)
     if century:
@@ -769,66 +1016,130 @@ async def get_raw_logtips_actions(
     if after_timestamp:
         query = query.where(Logtip.block_timestamp > after_timestamp)
 
-    if order.value == "desc":
-        query = query.order_by(Logtip.block_time.desc())
-    else:
-        query = query.order_by(Logtip.block_time)
-
-    tips = session.exec(query.offset(offset).limit(limit).options(selectinload(Logtip.tips))).all()
-
-    out = [
-        {
-            "railroader": tip.railroader,
-            "total_tips": tip.total_tips,
-            "before_tips": tip.before_tips,
-            "century": tip.century,
-            "train": tip.train,
-            "tips": tip.tips,
-            "block_time": tip.block_time,
-            "block_timestamp": tip.block_timestamp,
-        }
-        for tip in tips
-    ]
+    query = keyset(query, Logtip, cursor, order)
 
-    return {"query_time": time.perf_counter() - start, "data": out}
+    async with read_session() as session:
+        tips = (await session.execute(query.offset(offset).limit(limit))).scalars().all()
 
+    out = [{field: getattr(tip, field) for field in wanted} for tip in tips]
 
-@app.get("/asset", tags=["atomic"], response_model=Template, response_model_exclude_defaults=True)
-@cache(expire=10)
-async def get_template_for_asset_by_id(
-    asset_id: int,
-    session: Session = Depends(get_session),
+    return {"query_time": time.perf_counter() - start, "next_cursor": next_cursor(tips, limit), "data": out}
+
+
+export_models = {
+    "logrun": Logrun,
+    "usefuel": Usefuel,
+    "buyfuel": Buyfuel,
+    "npcencounter": Npcencounter,
+    "logtips": Logtip,
+}
+
+
+async def encode_ndjson(chunks):
+    async for chunk in chunks:
+        yield b"".join(orjson.dumps(dict(row._mapping), default=str, option=orjson.OPT_APPEND_NEWLINE) for row in chunk)
+
+
+async def encode_csv(chunks, columns):
+    buffer = io.StringIO()
+    out = csv.writer(buffer)
+    out.writerow(columns)
+    async for chunk in chunks:
+        out.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+@app.get("/export/{action}", tags=["admin"])
+async def export_raw_actions(
+    action: config.ExportAction,
+    format: config.ExportFormat = config.ExportFormat.ndjson,
+    railroader: str = None,
+    train: str = None,
+    century: str = None,
+    npc: str = None,
+    trx_id: str = None,
+    before: str = None,
+    after: str = None,
+    fuel_type: config.FuelType = None,
+    before_timestamp: int = None,
+    after_timestamp: int = None,
+    limit: int = None,
+    order: config.OrderChoose = config.OrderChoose.desc,
+    fields: str = None,
 ):
+    model = export_models[action.value]
+    columns = parse_fields(fields, model.__table__.columns.keys())
+    filters = {"train": train, "century": century, "npc": npc, "fuel_type": fuel_type}
+    unsupported = [name for name, value in filters.items() if value and not hasattr(model, name)]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"{action.value} can not be filtered by {', '.join(unsupported)}")
+
+    chunks = stream_raw(
+        model,
+        railroader=railroader,
+        trx_id=trx_id,
+        before=before,
+        after=after,
+        before_timestamp=before_timestamp,
+        after_timestamp=after_timestamp,
+        limit=limit,
+        order=order,
+        columns=columns,
+        **filters,
+    )
+    if format.value == "csv":
+        return StreamingResponse(
+            await admitted_stream("heavy", encode_csv(chunks, columns)),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={action.value}.csv"},
+        )
+    return StreamingResponse(await admitted_stream("heavy", encode_ndjson(chunks)), media_type="application/x-ndjson")
 
-    query = select(Asset)
-    if asset_id:
-        query = query.where(Asset.asset_id == str(asset_id))
 
-    asset = session.exec(query.options(selectinload(Asset.template))).first()
+def parse_ids(ids: str) -> list:
+    out = list(dict.fromkeys(key.strip() for key in ids.split(",") if key.strip()))
+    if not all(key.isdigit() for key in out):
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of numeric ids")
+    if len(out) > config.atomic_batch_max:
+        raise HTTPException(status_code=400, detail=f"at most {config.atomic_batch_max} ids per request")
+    return out
 
-    if asset.template.schema_name == "station":
-        out = {
-            "schema_name": asset.template.schema_name,
-            "template_id": asset.template_id,
-            "region": asset.region,
-            "region_id": asset.region_id,
-            "img": asset.img,
-            "name": asset.template.name,
-            "cardid": asset.template.cardid,
-            "rarity": asset.template.rarity,
-            "desc": asset.template.desc,
-        }
-    else:
-        out = asset.template
+
+async def atomic_batch(kind: str, ids: str):
+    start = time.perf_counter()
+    data = await atomic.get_many(kind, parse_ids(ids))
+    body = encode({"query_time": time.perf_counter() - start, "data": data})
+    return conditional_response(body, etag_of(encode(data)), config.atomic_max_age)
+
+
+@app.get("/assets", tags=["atomic"])
+async def get_templates_for_assets_by_ids(ids: str = Query(..., description="comma separated")):
+    return await atomic_batch("asset", ids)
+
+
+@app.get("/templates", tags=["atomic"])
+async def get_templates_by_ids(ids: str = Query(..., description="comma separated")):
+    return await atomic_batch("template", ids)
+
+
+@app.get("/asset", tags=["atomic"], response_model=Template, response_model_exclude_defaults=True)
+async def get_template_for_asset_by_id(
+    asset_id: int,
+):
+    out = (await atomic.get_many("asset", [str(asset_id)]))[str(asset_id)]
+    if out is None:
+        raise HTTPException(status_code=404, detail="asset not found")
     return out
 
 
 @app.get("/template", tags=["atomic"], response_model=Template, response_model_exclude_defaults=True)
-@cache(expire=10)
 async def get_template_by_id(
     template_id: int,
-    session: Session = Depends(get_session),
 ):
-    with Session(engine) as session:
-        template = session.get(Template, template_id)
-        return template
+    out = (await atomic.get_many("template", [str(template_id)]))[str(template_id)]
+    if out is None:
+        raise HTTPException(status_code=404, detail="template not found")
+    return out
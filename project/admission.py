@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import inspect
+import secrets
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from ipaddress import ip_address, ip_network
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException
+from sqlalchemy.exc import DBAPIError
+from starlette.datastructures import Headers
+
+import config
+from cachetool import aconn
+from db import async_reader_engine, statement_timeout
+
+# Admission control for the queries that reach postgres. Every route has a cost class
+# (config.cost_classes): a concurrency limit shared by all api workers, a statement_timeout and the
+# number of tokens it takes from the client's bucket. Clients are identified by api key when they
+# send one and by ip otherwise. Cache hits never get here, @cached sits in front of @admitted.
+
+client_id: ContextVar = ContextVar("client_id", default=None)
+
+# Slots are members of sem:{class} scored by when they lapse, so a worker dying mid query can't leak one
+acquire_slot = aconn.register_script(
+    """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+        redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+        return 1
+    end
+    return 0
+    """
+)
+
+take_tokens = aconn.register_script(
+    """
+    local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or burst)
+    local stamp = tonumber(redis.call('HGET', KEYS[1], 'stamp') or now)
+    tokens = math.min(burst, tokens + (now - stamp) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+)
+
+
+trusted_proxies = [ip_network(net.strip()) for net in config.trusted_proxies]
+
+
+def trusted(host: str) -> bool:
+    try:
+        address = ip_address(host)
+    except ValueError:
+        return False
+    return any(address in net for net in trusted_proxies)
+
+
+def client_ip(scope, headers) -> str:
+    # X-Forwarded-For only counts when a trusted proxy sent it, the client is the right-most hop that isn't one
+    peer = (scope.get("client") or ("unknown",))[0]
+    if not trusted(peer):
+        return peer
+    for hop in reversed(",".join(headers.getlist("x-forwarded-for")).split(",")):
+        hop = hop.strip()
+        if hop and not trusted(hop):
+            return hop
+    return peer
+
+
+class ClientMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            key = headers.get("x-api-key") or parse_qs(scope["query_string"].decode()).get("resource_key", [None])[0]
+            if key in config.api_keys:
+                client_id.set(f"key:{key}")
+            else:
+                client_id.set(f"ip:{client_ip(scope, headers)}")
+        await self.app(scope, receive, send)
+
+
+async def charge(client: str, cost: int):
+    quota = config.api_keys.get(client[4:], config.client_quota) if client.startswith("key:") else config.client_quota
+    allowed, left = await take_tokens(
+        keys=[f"quota:{client}"], args=[quota["rate"], quota["burst"], time.time(), cost]
+    )
+    if not allowed:
+        wait = (cost - float(left)) / quota["rate"]
+        raise HTTPException(status_code=429, detail="quota exceeded", headers={"Retry-After": str(int(wait) + 1)})
+
+
+# Per process cap on heavy queries and streams below the reader pool size, each holds a pooled connection for
+# long and the cheap routes of the same process would otherwise queue for the pool behind them
+local_slots = {"heavy": asyncio.Semaphore(max(1, async_reader_engine.sync_engine.pool.size() - 1))}
+
+
+async def acquire_local(name: str):
+    slots = local_slots.get(name)
+    if slots is None:
+        return None
+    try:
+        await asyncio.wait_for(slots.acquire(), config.admission_wait_ms / 1000)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=429, detail=f"too many {name} queries running", headers={"Retry-After": "1"})
+    return slots
+
+
+async def acquire(name: str, spec: dict) -> str:
+    token = secrets.token_hex(8)
+    lease = spec["statement_timeout_ms"] / 1000 + config.admission_lease_margin
+    deadline = time.monotonic() + config.admission_wait_ms / 1000
+    while True:
+        now = time.time()
+        if await acquire_slot(keys=[f"sem:{name}"], args=[now, spec["concurrency"], now + lease, token]):
+            return token
+        if time.monotonic() >= deadline:
+            detail = f"too many {name} queries running"
+            raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": "1"})
+        await asyncio.sleep(0.05)
+
+
+async def stream_lease(name: str, spec: dict, token: str, chunks):
+    # Holds the slot and the statement_timeout for as long as the response streams, not just until the
+    # endpoint returns. The lease is renewed per chunk so a long export keeps its slot. The process slot is only
+    # taken once the body is read, a generator that never starts can't release it.
+    lease = spec["statement_timeout_ms"] / 1000 + config.admission_lease_margin
+    statement_timeout.set(spec["statement_timeout_ms"])
+    try:
+        async with local_slots.get(name) or nullcontext():
+            async for chunk in chunks:
+                await aconn.zadd(f"sem:{name}", {token: time.time() + lease}, xx=True)
+                yield chunk
+    finally:
+        await aconn.zrem(f"sem:{name}", token)
+
+
+async def admitted_stream(name: str, chunks):
+    # For StreamingResponse bodies, charged and admitted before the headers go out
+    spec = config.cost_classes[name]
+    client = client_id.get()
+    if client:
+        await charge(client, spec["tokens"])
+    token = await acquire(name, spec)
+    return stream_lease(name, spec, token, chunks)
+
+
+def admitted(cost):
+    # cost is a class name or a function of the endpoint's arguments returning one
+    def wrapper(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def inner(*args, **kwargs):
+            if callable(cost):
+                bound = signature.bind_partial(*args, **kwargs)
+                bound.apply_defaults()
+                name = cost(bound.arguments)
+            else:
+                name = cost
+            spec = config.cost_classes[name]
+
+            client = client_id.get()
+            if client:
+                await charge(client, spec["tokens"])
+            slots = await acquire_local(name)
+            try:
+                token = await acquire(name, spec)
+            except HTTPException:
+                if slots:
+                    slots.release()
+                raise
+            timeout = statement_timeout.set(spec["statement_timeout_ms"])
+            try:
+                return await func(*args, **kwargs)
+            except DBAPIError as e:
+                if "statement timeout" in str(e.orig):
+                    raise HTTPException(status_code=503, detail=f"query exceeded the {name} time budget")
+                raise
+            finally:
+                statement_timeout.reset(timeout)
+                if slots:
+                    slots.release()
+                await aconn.zrem(f"sem:{name}", token)
+
+        return inner
+
+    return wrapper
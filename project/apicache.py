@@ -0,0 +1,249 @@
+import asyncio
+import functools
+import inspect
+import random
+import secrets
+import time
+from enum import Enum
+
+import orjson
+from fastapi import HTTPException, Response
+from fastapi.params import Depends, Param
+from sqlalchemy.engine import Row
+from sqlmodel import SQLModel
+
+import config
+from cachetool import aconn
+from httpcache import accepted_encoding, compress, etag_of
+
+# Endpoints return plain dicts, those are encoded once with orjson and the encoded bytes are what
+# gets cached in redis, a cache hit goes straight back to the client without decoding.
+#
+# Each entry is a hash {body, fresh_until, version, stored_at}. Until fresh_until the body is served as is, after
+# that it is served stale while the one worker holding lock:{key} recomputes it. The hash itself expires
+# at the hard ttl, both deadlines get jitter so keys written together don't all expire together.
+#
+# Bodies are stored with their ETag and, above config.compress_min_bytes, precompressed as body:gzip and
+# body:br. A hit is sent in the client's encoding as is, httpcache.HttpCacheMiddleware answers the 304s.
+#
+# Routes that pass tables= also store the writer watermarks of those tables (see cachetool.set_watermark)
+# as the version. Once the writer commits to one of them the entry counts as stale like after its soft ttl:
+# it is still served until the hard ttl while one worker recomputes it, so those routes can use a long soft
+# ttl that only bounds the drift of their time windows.
+
+release_lock = aconn.register_script(
+    """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+)
+
+extend_lock = aconn.register_script(
+    """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+)
+
+# Background refreshes, referenced here so the event loop doesn't drop them half way.
+refreshing = set()
+
+
+def default(obj):
+    if isinstance(obj, SQLModel):
+        return obj.dict()
+    if isinstance(obj, Row):
+        return obj._asdict()
+    raise TypeError(f"{type(obj)} is not serializable")
+
+
+def encode(payload) -> bytes:
+    return orjson.dumps(payload, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def conditional_response(body: bytes, tag: str, max_age: int) -> Response:
+    return Response(
+        body, media_type="application/json", headers={"ETag": tag, "Cache-Control": f"public, max-age={max_age}"}
+    )
+
+
+def prepare(body: bytes) -> dict:
+    entry = {b"body": body, b"etag": etag_of(body).encode()}
+    if len(body) >= config.compress_min_bytes:
+        for encoding in ("gzip", "br"):
+            entry[f"body:{encoding}".encode()] = compress(encoding, body)
+    return entry
+
+
+def entry_response(entry: dict, current: bool = True) -> Response:
+    # An entry from before the latest write is not cacheable downstream, whatever its soft ttl says
+    max_age = max(0, int(float(entry[b"fresh_until"]) - time.time())) if current else 0
+    tag = entry[b"etag"].decode()
+    headers = {"Cache-Control": f"public, max-age={max_age}", "Vary": "Accept-Encoding"}
+    encoding = accepted_encoding.get()
+    body = entry.get(f"body:{encoding}".encode()) if encoding else None
+    if body is None:
+        body = entry[b"body"]
+    else:
+        headers["Content-Encoding"] = encoding
+        tag = f'{tag[:-1]}-{encoding}"'
+    headers["ETag"] = tag
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def key_params(signature, args, kwargs) -> dict:
+    bound = signature.bind_partial(*args, **kwargs)
+    bound.apply_defaults()
+    out = {}
+    for name, value in bound.arguments.items():
+        if isinstance(signature.parameters[name].default, Depends):
+            continue
+        if isinstance(value, Param):
+            value = value.default
+        out[name] = value.value if isinstance(value, Enum) else value
+    return out
+
+
+def call_params(signature, params: dict) -> dict:
+    # What FastAPI would pass for a request with only these query params set.
+    bound = signature.bind_partial(**params)
+    bound.apply_defaults()
+    return {
+        name: value.default if isinstance(value, Param) else value
+        for name, value in bound.arguments.items()
+        if not isinstance(signature.parameters[name].default, Depends)
+    }
+
+
+def cache_key(func, params: dict) -> str:
+    return f"api:{func.__module__}:{func.__name__}:{orjson.dumps(params, option=orjson.OPT_SORT_KEYS).decode()}"
+
+
+def jittered(seconds: float) -> float:
+    return seconds * random.uniform(1, 1 + config.cache_jitter)
+
+
+async def lookup(key: str, tables: tuple):
+    pipe = aconn.pipeline(transaction=False)
+    pipe.hgetall(key)
+    for table in tables:
+        pipe.hget(f"watermark:{table}", "action_seq")
+    entry, *marks = await pipe.execute()
+    return entry, b",".join(mark or b"" for mark in marks)
+
+
+async def store(key: str, entry: dict, version: bytes, soft: int, hard: int) -> dict:
+    now = time.time()
+    entry = {
+        **entry,
+        b"version": version,
+        b"fresh_until": str(now + jittered(soft)).encode(),
+        b"stored_at": str(now).encode(),
+    }
+    pipe = aconn.pipeline(transaction=True)
+    pipe.delete(key)
+    pipe.hset(key, mapping=entry)
+    pipe.expire(key, int(jittered(hard)))
+    await pipe.execute()
+    return entry
+
+
+async def hold_lock(key: str, token: str):
+    # Renews lock:{key} while the recompute runs, a heavy aggregate of several statements can outlast one ttl
+    while True:
+        await asyncio.sleep(config.cache_lock_ms / 3000)
+        await extend_lock(keys=[f"lock:{key}"], args=[token, config.cache_lock_ms])
+
+
+async def recompute(key: str, token: str, version: bytes, soft: int, hard: int, func, args, kwargs) -> dict:
+    holder = asyncio.ensure_future(hold_lock(key, token))
+    try:
+        return await store(key, prepare(encode(await func(*args, **kwargs))), version, soft, hard)
+    finally:
+        holder.cancel()
+        await release_lock(keys=[f"lock:{key}"], args=[token])
+
+
+async def wait_for(key: str, since: float):
+    # Someone else is computing a missing key, poll for their result instead of piling onto the db. Any body
+    # stored after the wait started will do, the writer may have moved the watermarks on in the meantime.
+    # Gives up once the lock is gone or after a lock ttl, returns (entry, whether the lock is still held).
+    deadline = time.monotonic() + config.cache_lock_ms / 1000
+    while True:
+        await asyncio.sleep(0.05)
+        pipe = aconn.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.exists(f"lock:{key}")
+        entry, held = await pipe.execute()
+        if entry and float(entry.get(b"stored_at", 0)) >= since:
+            return entry, bool(held)
+        if not held or time.monotonic() >= deadline:
+            return None, bool(held)
+
+
+async def warm(endpoint, params: dict, ahead: float) -> bool:
+    # Refreshes the entry an endpoint would read for params, unless it stays fresh for another `ahead` seconds.
+    func = endpoint.__wrapped__
+    soft, hard, tables = endpoint.cache_options
+    signature = inspect.signature(func)
+    kwargs = call_params(signature, params)
+    key = cache_key(func, key_params(signature, (), kwargs))
+    entry, version = await lookup(key, tables)
+    if entry and entry.get(b"version", b"") == version and float(entry[b"fresh_until"]) > time.time() + ahead:
+        return False
+
+    token = secrets.token_hex(8)
+    if not await aconn.set(f"lock:{key}", token, nx=True, px=config.cache_lock_ms):
+        return False
+    await recompute(key, token, version, soft, hard, func, (), kwargs)
+    return True
+
+
+def cached(soft: int, hard: int = None, tables: tuple = ()):
+    hard = hard or soft * config.cache_hard_factor
+
+    def wrapper(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def inner(*args, **kwargs):
+            key = cache_key(func, key_params(signature, args, kwargs))
+            since = time.time()
+            entry, version = await lookup(key, tables)
+            current = entry and entry.get(b"version", b"") == version
+            if current and float(entry[b"fresh_until"]) > time.time():
+                return entry_response(entry)
+
+            # Only the lock holder ever runs func, everyone else gets the stale body or waits for the new one
+            while True:
+                token = secrets.token_hex(8)
+                if await aconn.set(f"lock:{key}", token, nx=True, px=config.cache_lock_ms):
+                    refresh = recompute(key, token, version, soft, hard, func, args, kwargs)
+                    if entry:
+                        # Stale, answer right away and let this request refresh the entry in the background.
+                        task = asyncio.ensure_future(refresh)
+                        refreshing.add(task)
+                        task.add_done_callback(refreshing.discard)
+                        return entry_response(entry, current)
+                    return entry_response(await refresh)
+
+                if entry:
+                    return entry_response(entry, current)
+                entry, held = await wait_for(key, since)
+                if entry:
+                    return entry_response(entry)
+                if held:
+                    retry = max(1, int(await aconn.pttl(f"lock:{key}")) // 1000)
+                    raise HTTPException(
+                        status_code=503, detail="response is still being computed", headers={"Retry-After": str(retry)}
+                    )
+                # The holder failed without storing anything, take the lock and compute it here
+
+        inner.cache_options = (soft, hard, tables)
+        return inner
+
+    return wrapper
@@ -0,0 +1,462 @@
+import asyncio
+import glob
+import inspect
+import os
+from datetime import datetime, timedelta
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import BigInteger, Float, cast, func
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select
+
+import config
+from db import read_engine, read_session
+from disclog import postLog
+from models import Buyfuel, Logrun, Logtip, Npcencounter, Usefuel
+
+# Sealed months of the action tables are exported to
+# {archive_path}/{table}/month=YYYY-MM/data.parquet and queried with duckdb,
+# only the unsealed tail is read from postgres.
+
+logrun_schema = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("trx_id", pa.string()),
+        ("action_seq", pa.int64()),
+        ("block_time", pa.string()),
+        ("block_timestamp", pa.int64()),
+        ("hour_handlestamp", pa.int64()),
+        ("day_handlestamp", pa.int64()),
+        ("railroader", pa.string()),
+        ("railroader_reward", pa.int64()),
+        ("run_complete", pa.int64()),
+        ("run_start", pa.int64()),
+        ("station_owner", pa.string()),
+        ("station_owner_reward", pa.int64()),
+        ("arrive_station", pa.string()),
+        ("depart_station", pa.string()),
+        ("train_name", pa.string()),
+        ("weight", pa.int64()),
+        ("century", pa.string()),
+        ("distance", pa.int64()),
+        ("last_run_time", pa.string()),
+        ("last_run_tx", pa.string()),
+        ("fuel_type", pa.string()),
+        ("quantity", pa.float64()),
+        ("locomotive_ids", pa.list_(pa.string())),
+        ("locomotive_templates", pa.list_(pa.int64())),
+        ("conductor_ids", pa.list_(pa.string())),
+        ("conductor_templates", pa.list_(pa.int64())),
+        ("railcar_ids", pa.list_(pa.string())),
+        ("load_ids", pa.list_(pa.string())),
+        ("load_types", pa.list_(pa.string())),
+        ("total_tips", pa.int64()),
+        ("npcs", pa.list_(pa.string())),
+    ]
+)
+
+usefuel_schema = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("trx_id", pa.string()),
+        ("action_seq", pa.int64()),
+        ("block_time", pa.string()),
+        ("block_timestamp", pa.int64()),
+        ("fuel_type", pa.string()),
+        ("quantity", pa.float64()),
+        ("railroader", pa.string()),
+    ]
+)
+
+buyfuel_schema = usefuel_schema.append(pa.field("century", pa.string())).append(
+    pa.field("tocium_payed", pa.float64())
+)
+
+npcencounter_schema = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("trx_id", pa.string()),
+        ("action_seq", pa.int64()),
+        ("block_time", pa.string()),
+        ("block_timestamp", pa.int64()),
+        ("century", pa.string()),
+        ("npc", pa.string()),
+        ("railroader", pa.string()),
+        ("reward", pa.float64()),
+        ("reward_symbol", pa.string()),
+        ("train", pa.string()),
+    ]
+)
+
+logtip_schema = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("trx_id", pa.string()),
+        ("action_seq", pa.int64()),
+        ("block_time", pa.string()),
+        ("block_timestamp", pa.int64()),
+        ("total_tips", pa.int64()),
+        ("before_tips", pa.int64()),
+        ("railroader", pa.string()),
+        ("century", pa.string()),
+        ("train", pa.string()),
+        ("tip_templates", pa.list_(pa.int64())),
+        ("tip_criteria", pa.list_(pa.string())),
+        ("tip_amounts", pa.list_(pa.int64())),
+    ]
+)
+
+
+def flatten_logrun(run):
+    loads = [load for car in run.cars for load in car.loads]
+    return {
+        "id": run.id,
+        "trx_id": run.trx_id,
+        "action_seq": run.action_seq,
+        "block_time": run.block_time,
+        "block_timestamp": run.block_timestamp,
+        "hour_handlestamp": run.hour_handlestamp,
+        "day_handlestamp": run.day_handlestamp,
+        "railroader": run.railroader,
+        "railroader_reward": run.railroader_reward,
+        "run_complete": run.run_complete,
+        "run_start": run.run_start,
+        "station_owner": run.station_owner,
+        "station_owner_reward": run.station_owner_reward,
+        "arrive_station": run.arrive_station,
+        "depart_station": run.depart_station,
+        "train_name": run.train_name,
+        "weight": run.weight,
+        "century": run.century,
+        "distance": run.distance,
+        "last_run_time": run.last_run_time,
+        "last_run_tx": run.last_run_tx,
+        "fuel_type": run.fuel_type,
+        "quantity": run.quantity,
+        "locomotive_ids": [loc.asset_id for loc in run.locomotives],
+        "locomotive_templates": [loc.template_id for loc in run.locomotives],
+        "conductor_ids": [con.asset_id for con in run.conductors],
+        "conductor_templates": [con.template_id for con in run.conductors],
+        "railcar_ids": [railcar.asset_id for car in run.cars for railcar in car.car],
+        "load_ids": [load.asset_id for load in loads],
+        "load_types": [load.template.type for load in loads if load.template and load.template.type],
+        "total_tips": run.logtips[0].total_tips if len(run.logtips) > 0 else 0,
+        "npcs": [npc.npc for npc in run.npcs],
+    }
+
+
+def flatten_logtip(tip):
+    return {
+        "id": tip.id,
+        "trx_id": tip.trx_id,
+        "action_seq": tip.action_seq,
+        "block_time": tip.block_time,
+        "block_timestamp": tip.block_timestamp,
+        "total_tips": tip.total_tips,
+        "before_tips": tip.before_tips,
+        "railroader": tip.railroader,
+        "century": tip.century,
+        "train": tip.train,
+        "tip_templates": [t.template_id for t in tip.tips],
+        "tip_criteria": [t.criterion for t in tip.tips],
+        "tip_amounts": [t.amount for t in tip.tips],
+    }
+
+
+def flatten_plain(schema):
+    def flatten(row):
+        return {name: getattr(row, name) for name in schema.names}
+
+    return flatten
+
+
+archived_tables = {
+    "logrun": (Logrun, logrun_schema, flatten_logrun),
+    "usefuel": (Usefuel, usefuel_schema, flatten_plain(usefuel_schema)),
+    "buyfuel": (Buyfuel, buyfuel_schema, flatten_plain(buyfuel_schema)),
+    "npcencounter": (Npcencounter, npcencounter_schema, flatten_plain(npcencounter_schema)),
+    "logtip": (Logtip, logtip_schema, flatten_logtip),
+}
+
+
+export_options = {
+    "logrun": [selectinload(Logrun.logtips), selectinload(Logrun.npcs)],
+}
+
+
+def next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    if mon == 12:
+        return f"{year + 1}-01"
+    return f"{year}-{mon + 1:02d}"
+
+
+def month_path(table: str, month: str) -> str:
+    return os.path.join(config.archive_path, table, f"month={month}", "data.parquet")
+
+
+def archived_months(table: str) -> list:
+    paths = glob.glob(os.path.join(config.archive_path, table, "month=*", "data.parquet"))
+    return sorted(path.split("month=")[1][:7] for path in paths)
+
+
+def horizon(table: str):
+    # First month that is not in the archive, everything before it is served from parquet.
+    months = archived_months(table)
+    if not months:
+        return None
+    return next_month(months[-1])
+
+
+def export_month(session, table: str, month: str) -> int:
+    model, schema, flatten = archived_tables[table]
+    path = month_path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+
+    written = 0
+    last_id = 0
+    with pq.ParquetWriter(tmp_path, schema, compression="zstd") as parquet:
+        while True:
+            query = (
+                select(model)
+                .where(model.block_time >= month)
+                .where(model.block_time < next_month(month))
+                .where(model.id > last_id)
+                .order_by(model.id)
+                .limit(config.archive_chunk)
+                .options(*export_options.get(table, []))
+            )
+            rows = session.exec(query).all()
+            if not rows:
+                break
+            parquet.write_table(pa.Table.from_pylist([flatten(row) for row in rows], schema=schema))
+            written += len(rows)
+            last_id = rows[-1].id
+            session.expunge_all()
+
+    os.replace(tmp_path, path)
+    return written
+
+
+def sealed_months(session, table: str) -> list:
+    model = archived_tables[table][0]
+    newest = session.exec(select(model.block_time).order_by(model.id.desc()).limit(1)).first()
+    if not newest:
+        return []
+
+    # A month is sealed once the clock and the newest ingested action are archive_grace_hours past its end.
+    grace = timedelta(hours=config.archive_grace_hours)
+    cutoff = min(datetime.utcnow(), datetime.fromisoformat(newest[:19])) - grace
+    cutoff = cutoff.isoformat()
+    month = horizon(table) or config.archive_start
+    out = []
+    while next_month(month) <= cutoff:
+        out.append(month)
+        month = next_month(month)
+    return out
+
+
+def export_sealed() -> dict:
+    done = {}
+    with Session(read_engine()) as session:
+        for table in archived_tables:
+            for month in sealed_months(session, table):
+                try:
+                    done[f"{table}:{month}"] = export_month(session, table, month)
+                except Exception as e:
+                    postLog(e, "warn", f"{inspect.stack()[0][3]}:{inspect.stack()[0][2]}")
+                    # Keep the archive contiguous, retry this month on the next run.
+                    break
+    return done
+
+
+def available(table: str) -> bool:
+    return horizon(table) is not None
+
+
+async def fetch_tail(table: str, dimensions: list, measures: dict, start: str) -> pa.Table:
+    # The tail is grouped in postgres, one row per combination of dimensions with its row count `n` and the
+    # measures aggregated as given ({column: "sum" | "max"}).
+    model, schema = archived_tables[table][:2]
+    dims = [getattr(model, c) for c in dimensions]
+    aggs = [
+        cast(getattr(func, agg)(getattr(model, c)), BigInteger if pa.types.is_integer(schema.field(c).type) else Float)
+        for c, agg in measures.items()
+    ]
+    async with read_session() as session:
+        query = select(*dims, func.count(), *aggs).where(model.block_time >= start).group_by(*dims)
+        rows = (await session.execute(query)).all()
+    fields = [schema.field(c) for c in dimensions] + [pa.field("n", pa.int64())] + [schema.field(c) for c in measures]
+    names = [field.name for field in fields]
+    return pa.Table.from_pylist([dict(zip(names, row)) for row in rows], schema=pa.schema(fields))
+
+
+def query_duckdb(table: str, dimensions: list, measures: dict, tail: pa.Table, sql: str, params: list):
+    parquet_cols = ", ".join(dimensions + ["1 AS n"] + list(measures))
+    tail_cols = ", ".join(dimensions + ["n"] + list(measures))
+    con = duckdb.connect()
+    try:
+        con.register("tail", tail)
+        con.execute(
+            f"CREATE TEMP VIEW actions AS "
+            f"SELECT {parquet_cols} "
+            f"FROM read_parquet('{os.path.join(config.archive_path, table, '*', 'data.parquet')}') "
+            f"UNION ALL SELECT {tail_cols} FROM tail"
+        )
+        return con.execute(sql, params).fetchall()
+    finally:
+        con.close()
+
+
+async def run_duckdb(table: str, dimensions: list, measures: dict, sql: str, params: list = None):
+    # `sql` selects from a relation called `actions`: parquet history row by row plus the grouped postgres tail,
+    # so it counts with sum(n) and only re-aggregates the measures the way they were aggregated in the tail.
+    tail = await fetch_tail(table, dimensions, measures, horizon(table))
+    return await asyncio.to_thread(query_duckdb, table, dimensions, measures, tail, sql, params or [])
+
+
+async def alltime_admin_dash(century: str = None) -> dict:
+    where = "WHERE century = ?" if century else ""
+    rows = await run_duckdb(
+        "logrun",
+        ["railroader", "train_name", "century", "fuel_type"],
+        {"railroader_reward": "sum", "distance": "sum", "weight": "sum", "quantity": "sum"},
+        f"""
+        SELECT
+            sum(n),
+            sum(railroader_reward),
+            sum(distance),
+            sum(railroader_reward) // sum(n),
+            sum(weight),
+            sum(weight) // sum(n),
+            sum(quantity) FILTER (WHERE fuel_type = 'DIESEL'),
+            sum(quantity) FILTER (WHERE fuel_type = 'COAL'),
+            count(DISTINCT railroader),
+            count(DISTINCT train_name)
+        FROM actions {where}
+        """,
+        [century] if century else [],
+    )
+    transports, reward, distance, avg_reward, weight, avg_weight, diesel, coal, roaders, trains = rows[0]
+    return {
+        "total_transports": transports,
+        "total_distance": distance,
+        "total_reward": reward / 10000 if reward else 0,
+        "avg_reward": avg_reward / 10000 if avg_reward else 0,
+        "total_weight": weight,
+        "avg_weight": avg_weight,
+        "total_coal": round(coal, 2) if coal else 0,
+        "avg_coal": round(coal / transports, 2) if coal else 0,
+        "total_diesel": round(diesel, 2) if diesel else 0,
+        "avg_diesel": round(diesel / transports, 2) if diesel else 0,
+        "active_railroaders": roaders,
+        "active_trains": trains,
+    }
+
+
+async def alltime_stations(owner: str = None, limit: int = 1000) -> list:
+    where = "WHERE station_owner = ?" if owner else ""
+    rows = await run_duckdb(
+        "logrun",
+        ["arrive_station", "station_owner", "railroader"],
+        {"station_owner_reward": "sum", "weight": "sum", "block_timestamp": "max"},
+        f"""
+        WITH filtered AS (SELECT * FROM actions {where}),
+        top AS (
+            SELECT
+                arrive_station AS station,
+                arg_max(station_owner, block_timestamp) AS owner,
+                sum(n) AS total_transports,
+                sum(station_owner_reward) AS total_reward,
+                sum(station_owner_reward) // sum(n) AS avg_reward,
+                sum(weight) AS total_weight,
+                sum(weight) // sum(n) AS avg_weight
+            FROM filtered GROUP BY arrive_station ORDER BY total_transports DESC LIMIT ?
+        ),
+        visitors AS (
+            SELECT arrive_station AS station, railroader, sum(n) AS visits
+            FROM filtered WHERE arrive_station IN (SELECT station FROM top)
+            GROUP BY arrive_station, railroader
+        )
+        SELECT top.*, list({'k': visitors.railroader, 'v': visitors.visits})
+        FROM top JOIN visitors USING (station)
+        GROUP BY ALL ORDER BY total_transports DESC
+        """,
+        ([owner] if owner else []) + [limit],
+    )
+    return [
+        {
+            "station": station,
+            "owner": station_owner,
+            "total_transports": transports,
+            "total_comission": reward / 10000,
+            "avg_comission": avg_reward / 10000,
+            "total_weight": weight,
+            "avg_weight": avg_weight,
+            "visitors": {v["k"]: v["v"] for v in visitors},
+        }
+        for station, station_owner, transports, reward, avg_reward, weight, avg_weight, visitors in rows
+    ]
+
+
+async def alltime_railroader(railroader: str = None, train: str = None) -> list:
+    filters = []
+    params = []
+    if railroader:
+        filters.append("railroader = ?")
+        params.append(railroader)
+    if train:
+        filters.append("train_name = ?")
+        params.append(train)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    rows = await run_duckdb(
+        "logrun",
+        ["railroader", "arrive_station", "train_name", "fuel_type"],
+        {"railroader_reward": "sum", "distance": "sum", "weight": "sum", "quantity": "sum"},
+        f"""
+        WITH filtered AS (SELECT * FROM actions {where}),
+        stations AS (
+            SELECT railroader, arrive_station, sum(n) AS visits
+            FROM filtered GROUP BY railroader, arrive_station
+        ),
+        totals AS (
+            SELECT
+                railroader AS name,
+                sum(n) AS total_transports,
+                sum(railroader_reward) AS total_reward,
+                sum(distance) AS total_distance,
+                sum(railroader_reward) // sum(n) AS avg_reward,
+                sum(weight) AS total_weight,
+                sum(weight) // sum(n) AS avg_weight,
+                sum(quantity) FILTER (WHERE fuel_type = 'DIESEL') AS total_diesel,
+                sum(quantity) FILTER (WHERE fuel_type = 'COAL') AS total_coal
+            FROM filtered GROUP BY railroader
+        )
+        SELECT totals.*, list({'k': stations.arrive_station, 'v': stations.visits})
+        FROM totals JOIN stations ON stations.railroader = totals.name
+        GROUP BY ALL ORDER BY total_transports DESC
+        """,
+        params,
+    )
+    out = []
+    for name, transports, reward, distance, avg_reward, weight, avg_weight, diesel, coal, stations in rows:
+        out.append(
+            {
+                "name": name,
+                "total_transports": transports,
+                "total_distance": distance,
+                "total_reward": reward / 10000,
+                "avg_reward": avg_reward / 10000,
+                "total_weight": weight,
+                "avg_weight": avg_weight,
+                "total_coal": round(coal, 2) if coal else 0,
+                "avg_coal": round(coal / transports, 2) if coal else 0,
+                "total_diesel": round(diesel, 2) if diesel else 0,
+                "avg_diesel": round(diesel / transports, 2) if diesel else 0,
+                "visited_stations": {v["k"]: v["v"] for v in stations},
+            }
+        )
+    return out
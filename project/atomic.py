@@ -0,0 +1,93 @@
+import time
+
+import orjson
+from sqlalchemy.orm import noload, selectinload
+from sqlmodel import select
+
+import config
+from cachetool import aconn
+from db import read_session
+from models import Asset, Template
+
+# Templates and assets never change once minted, they're cached rendered in two layers: a dict per api
+# worker and atomic:{kind}:{id} in redis shared by all of them. Unknown ids are remembered in redis for a
+# short while only, the writer drops that marker when the id gets inserted.
+
+local = {}
+MISSING = b"null"
+
+
+def render_template(template: Template) -> dict:
+    return template.dict(exclude_defaults=True)
+
+
+def render_asset(asset: Asset) -> dict:
+    if asset.template.schema_name == "station":
+        out = {
+            "schema_name": asset.template.schema_name,
+            "template_id": asset.template_id,
+            "region": asset.region,
+            "region_id": asset.region_id,
+            "img": asset.img,
+            "name": asset.template.name,
+            "cardid": asset.template.cardid,
+            "rarity": asset.template.rarity,
+            "desc": asset.template.desc,
+        }
+        return {key: value for key, value in out.items() if value is not None}
+    return render_template(asset.template)
+
+
+async def load(kind: str, ids: list) -> dict:
+    async with read_session() as session:
+        if kind == "template":
+            query = (
+                select(Template)
+                .where(Template.template_id.in_([int(key) for key in ids]))
+                .options(noload(Template.assets))
+            )
+            return {str(t.template_id): render_template(t) for t in (await session.execute(query)).scalars()}
+        query = (
+            select(Asset)
+            .where(Asset.asset_id.in_(ids))
+            .options(selectinload(Asset.template).options(noload(Template.assets)))
+        )
+        return {a.asset_id: render_asset(a) for a in (await session.execute(query)).scalars() if a.template}
+
+
+def remember(kind: str, key: str, value: dict):
+    if len(local) >= config.atomic_local_size:
+        local.clear()
+    local[(kind, key)] = (time.monotonic() + config.atomic_local_ttl, value)
+
+
+async def get_many(kind: str, ids: list) -> dict:
+    out = {}
+    now = time.monotonic()
+    for key in ids:
+        hit = local.get((kind, key))
+        if hit and hit[0] > now:
+            out[key] = hit[1]
+
+    wanted = [key for key in ids if key not in out]
+    if wanted:
+        for key, raw in zip(wanted, await aconn.mget([f"atomic:{kind}:{key}" for key in wanted])):
+            if raw is None:
+                continue
+            out[key] = orjson.loads(raw)
+            if raw != MISSING:
+                remember(kind, key, out[key])
+
+    wanted = [key for key in ids if key not in out]
+    if wanted:
+        found = await load(kind, wanted)
+        pipe = aconn.pipeline(transaction=False)
+        for key in wanted:
+            out[key] = found.get(key)
+            if key in found:
+                remember(kind, key, out[key])
+                pipe.set(f"atomic:{kind}:{key}", orjson.dumps(out[key]), ex=config.atomic_ttl)
+            else:
+                pipe.set(f"atomic:{kind}:{key}", MISSING, ex=config.atomic_missing_ttl)
+        await pipe.execute()
+    return out
@@ -0,0 +1,108 @@
+import time
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+import config
+from cachetool import aconn, conn
+from db import read_engine
+from models import Achievement
+
+# Achievement rarity counters maintained by the writer, keyed by achv_id:
+#   avstats:holders              hash achv_id -> railroaders holding it
+#   avstats:first, avstats:last  hash achv_id -> earliest / latest reached_date_timestamp
+#   avstats:days:{achv_id}       hash daystamp -> achievements reached that day
+#   avstats:seeded               set once rebuild() backfilled the counters, until then they only count what the
+#                                writer recorded since it started
+
+record_reached = conn.register_script(
+    """
+    redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+    local first = redis.call('HGET', KEYS[2], ARGV[1])
+    if not first or tonumber(ARGV[2]) < tonumber(first) then
+        redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    end
+    local last = redis.call('HGET', KEYS[3], ARGV[1])
+    if not last or tonumber(ARGV[2]) > tonumber(last) then
+        redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+    end
+    redis.call('HINCRBY', KEYS[4], ARGV[3], 1)
+    """
+)
+
+
+def day_of(timestamp: int) -> int:
+    return timestamp - timestamp % 86400
+
+
+def record(av):
+    if av.achv_id is None:
+        return
+    keys = ["avstats:holders", "avstats:first", "avstats:last", f"avstats:days:{av.achv_id}"]
+    record_reached(keys=keys, args=[av.achv_id, av.reached_date_timestamp, day_of(av.reached_date_timestamp)])
+
+
+def rebuild():
+    # Backfill from the achievement table, run once by beat (RebuildAvStats). Older rows got their achv_id in
+    # migration c5d9e3f7a2b4.
+    with Session(read_engine()) as session:
+        totals = session.exec(
+            select(
+                Achievement.achv_id,
+                func.count(),
+                func.min(Achievement.reached_date_timestamp),
+                func.max(Achievement.reached_date_timestamp),
+            )
+            .where(Achievement.achv_id.isnot(None))
+            .group_by(Achievement.achv_id)
+        ).all()
+        day = Achievement.reached_date_timestamp - Achievement.reached_date_timestamp % 86400
+        days = session.exec(
+            select(Achievement.achv_id, day, func.count()).where(Achievement.achv_id.isnot(None)).group_by(
+                Achievement.achv_id, day
+            )
+        ).all()
+
+    pipe = conn.pipeline(transaction=True)
+    pipe.delete("avstats:holders", "avstats:first", "avstats:last")
+    pipe.delete(*[f"avstats:days:{achv_id}" for achv_id in config.achv_names])
+    for achv_id, holders, first, last in totals:
+        pipe.hset("avstats:holders", achv_id, holders)
+        pipe.hset("avstats:first", achv_id, first)
+        pipe.hset("avstats:last", achv_id, last)
+    for achv_id, daystamp, reached in days:
+        pipe.hset(f"avstats:days:{achv_id}", daystamp, reached)
+    pipe.set("avstats:seeded", int(time.time()))
+    pipe.execute()
+    return len(totals)
+
+
+async def seeded() -> bool:
+    return bool(await aconn.exists("avstats:seeded"))
+
+
+async def rarity(histogram: bool) -> list:
+    pipe = aconn.pipeline(transaction=False)
+    pipe.hgetall("avstats:holders")
+    pipe.hgetall("avstats:first")
+    pipe.hgetall("avstats:last")
+    if histogram:
+        for achv_id in config.achv_names:
+            pipe.hgetall(f"avstats:days:{achv_id}")
+    holders, first, last, *days = await pipe.execute()
+
+    out = []
+    for i, (achv_id, (name, tier)) in enumerate(config.achv_names.items()):
+        key = str(achv_id).encode()
+        entry = {
+            "achv_id": achv_id,
+            "name": name,
+            "tier": tier,
+            "holders": int(holders.get(key, 0)),
+            "first_reached": int(first[key]) if key in first else None,
+            "last_reached": int(last[key]) if key in last else None,
+        }
+        if histogram:
+            entry["days"] = dict(sorted((int(day), int(reached)) for day, reached in days[i].items()))
+        out.append(entry)
+    return out
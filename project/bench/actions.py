@@ -0,0 +1,142 @@
+from bench.world import World, block_time
+
+# Greymass v1 history and atomicassets shaped payloads for a bench.world.World, the way the filler and
+# scanTemplates hand them to worker.writer. Template and asset fields follow Builder.create_new_template
+# and create_new_asset, so the generated actions only reference ids the writer can resolve.
+
+
+def template_payload(template: dict) -> dict:
+    return {
+        "template_id": str(template["template_id"]),
+        "schema": {"schema_name": template["schema_name"]},
+        "immutable_data": {key: value for key, value in template.items() if key not in ("template_id", "schema_name")},
+    }
+
+
+def asset_payload(asset: dict, schema: str) -> dict:
+    immutable = {key: asset[key] for key in ("img", "region", "region_id") if key in asset}
+    return {
+        "asset_id": asset["asset_id"],
+        "template": {"template_id": str(asset["template_id"])},
+        "schema": {"schema_name": schema},
+        "immutable_data": immutable,
+    }
+
+
+def atomic_payloads(world: World) -> tuple:
+    schemas = {template["template_id"]: template["schema_name"] for template in world.templates}
+    templates = [template_payload(template) for template in world.templates]
+    assets = [asset_payload(asset, schemas[asset["template_id"]]) for asset in world.assets]
+    return templates, assets
+
+
+class Actions:
+    def __init__(self, world: World):
+        self.world = world
+        self.seqs = {"rr.century": 0, "m.century": 0}
+        self.global_seq = 0
+
+    def action(self, account: str, timestamp: int, trx_id: str, name: str, actor: str, data: dict) -> dict:
+        # Sequence numbers are given out by history() once the actions are in block order
+        block_num = timestamp * 2
+        return {
+            "global_action_seq": None,
+            "account_action_seq": None,
+            "block_num": block_num,
+            "block_time": block_time(timestamp),
+            "action_trace": {
+                "action_ordinal": 1,
+                "creator_action_ordinal": 0,
+                "receiver": account,
+                "act": {
+                    "account": account,
+                    "name": name,
+                    "authorization": [{"actor": actor, "permission": "active"}],
+                    "data": data,
+                },
+                "trx_id": trx_id,
+                "block_num": block_num,
+                "block_time": block_time(timestamp),
+            },
+        }
+
+    def for_run(self, run: dict) -> list:
+        # The departure's fuel actions on m.century, then the arrival on rr.century with tips and npcs ahead of
+        # the logrun that links them
+        train = run["train"]
+        actions = []
+        if run["buy"]:
+            quantity, tocium, trx = run["buy"]
+            data = {
+                "railroader": run["railroader"],
+                "century": run["century"],
+                "quantity": f"{quantity:.2f} {run['fuel']}",
+                "tocium": f"{tocium:.4f} TOCIUM",
+            }
+            actions.append(self.action("m.century", run["start"] - 60, trx, "buyfuel", run["railroader"], data))
+        data = {"railroader": run["railroader"], "quantity": f"{run['quantity']:.2f} {run['fuel']}"}
+        actions.append(self.action("m.century", run["start"], run["depart_trx"], "usefuel", run["railroader"], data))
+
+        if run["npc"]:
+            npc, reward = run["npc"]
+            data = {
+                "railroader": run["railroader"],
+                "century": run["century"],
+                "npc": npc,
+                "reward": f"{reward:.4f} TOCIUM",
+                "train": train["name"],
+            }
+            actions.append(self.action("rr.century", run["end"], run["trx"], "npcencounter", run["railroader"], data))
+        if run["tips"]:
+            total = sum(amount for _, _, amount in run["tips"])
+            data = {
+                "railroader": run["railroader"],
+                "century": run["century"],
+                "train": train["name"],
+                "total_tips": total,
+                "before_tips": total * 4 // 5,
+                "tips": [
+                    {"template_id": template_id, "criterion": criterion, "tip": amount}
+                    for template_id, criterion, amount in run["tips"]
+                ],
+            }
+            actions.append(self.action("rr.century", run["end"], run["trx"], "logtips", run["railroader"], data))
+
+        data = {
+            "railroader": run["railroader"],
+            "railroader_reward": run["reward"],
+            "run_start": run["start"],
+            "run_complete": run["end"],
+            "station_owner": run["owner"],
+            "station_owner_reward": run["owner_reward"],
+            "train_name": train["name"],
+            "weight": run["weight"],
+            "arrive_station": run["arrive"],
+            "depart_station": run["depart"],
+            "century": run["century"],
+            "distance": run["distance"],
+            "last_run_time": block_time(run["start"]),
+            "last_run_tx": run["depart_trx"],
+            "locomotives": [train["locomotive"]],
+            "conductors": [train["conductor"]],
+            "loads": [{"railcar_asset_id": car["railcar"], "load_ids": car["loads"]} for car in train["cars"]],
+        }
+        actions.append(self.action("rr.century", run["end"], run["trx"], "logrun", run["railroader"], data))
+        return actions
+
+    def history(self, first_day: int, days: int, runs_per_day: float, until: int) -> tuple:
+        # (runs, actions) for `days` days, actions in block order across both accounts
+        runs, actions = [], []
+        for day in range(first_day, min(first_day + days * 86400, until), 86400):
+            for run in self.world.runs_on(day, runs_per_day, until):
+                runs.append(run)
+                actions.extend(self.for_run(run))
+        # Stable, the actions of one transaction keep their order
+        actions.sort(key=lambda action: action["block_time"])
+        for action in actions:
+            account = action["action_trace"]["receiver"]
+            self.seqs[account] += 1
+            self.global_seq += 1
+            action["account_action_seq"] = self.seqs[account]
+            action["global_action_seq"] = self.global_seq
+        return runs, actions
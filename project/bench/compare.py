@@ -0,0 +1,64 @@
+import argparse
+import json
+
+# Diffs two bench.load reports, exits 1 when a route got slower than the tolerance allows:
+#   python -m bench.compare bench/results/base.json bench/results/head.json --tolerance 0.15
+
+# metric: True when lower is better
+metrics = {"p50_ms": True, "p95_ms": True, "p99_ms": True, "rps": False, "db_ms": True, "errors": True}
+# Only these fail the comparison, p99 and throughput vary too much between runs. Latencies only count the
+# successful requests, so any growth in errors fails as well.
+gated = ["p50_ms", "p95_ms", "db_ms", "errors"]
+
+
+def change(before, after) -> float:
+    if before is None or after is None:
+        return None
+    if before == 0:
+        return 0.0 if after == 0 else float("inf")
+    return (after - before) / before
+
+
+def compare(base: dict, head: dict, tolerance: float) -> list:
+    regressions = []
+    print(f"{'route':<18}" + "".join(f"{metric:>22}" for metric in metrics))
+    for name in base["routes"]:
+        if name not in head["routes"]:
+            continue
+        line = f"{name:<18}"
+        for metric, lower_is_better in metrics.items():
+            before, after = base["routes"][name].get(metric), head["routes"][name].get(metric)
+            delta = change(before, after)
+            if delta is None:
+                line += f"{'-':>22}"
+                continue
+            if metric == "errors":
+                worse = after > before
+            else:
+                worse = delta > tolerance if lower_is_better else delta < -tolerance
+            if worse and metric in gated:
+                regressions.append((name, metric, before, after))
+            line += f"{f'{before:.1f} -> {after:.1f} {delta:+.0%}' + ('!' if worse else ' '):>22}"
+        print(line)
+    if "mix" in base and "mix" in head:
+        print(f"mix rps {base['mix']['rps']} -> {head['mix']['rps']}")
+        if head["mix"]["errors"] > base["mix"]["errors"]:
+            regressions.append(("mix", "errors", base["mix"]["errors"], head["mix"]["errors"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two bench.load reports")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change, 0.15 is 15%%")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print(f"{base['meta']['commit']} -> {head['meta']['commit']}")
+    regressions = compare(base, head, args.tolerance)
+    for name, metric, before, after in regressions:
+        print(f"regression: {name} {metric} {before} -> {after}")
+    raise SystemExit(1 if regressions else 0)
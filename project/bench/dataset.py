@@ -0,0 +1,253 @@
+import argparse
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel
+
+import avstats
+import cachetool
+import leaderboard
+from bench.ledger import Ledger
+from bench.world import World, block_time
+from db import engine
+from models import (
+    Achievement,
+    Asset,
+    Buyfuel,
+    Car,
+    CarLoadLink,
+    CarRailcarLink,
+    Logrun,
+    LogrunCarLink,
+    LogrunConductorLink,
+    LogrunLocomotiveLink,
+    LogrunNpcencounterLink,
+    LogrunTipsLink,
+    Logtip,
+    Npcencounter,
+    Railroader,
+    Template,
+    Tip,
+    Usefuel,
+)
+
+# Loads a synthetic history straight into postgres, same shape as the writer produces but without the
+# per action round trips:
+#   python -m bench.dataset --reset --railroaders 500 --stations 120 --months 3
+# then sets the redis watermarks, counters, leaderboards and rarity counters the apis read.
+
+serial_tables = [Logrun, Car, Usefuel, Buyfuel, Npcencounter, Logtip, Tip, Railroader, Achievement]
+account_tables = {"rr.century": [Logrun, Npcencounter, Logtip], "m.century": [Usefuel, Buyfuel]}
+
+
+def insert(session, model, rows: list):
+    # executemany needs every row to have the same keys
+    columns = model.__table__.columns.keys()
+    for i in range(0, len(rows), 5000):
+        chunk = [{column: row.get(column) for column in columns} for row in rows[i : i + 5000]]
+        session.execute(model.__table__.insert(), chunk)
+
+
+class Loader:
+    def __init__(self, world: World):
+        self.world = world
+        self.ledger = Ledger(world)
+        self.ids = {model: 0 for model in serial_tables}
+        self.seqs = {account: 0 for account in account_tables}
+        self.heads = {}
+        self.account_heads = {}
+        self.rows = {}
+
+    def next_id(self, model) -> int:
+        self.ids[model] += 1
+        return self.ids[model]
+
+    def action(self, model, account: str, timestamp: int, **fields) -> dict:
+        self.seqs[account] += 1
+        row = {
+            "id": self.next_id(model),
+            "action_seq": self.seqs[account],
+            "block_time": block_time(timestamp),
+            "block_timestamp": timestamp,
+            **fields,
+        }
+        self.heads[model] = (row["action_seq"], timestamp)
+        self.account_heads[account] = timestamp
+        self.rows.setdefault(model, []).append(row)
+        return row
+
+    def link(self, model, **fields):
+        self.rows.setdefault(model, []).append(fields)
+
+    def add_run(self, run: dict):
+        train = run["train"]
+        if run["buy"]:
+            quantity, tocium, trx = run["buy"]
+            self.action(
+                Buyfuel,
+                "m.century",
+                run["start"] - 60,
+                trx_id=trx,
+                fuel_type=run["fuel"],
+                quantity=quantity,
+                railroader=run["railroader"],
+                century=run["century"],
+                tocium_payed=tocium,
+            )
+        self.action(
+            Usefuel,
+            "m.century",
+            run["start"],
+            trx_id=run["depart_trx"],
+            fuel_type=run["fuel"],
+            quantity=run["quantity"],
+            railroader=run["railroader"],
+        )
+
+        npc = None
+        if run["npc"]:
+            name, reward = run["npc"]
+            npc = self.action(
+                Npcencounter,
+                "rr.century",
+                run["end"],
+                trx_id=run["trx"],
+                century=run["century"],
+                npc=name,
+                railroader=run["railroader"],
+                reward=reward,
+                reward_symbol="TOCIUM",
+                train=train["name"],
+            )
+            self.ledger.npcencounter(run)
+        logtip = None
+        if run["tips"]:
+            total = sum(amount for _, _, amount in run["tips"])
+            logtip = self.action(
+                Logtip,
+                "rr.century",
+                run["end"],
+                trx_id=run["trx"],
+                total_tips=total,
+                before_tips=total * 4 // 5,
+                railroader=run["railroader"],
+                century=run["century"],
+                train=train["name"],
+            )
+            for template_id, criterion, amount in run["tips"]:
+                tip = {"id": self.next_id(Tip), "template_id": template_id, "criterion": criterion, "amount": amount}
+                self.link(Tip, logtip_id=logtip["id"], **tip)
+
+        arrived = datetime.utcfromtimestamp(run["end"])
+        logrun = self.action(
+            Logrun,
+            "rr.century",
+            run["end"],
+            trx_id=run["trx"],
+            hour_handle=arrived.strftime("20%y-%m-%dT%H:00:00.000"),
+            hour_handlestamp=run["end"] - run["end"] % 3600,
+            day_handle=arrived.strftime("20%y-%m-%dT00:00:00.000"),
+            day_handlestamp=run["end"] - run["end"] % 86400,
+            railroader=run["railroader"],
+            railroader_reward=run["reward"],
+            run_complete=run["end"],
+            run_start=run["start"],
+            station_owner=run["owner"],
+            station_owner_reward=run["owner_reward"],
+            arrive_station=run["arrive"],
+            depart_station=run["depart"],
+            train_name=train["name"],
+            weight=run["weight"],
+            century=run["century"],
+            distance=run["distance"],
+            last_run_time=block_time(run["start"]),
+            last_run_tx=run["depart_trx"],
+            fuel_type=run["fuel"],
+            quantity=run["quantity"],
+        )
+        self.link(LogrunLocomotiveLink, asset_id=train["locomotive"], logrun_id=logrun["id"])
+        self.link(LogrunConductorLink, asset_id=train["conductor"], logrun_id=logrun["id"])
+        if logtip:
+            self.link(LogrunTipsLink, logtips_id=logtip["id"], logrun_id=logrun["id"])
+        if npc:
+            self.link(LogrunNpcencounterLink, npcencounter_id=npc["id"], logrun_id=logrun["id"])
+        for index, car in enumerate(train["cars"]):
+            car_id = self.next_id(Car)
+            self.link(Car, id=car_id, index=index, type="commodity")
+            self.link(CarRailcarLink, asset_id=car["railcar"], car_id=car_id)
+            for load in car["loads"]:
+                self.link(CarLoadLink, asset_id=load, car_id=car_id)
+            self.link(LogrunCarLink, logrun_id=logrun["id"], car_id=car_id)
+        self.ledger.logrun(run)
+
+    def flush(self, session):
+        # Parents before the link tables that reference them
+        for model in [Usefuel, Buyfuel, Npcencounter, Logtip, Tip, Logrun, Car]:
+            insert(session, model, self.rows.pop(model, []))
+        for model in list(self.rows):
+            insert(session, model, self.rows.pop(model))
+        session.commit()
+
+
+def load(args):
+    started = time.perf_counter()
+    world = World(args.seed, args.railroaders, args.stations)
+    loader = Loader(world)
+
+    with Session(engine) as session:
+        if session.execute(text("SELECT to_regclass('logrun')")).scalar():
+            if not args.reset and session.execute(text("SELECT EXISTS (SELECT 1 FROM logrun)")).scalar():
+                raise SystemExit("the database already has logruns, pass --reset to replace them")
+    if args.reset:
+        SQLModel.metadata.drop_all(engine)
+        cachetool.conn.flushdb()
+    SQLModel.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        insert(session, Template, world.templates)
+        insert(session, Asset, world.assets)
+        session.commit()
+
+        now = int(time.time())
+        first_day = now - now % 86400 - args.months * 30 * 86400
+        for day in range(first_day, now, 86400):
+            for run in world.runs_on(day, args.runs_per_day, now):
+                loader.add_run(run)
+            loader.flush(session)
+            print(f"{block_time(day)[:10]} logruns: {loader.ids[Logrun]}")
+
+        insert(session, Railroader, loader.ledger.railroader_rows())
+        insert(session, Achievement, loader.ledger.achievements)
+        for model in serial_tables:
+            sequence = f"pg_get_serial_sequence('{model.__tablename__}', 'id')"
+            session.execute(text(f"SELECT setval({sequence}, {max(1, loader.ids[model])})"))
+        session.commit()
+
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE"))
+
+    for account, models in account_tables.items():
+        for model in models:
+            if model in loader.heads:
+                cachetool.set_watermark(model.__tablename__, *loader.heads[model])
+            counted = int(cachetool.conn.get(f"count:{model.__tablename__}") or 0)
+            cachetool.seed_count(model.__tablename__, loader.ids[model], counted)
+        if account in loader.account_heads:
+            cachetool.set_ingest_head(account, loader.seqs[account], block_time(loader.account_heads[account]))
+    leaderboard.rebuild()
+    avstats.rebuild()
+
+    counts = {model.__tablename__: count for model, count in loader.ids.items()}
+    print(f"loaded {counts}, took: {(time.perf_counter() - started):.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a synthetic ToC history into the configured database")
+    parser.add_argument("--railroaders", type=int, default=500)
+    parser.add_argument("--stations", type=int, default=120)
+    parser.add_argument("--months", type=int, default=3)
+    parser.add_argument("--runs-per-day", type=float, default=4, help="mean logruns per railroader and day")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true", help="drop all tables and flush redis first")
+    load(parser.parse_args())
@@ -0,0 +1,108 @@
+import config
+from worker import compareTime, cuts, days, days_av_names, days_dict, miles_av_names, miles_dict
+
+# Railroader totals and achievements following the same rules as worker.AchievementProcessor, replayed
+# in action order over generated runs. Builds the rows of a dataset without going through the writer and
+# is the reference the writer's output is checked against.
+
+
+class Ledger:
+    def __init__(self, world):
+        self.world = world
+        self.railroaders = {}
+        self.achievements = []
+
+    def new_railroader(self, name: str, timestamp: int, miles: int, npc: str = None) -> dict:
+        railroader = {
+            "id": len(self.railroaders) + 1,
+            "name": name,
+            "first_run_stamp": timestamp,
+            "total_miles": miles,
+            "total_runs": 1,
+            "conseq_day": 1,
+            "last_run_stamp": timestamp,
+            **{f"total_miles_{typ}": 0 for typ in config.commodity_types},
+            # Like the processor, a railroader first seen through an npc counts as a stranger meeting
+            "npc_encounter": 1 if npc else 0,
+            "otto_meets": 0,
+            "stranger_meets": 1 if npc else 0,
+            "reached": set(),
+        }
+        self.railroaders[name] = railroader
+        return railroader
+
+    def achieve(self, railroader: dict, timestamp: int, **fields) -> dict:
+        achievement = {
+            "id": len(self.achievements) + 1,
+            "railroader_id": railroader["id"],
+            "achv_id": config.achv_ids.get((fields["name"], fields["tier"])),
+            "reached": True,
+            "reached_date_timestamp": timestamp,
+            **fields,
+        }
+        railroader["reached"].add((fields["criteria"], fields["type"], fields["value"]))
+        self.achievements.append(achievement)
+        return achievement
+
+    def logrun(self, run: dict) -> list:
+        railroader = self.railroaders.get(run["railroader"])
+        if railroader is None:
+            self.new_railroader(run["railroader"], run["end"], run["distance"])
+            return []
+
+        reached = []
+        railroader["total_miles"] += run["distance"]
+        railroader["total_runs"] += 1
+        time_diff = compareTime(railroader["last_run_stamp"], run["end"])
+        if time_diff == 24.0:
+            railroader["conseq_day"] += 1
+        if time_diff > 24.0:
+            railroader["conseq_day"] = 1
+        railroader["last_run_stamp"] = run["end"]
+
+        for typ in dict.fromkeys(car["type"] for car in run["train"]["cars"]):
+            field = f"total_miles_{typ}"
+            old = railroader[field]
+            railroader[field] = old + run["distance"]
+            for cut in cuts:
+                if old + run["distance"] > cut and ("miles", typ, cut) not in railroader["reached"]:
+                    reached.append(
+                        self.achieve(
+                            railroader,
+                            run["end"],
+                            type=typ,
+                            criteria="miles",
+                            tier=miles_dict[str(cut)],
+                            value=cut,
+                            name=miles_av_names[typ],
+                        )
+                    )
+        for day in days:
+            if railroader["conseq_day"] > day and ("days", "conseq_days", day) not in railroader["reached"]:
+                reached.append(
+                    self.achieve(
+                        railroader,
+                        run["end"],
+                        type="conseq_days",
+                        criteria="days",
+                        tier=days_dict[str(day)],
+                        value=day,
+                        name=days_av_names[str(day)],
+                    )
+                )
+        return reached
+
+    def npcencounter(self, run: dict):
+        npc, _ = run["npc"]
+        railroader = self.railroaders.get(run["railroader"])
+        if railroader is None:
+            self.new_railroader(run["railroader"], run["end"], 0, npc)
+            return
+        railroader["npc_encounter"] += 1
+        if npc == "otto":
+            railroader["otto_meets"] += 1
+        if npc == "stranger":
+            railroader["stranger_meets"] += 1
+
+    def railroader_rows(self) -> list:
+        return [{key: value for key, value in row.items() if key != "reached"} for row in self.railroaders.values()]
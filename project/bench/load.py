@@ -0,0 +1,250 @@
+import argparse
+import copy
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+
+import requests
+from sqlalchemy import func, text
+from sqlmodel import Session, select
+
+import cachetool
+import config
+from db import engine
+from models import Asset, Logrun, Railroader, Template
+
+# Drives both apis with the traffic mix of the public dashboards and writes a JSON report:
+#   python -m bench.load --concurrency 16
+# Every route is first driven on its own from an empty response cache and with the api's cache warmer held
+# off, which is when postgres time per request is taken from pg_stat_statements. Then all routes together
+# with the weights below, warmer running. Compare reports with bench.compare.
+
+
+class Names:
+    def __init__(self, session, rng: random.Random):
+        self.rng = rng
+        self.railroaders = session.exec(select(Railroader.name).order_by(Railroader.total_runs.desc())).all()
+        self.stations = session.exec(
+            select(Logrun.arrive_station).group_by(Logrun.arrive_station).order_by(func.count().desc())
+        ).all()
+        self.owners = session.exec(select(Logrun.station_owner).distinct()).all()
+        self.trains = session.exec(select(Logrun.train_name).distinct()).all()
+        self.centuries = session.exec(select(Logrun.century).distinct()).all()
+        self.assets = session.exec(select(Asset.asset_id).limit(5000)).all()
+        self.templates = session.exec(select(Template.template_id)).all()
+
+    def popular(self, names: list) -> str:
+        # Skewed towards the front, the lists are ordered by activity
+        return names[min(int(self.rng.paretovariate(1.2)) - 1, len(names) - 1)]
+
+    def timeframe(self) -> int:
+        return self.rng.choices([1, 24, 48, 168, 720, 0], [5, 50, 10, 10, 5, 2])[0]
+
+    def ids(self, ids: list) -> str:
+        return ",".join(str(i) for i in self.rng.sample(ids, min(len(ids), self.rng.randint(1, 100))))
+
+
+# name: (app, path, weight in the mix, params)
+routes = {
+    "status": ("history", "/status", 2, lambda n: {}),
+    "station": ("history", "/station", 15, lambda n: {"station": n.popular(n.stations), "timeframe": n.timeframe()}),
+    "stations": ("history", "/stations", 10, lambda n: {"timeframe": n.timeframe()}),
+    "stations_owner": ("history", "/stations", 3, lambda n: {"owner": n.rng.choice(n.owners), "timeframe": 24}),
+    "railroader": (
+        "history",
+        "/railroader",
+        15,
+        lambda n: {"railroader": n.popular(n.railroaders), "timeframe": n.timeframe()},
+    ),
+    "railroader_train": (
+        "history",
+        "/railroader",
+        3,
+        lambda n: {"railroader": n.popular(n.railroaders), "train": n.rng.choice(n.trains), "timeframe": 24},
+    ),
+    "railroaders": ("history", "/railroaders", 5, lambda n: {}),
+    "admin_dash": (
+        "history",
+        "/admin_dash",
+        5,
+        lambda n: {"timeframe": n.timeframe(), "century": n.rng.choice(n.centuries + [None, None])},
+    ),
+    "leaderboard": ("history", "/leaderboard", 5, lambda n: {"timeframe": n.rng.choice([0, 24, 48])}),
+    "logrun": ("history", "/logrun", 8, lambda n: {"railroader": n.popular(n.railroaders), "limit": 100}),
+    "logrun_full": (
+        "history",
+        "/logrun",
+        3,
+        lambda n: {"railroader": n.popular(n.railroaders), "simple": False, "limit": 50},
+    ),
+    "logrun_station": ("history", "/logrun", 3, lambda n: {"arrive_station": n.popular(n.stations), "limit": 500}),
+    "usefuel": ("history", "/usefuel", 2, lambda n: {"railroader": n.popular(n.railroaders), "limit": 100}),
+    "buyfuel": ("history", "/buyfuel", 2, lambda n: {"railroader": n.popular(n.railroaders), "limit": 100}),
+    "npcencounter": ("history", "/npcencounter", 2, lambda n: {"railroader": n.popular(n.railroaders)}),
+    "logtips": ("history", "/logtips", 2, lambda n: {"railroader": n.popular(n.railroaders), "limit": 100}),
+    "assets": ("history", "/assets", 5, lambda n: {"ids": n.ids(n.assets)}),
+    "templates": ("history", "/templates", 2, lambda n: {"ids": n.ids(n.templates)}),
+    "roader": ("achievements", "/roader", 5, lambda n: {"railroader": n.popular(n.railroaders)}),
+    "avs": ("achievements", "/avs", 5, lambda n: {"railroader": n.popular(n.railroaders)}),
+    "avs_achv": ("achievements", "/avs", 2, lambda n: {"achv_id": n.rng.choice(list(config.achv_names))}),
+    "avs_stats": ("achievements", "/avs/stats", 1, lambda n: {}),
+}
+
+
+def percentile(ordered: list, p: float) -> float:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    ordered = sorted(ms for ms, status in samples if status < 400)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, status in samples if status >= 400),
+        "rps": round(len(samples) / elapsed, 1),
+        "p50_ms": percentile(ordered, 0.5),
+        "p95_ms": percentile(ordered, 0.95),
+        "p99_ms": percentile(ordered, 0.99),
+    }
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def db_time() -> float:
+    # Total postgres execution time so far in ms, excluding the bench's own statements
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT coalesce(sum(total_exec_time), 0) FROM pg_stat_statements WHERE query NOT ILIKE '%pg_stat%'")
+        ).scalar()
+
+
+def clear_cache():
+    for pattern in ("api:*", "lock:*", "atomic:*"):
+        for key in cachetool.conn.scan_iter(pattern, count=1000):
+            cachetool.conn.delete(key)
+
+
+def hold_warmer(seconds: float):
+    # Takes the warmer's leader lease, no api worker warms until it lapses or release_warmer() runs
+    cachetool.conn.set("warmer:leader", "bench", px=int(seconds * 1000))
+
+
+def release_warmer():
+    if cachetool.conn.get("warmer:leader") == b"bench":
+        cachetool.conn.delete("warmer:leader")
+
+
+def drive(args, names: Names, chosen: list, seconds: float) -> dict:
+    weights = [routes[name][2] for name in chosen]
+    samples = {name: [] for name in chosen}
+    deadline = time.monotonic() + seconds
+
+    def client(seed: int):
+        rng = random.Random(seed)
+        picker = copy.copy(names)
+        picker.rng = rng
+        http = requests.Session()
+        if args.api_key:
+            http.headers["X-Api-Key"] = args.api_key
+        while time.monotonic() < deadline:
+            name = rng.choices(chosen, weights)[0]
+            app, path, _, params = routes[name]
+            url = (args.history if app == "history" else args.achievements) + path
+            sent = time.perf_counter()
+            try:
+                status = http.get(url, params=params(picker), timeout=args.timeout).status_code
+            except requests.RequestException:
+                status = 599
+            samples[name].append(((time.perf_counter() - sent) * 1000, status))
+
+    threads = [threading.Thread(target=client, args=(args.seed + i,)) for i in range(args.concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return {name: summarize(route_samples, elapsed) for name, route_samples in samples.items()}
+
+
+def run(args):
+    chosen = [name for name in routes if not args.routes or name in args.routes]
+    with Session(engine) as session:
+        session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_stat_statements"))
+        session.commit()
+        names = Names(session, random.Random(args.seed))
+        rows = session.exec(select(func.count()).select_from(Logrun)).one()
+
+    report = {
+        "meta": {
+            "commit": args.label or commit(),
+            "started": int(time.time()),
+            "logruns": rows,
+            "railroaders": len(names.railroaders),
+            "concurrency": args.concurrency,
+            "route_seconds": args.route_seconds,
+            "mix_seconds": args.mix_seconds,
+            "cold": args.cold,
+            "api_key": bool(args.api_key),
+        },
+        "routes": {},
+    }
+    # A leader mid round when the lease is taken still finishes it, wait that out before counting
+    hold_warmer(args.route_seconds + 2 * config.warm_interval)
+    time.sleep(config.warm_interval)
+    try:
+        for name in chosen:
+            hold_warmer(args.route_seconds + 2 * config.warm_interval)
+            clear_cache()
+            with engine.connect() as conn:
+                conn.execute(text("SELECT pg_stat_statements_reset()"))
+            before = db_time()
+            result = drive(args, names, [name], args.route_seconds)[name]
+            result["db_ms"] = round((db_time() - before) / max(1, result["requests"]), 3)
+            report["routes"][name] = result
+            print(name, result)
+    finally:
+        release_warmer()
+
+    if args.mix_seconds:
+        if args.cold:
+            clear_cache()
+        mixed = drive(args, names, chosen, args.mix_seconds)
+        report["mix"] = {
+            "rps": round(sum(result["rps"] for result in mixed.values()), 1),
+            "errors": sum(result["errors"] for result in mixed.values()),
+            "routes": mixed,
+        }
+        print("mix", report["mix"]["rps"], "rps")
+
+    out = args.out or f"bench/results/{report['meta']['commit'] or 'latest'}.json"
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test APIhistory and APIachievements")
+    parser.add_argument("--history", default="http://history:8000")
+    parser.add_argument("--achievements", default="http://achievements:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--route-seconds", type=float, default=10)
+    parser.add_argument("--mix-seconds", type=float, default=60)
+    parser.add_argument("--routes", nargs="*", help=f"subset of: {' '.join(routes)}")
+    parser.add_argument("--cold", action="store_true", help="also clear the response caches before the mix")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--api-key", default=config.bench_api_key, help="sent as X-Api-Key, defaults to BENCH_API_KEY")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", help="recorded in the report instead of the git commit")
+    parser.add_argument("--out", help="defaults to bench/results/<commit>.json")
+    run(parser.parse_args())
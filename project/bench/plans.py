@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import inspect
+import json
+import random
+
+from sqlalchemy import event, text
+from sqlmodel import Session, select
+
+import APIachievements
+import APIhistory
+import config
+from apicache import call_params
+from bench.load import Names, commit
+from db import async_reader_engine, async_writer_engine, engine
+from models import Logrun
+
+# Runs every endpoint's postgres path against the seeded bench database, captures the SQL it sends and checks
+# EXPLAIN (ANALYZE, BUFFERS) of each statement against a recorded baseline:
+#   python -m bench.plans --record   once on a known good commit, after bench.dataset
+#   python -m bench.plans            fails on a new sequential scan of a large table or too many buffers
+# The endpoints are called without their cache and admission wrappers. The hot window is never started
+# here, and the cases avoid timeframe 0 so the parquet archive is not used either.
+
+# name: (endpoint, params)
+cases = {
+    "station_hours": (APIhistory.station_owner_dashboard_query_v3, lambda n: {"station": n.stations[0]}),
+    "station_days": (
+        APIhistory.station_owner_dashboard_query_v3,
+        lambda n: {"station": n.stations[0], "timeframe": 168},
+    ),
+    "stations": (APIhistory.get_station_aggregated_and_ordered, lambda n: {}),
+    "stations_owner": (APIhistory.get_station_aggregated_and_ordered, lambda n: {"owner": n.owners[0]}),
+    "railroader": (APIhistory.get_railroader_dashboard, lambda n: {"railroader": n.railroaders[0]}),
+    "railroader_week": (
+        APIhistory.get_railroader_dashboard,
+        lambda n: {"railroader": n.railroaders[0], "timeframe": 168},
+    ),
+    "railroader_train": (
+        APIhistory.get_railroader_dashboard,
+        lambda n: {"railroader": n.railroaders[0], "train": n.trains[0]},
+    ),
+    "railroaders": (APIhistory.get_railroader_aggregated_and_ordered, lambda n: {}),
+    "logrun_simple": (APIhistory.get_raw_logrun_actions, lambda n: {"railroader": n.railroaders[0]}),
+    "logrun_full": (
+        APIhistory.get_raw_logrun_actions,
+        lambda n: {"railroader": n.railroaders[0], "simple": False, "limit": 100},
+    ),
+    "logrun_station": (APIhistory.get_raw_logrun_actions, lambda n: {"arrive_station": n.stations[0], "limit": 500}),
+    "logrun_trx": (APIhistory.get_raw_logrun_actions, lambda n: {"trx_id": n.trx_id}),
+    "usefuel": (APIhistory.get_raw_usefuel_actions, lambda n: {"railroader": n.railroaders[0], "limit": 100}),
+    "buyfuel": (APIhistory.get_raw_buyfuel_actions, lambda n: {"railroader": n.railroaders[0], "limit": 100}),
+    "npcencounter": (APIhistory.get_raw_npcecnounter_actions, lambda n: {"railroader": n.railroaders[0]}),
+    "logtips": (APIhistory.get_raw_logtips_actions, lambda n: {"railroader": n.railroaders[0], "limit": 100}),
+    "roader": (APIachievements.fetch_roaders, lambda n: {"railroader": n.railroaders[0]}),
+    "avs": (APIachievements.fetch_avs, lambda n: {"railroader": n.railroaders[0]}),
+    "avs_achv": (APIachievements.fetch_avs, lambda n: {"achv_id": min(config.achv_names)}),
+}
+
+captured = []
+
+
+def capture(conn, cursor, statement, parameters, context, executemany):
+    if captured and statement.lstrip().upper().startswith("SELECT"):
+        captured[-1].append((statement, parameters))
+
+
+for async_engine in {async_writer_engine, async_reader_engine}:
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+
+
+async def statements(endpoint, params: dict) -> list:
+    # The statements the endpoint sends for these query params, in order
+    func = inspect.unwrap(endpoint)
+    captured.append([])
+    try:
+        await func(**call_params(inspect.signature(func), params))
+        return captured[-1]
+    finally:
+        captured.pop()
+
+
+def walk(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+async def explain(conn, statement: str, parameters, large: set) -> dict:
+    result = await conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", tuple(parameters))
+    plan = result.scalar()
+    plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+    root = plan["Plan"]
+    return {
+        "sql": " ".join(statement.split()),
+        "buffers": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0),
+        "seq_scans": sorted(
+            {node["Relation Name"] for node in walk(root) if node["Node Type"] == "Seq Scan"} & large
+        ),
+        "ms": round(plan["Execution Time"], 3),
+        "nodes": sorted({node["Node Type"] for node in walk(root)}),
+    }
+
+
+async def measure(names: Names, large: set, chosen: list) -> dict:
+    out = {}
+    async with async_writer_engine.connect() as conn:
+        for name in chosen:
+            endpoint, params = cases[name]
+            plans = [
+                await explain(conn, statement, parameters, large)
+                for statement, parameters in await statements(endpoint, params(names))
+            ]
+            out[name] = {
+                "statements": len(plans),
+                "buffers": sum(plan["buffers"] for plan in plans),
+                "seq_scans": sorted({table for plan in plans for table in plan["seq_scans"]}),
+                "ms": round(sum(plan["ms"] for plan in plans), 3),
+                "plans": plans,
+            }
+            print(name, {key: value for key, value in out[name].items() if key != "plans"})
+    return out
+
+
+def check(baseline: dict, current: dict, tolerance: float) -> list:
+    failures = []
+    for name, case in current.items():
+        if name not in baseline:
+            print(f"{name}: not in the baseline, record it")
+            continue
+        before = baseline[name]
+        for table in sorted(set(case["seq_scans"]) - set(before["seq_scans"])):
+            failures.append(f"{name}: sequential scan on {table}")
+        if case["buffers"] > before["buffers"] * (1 + tolerance):
+            failures.append(f"{name}: {case['buffers']} buffers, budget {before['buffers']}")
+        if case["statements"] != before["statements"]:
+            failures.append(f"{name}: {case['statements']} statements, was {before['statements']}")
+    return failures
+
+
+def run(args) -> int:
+    chosen = [name for name in cases if not args.cases or name in args.cases]
+    with Session(engine) as session:
+        names = Names(session, random.Random(args.seed))
+        names.trx_id = session.exec(select(Logrun.trx_id).order_by(Logrun.id.desc()).limit(1)).first()
+        logruns = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'logrun'")).scalar()
+        large = set(
+            session.execute(
+                text("SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples >= :rows"),
+                {"rows": args.large_rows},
+            ).scalars()
+        )
+    if not names.railroaders or not names.stations:
+        raise SystemExit("the database is empty, seed it with bench.dataset first")
+
+    current = asyncio.run(measure(names, large, chosen))
+    if args.record:
+        report = {"meta": {"commit": commit(), "logruns": logruns, "large_rows": args.large_rows}, "cases": current}
+        with open(args.budget, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline written to {args.budget}")
+        return 0
+
+    try:
+        with open(args.budget) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        raise SystemExit(f"no baseline at {args.budget}, run with --record on a known good commit first")
+    recorded = baseline["meta"]["logruns"]
+    if abs(logruns - recorded) > recorded * 0.1:
+        print(f"warning: baseline was recorded with {recorded} logruns, the database has {logruns}")
+    failures = check(baseline["cases"], current, args.tolerance)
+    for failure in failures:
+        print(f"regression: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the query plans of every endpoint against a baseline")
+    parser.add_argument("--budget", default="bench/plans.json", help="baseline written by --record")
+    parser.add_argument("--record", action="store_true", help="write the current plans as the baseline")
+    parser.add_argument("--cases", nargs="*", help=f"subset of: {' '.join(cases)}")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed buffer growth, 0.2 is 20%%")
+    parser.add_argument("--large-rows", type=int, default=10000, help="tables from this many rows count as large")
+    parser.add_argument("--seed", type=int, default=1)
+    raise SystemExit(run(parser.parse_args()))
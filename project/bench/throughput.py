@@ -0,0 +1,267 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+from sqlalchemy import func
+from sqlmodel import Session, SQLModel, select
+
+import cachetool
+from bench.actions import Actions, atomic_payloads
+from bench.ledger import Ledger
+from bench.world import World
+from db import engine
+from models import (
+    Achievement,
+    Buyfuel,
+    Car,
+    CarLoadLink,
+    CarRailcarLink,
+    Logrun,
+    LogrunCarLink,
+    LogrunConductorLink,
+    LogrunLocomotiveLink,
+    LogrunNpcencounterLink,
+    LogrunTipsLink,
+    Logtip,
+    Npcencounter,
+    Railroader,
+    Tip,
+    Usefuel,
+)
+from worker import writer
+
+# Pushes generated actions through worker.writer for every batch size and worker count given, and checks
+# what it wrote against the runs that were generated:
+#   python -m bench.throughput --reset --railroaders 200 --days 7 --batch-sizes 50 400 --workers 1 4
+# Every configuration starts from empty tables, use a database of its own. With more than one worker,
+# batches run concurrently like on several celery workers, so a logrun can be written before its
+# usefuel and railroader totals can race; the checks report that as mismatches.
+
+logrun_fields = [
+    "railroader",
+    "railroader_reward",
+    "station_owner",
+    "station_owner_reward",
+    "arrive_station",
+    "depart_station",
+    "train_name",
+    "century",
+    "distance",
+    "weight",
+    "fuel_type",
+    "quantity",
+    "block_timestamp",
+    "last_run_tx",
+]
+
+
+def expected_logrun(run: dict) -> tuple:
+    return (
+        run["railroader"],
+        run["reward"],
+        run["owner"],
+        run["owner_reward"],
+        run["arrive"],
+        run["depart"],
+        run["train"]["name"],
+        run["century"],
+        run["distance"],
+        run["weight"],
+        run["fuel"],
+        run["quantity"],
+        run["end"],
+        run["depart_trx"],
+    )
+
+
+def grouped(rows) -> dict:
+    out = {}
+    for key, *value in rows:
+        out.setdefault(key, []).append(tuple(value) if len(value) > 1 else value[0])
+    return {key: sorted(values) for key, values in out.items()}
+
+
+def diff(name: str, expected: dict, actual: dict, report: dict, show: int):
+    missing = [key for key in expected if key not in actual]
+    extra = [key for key in actual if key not in expected]
+    wrong = [key for key in expected if key in actual and expected[key] != actual[key]]
+    report[name] = {"expected": len(expected), "missing": len(missing), "extra": len(extra), "wrong": len(wrong)}
+    for key in wrong[:show]:
+        print(f"  {name} {key}: expected {expected[key]}, got {actual[key]}")
+
+
+def verify(runs: list, ledger: Ledger, show: int) -> dict:
+    report = {}
+    by_trx = {run["trx"]: run for run in runs}
+    with Session(engine) as session:
+        rows = session.exec(select(Logrun.trx_id, *[getattr(Logrun, field) for field in logrun_fields])).all()
+        actual = {trx: tuple(values) for trx, *values in rows}
+        diff("logrun", {trx: expected_logrun(run) for trx, run in by_trx.items()}, actual, report, show)
+
+        cars = grouped(
+            session.exec(
+                select(Logrun.trx_id, Car.index, CarRailcarLink.asset_id)
+                .join(LogrunCarLink, LogrunCarLink.logrun_id == Logrun.id)
+                .join(Car, Car.id == LogrunCarLink.car_id)
+                .join(CarRailcarLink, CarRailcarLink.car_id == Car.id)
+            ).all()
+        )
+        loads = grouped(
+            session.exec(
+                select(Logrun.trx_id, Car.index, CarLoadLink.asset_id)
+                .join(LogrunCarLink, LogrunCarLink.logrun_id == Logrun.id)
+                .join(Car, Car.id == LogrunCarLink.car_id)
+                .join(CarLoadLink, CarLoadLink.car_id == Car.id)
+            ).all()
+        )
+        expected_cars = {
+            trx: sorted((index, car["railcar"]) for index, car in enumerate(run["train"]["cars"]))
+            for trx, run in by_trx.items()
+        }
+        expected_loads = {
+            trx: sorted((index, load) for index, car in enumerate(run["train"]["cars"]) for load in car["loads"])
+            for trx, run in by_trx.items()
+        }
+        diff("logrun_cars", expected_cars, cars, report, show)
+        diff("logrun_loads", expected_loads, loads, report, show)
+
+        for name, link, part in (
+            ("logrun_locomotives", LogrunLocomotiveLink, "locomotive"),
+            ("logrun_conductors", LogrunConductorLink, "conductor"),
+        ):
+            query = select(Logrun.trx_id, link.asset_id).join(link, link.logrun_id == Logrun.id)
+            expected = {trx: [run["train"][part]] for trx, run in by_trx.items()}
+            diff(name, expected, grouped(session.exec(query).all()), report, show)
+
+        tips = grouped(
+            session.exec(
+                select(Logrun.trx_id, Tip.template_id, Tip.criterion, Tip.amount)
+                .join(LogrunTipsLink, LogrunTipsLink.logrun_id == Logrun.id)
+                .join(Tip, Tip.logtip_id == LogrunTipsLink.logtips_id)
+            ).all()
+        )
+        expected = {trx: sorted(run["tips"]) for trx, run in by_trx.items() if run["tips"]}
+        diff("logrun_tips", expected, tips, report, show)
+        npcs = grouped(
+            session.exec(
+                select(Logrun.trx_id, Npcencounter.npc)
+                .join(LogrunNpcencounterLink, LogrunNpcencounterLink.logrun_id == Logrun.id)
+                .join(Npcencounter, Npcencounter.id == LogrunNpcencounterLink.npcencounter_id)
+            ).all()
+        )
+        diff("logrun_npcs", {trx: [run["npc"][0]] for trx, run in by_trx.items() if run["npc"]}, npcs, report, show)
+
+        counts = {
+            Usefuel: len(runs),
+            Buyfuel: sum(1 for run in runs if run["buy"]),
+            Npcencounter: sum(1 for run in runs if run["npc"]),
+            Logtip: sum(1 for run in runs if run["tips"]),
+            Tip: sum(len(run["tips"]) for run in runs if run["tips"]),
+        }
+        actual = {model.__tablename__: session.exec(select(func.count()).select_from(model)).one() for model in counts}
+        diff("counts", {model.__tablename__: count for model, count in counts.items()}, actual, report, show)
+
+        columns = [column for column in Railroader.__table__.columns.keys() if column != "id"]
+        actual = {row.name: tuple(getattr(row, c) for c in columns) for row in session.exec(select(Railroader))}
+        expected = {row["name"]: tuple(row[column] for column in columns) for row in ledger.railroader_rows()}
+        diff("railroaders", expected, actual, report, show)
+
+        names = {row["id"]: row["name"] for row in ledger.railroader_rows()}
+        fields = ["name", "tier", "value", "reached_date_timestamp", "achv_id"]
+        query = (
+            select(Railroader.name, *[getattr(Achievement, field) for field in fields])
+            .select_from(Achievement)
+            .join(Railroader, Railroader.id == Achievement.railroader_id)
+        )
+        actual = grouped(session.exec(query).all())
+        expected = grouped(
+            (names[row["railroader_id"]], *[row[field] for field in fields]) for row in ledger.achievements
+        )
+        diff("achievements", expected, actual, report, show)
+    return report
+
+
+def reset():
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    cachetool.conn.flushdb()
+
+
+def fresh_connections():
+    # Forked workers must not share the parent's pooled connections
+    engine.dispose()
+
+
+def write(batch: list) -> int:
+    writer(batch, "action")
+    return len(batch)
+
+
+def measure(args, batch_size: int, workers: int) -> dict:
+    world = World(args.seed, args.railroaders, args.stations)
+    now = int(time.time())
+    first_day = now - now % 86400 - args.days * 86400
+    runs, actions = Actions(world).history(first_day, args.days, args.runs_per_day, now)
+    ledger = Ledger(world)
+    for run in runs:
+        if run["npc"]:
+            ledger.npcencounter(run)
+        ledger.logrun(run)
+
+    reset()
+    templates, assets = atomic_payloads(world)
+    writer(templates, "template")
+    writer(assets, "asset")
+    engine.dispose()
+
+    batches = [actions[i : i + batch_size] for i in range(0, len(actions), batch_size)]
+    started = time.perf_counter()
+    if workers == 1:
+        for batch in batches:
+            write(batch)
+    else:
+        with multiprocessing.get_context("fork").Pool(workers, initializer=fresh_connections) as pool:
+            for _ in pool.imap(write, batches):
+                pass
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "batch_size": batch_size,
+        "workers": workers,
+        "actions": len(actions),
+        "logruns": len(runs),
+        "seconds": round(elapsed, 2),
+        "actions_per_second": round(len(actions) / elapsed, 1),
+    }
+    print(result)
+    result["checks"] = verify(runs, ledger, args.show)
+    failed = {
+        name: check for name, check in result["checks"].items() if check["missing"] + check["extra"] + check["wrong"]
+    }
+    result["correct"] = not failed
+    print("  correct" if not failed else f"  mismatches: {failed}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure worker.writer throughput and check what it writes")
+    parser.add_argument("--railroaders", type=int, default=200)
+    parser.add_argument("--stations", type=int, default=60)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--runs-per-day", type=float, default=4)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--show", type=int, default=5, help="mismatches printed per check")
+    parser.add_argument("--reset", action="store_true", help="required, every configuration drops all tables")
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args()
+    if not args.reset:
+        raise SystemExit("this drops and recreates every table for each configuration, pass --reset to go ahead")
+
+    results = [measure(args, size, workers) for size in args.batch_sizes for workers in args.workers]
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    raise SystemExit(0 if all(result["correct"] for result in results) else 1)
@@ -0,0 +1,196 @@
+import random
+from datetime import datetime
+
+import config
+
+# A synthetic Train of the Century: templates, assets, stations and railroaders with their trains. The same seed
+# always gives the same world, the dataset loader and the action generator both build on it.
+
+centuries = ["modern", "steam"]
+fuels = ["DIESEL", "COAL"]
+npcs = ["otto", "stranger"]
+criteria = ["distance", "weight", "station", "century"]
+first_template = 100000
+first_asset = 1099500000000
+
+
+def block_time(timestamp: int) -> str:
+    return datetime.utcfromtimestamp(timestamp).isoformat(timespec="milliseconds")
+
+
+class World:
+    def __init__(self, seed: int = 1, railroaders: int = 500, stations: int = 120):
+        self.rng = random.Random(seed)
+        self.templates = []
+        self.assets = []
+        self.next_template = first_template
+        self.next_asset = first_asset
+
+        self.locomotives = [
+            self.template(
+                "locomotive",
+                fuel=fuel,
+                speed=self.rng.randint(1, 10),
+                distance=self.rng.randint(200, 2000),
+                composition="steel",
+                hauling_power=self.rng.randint(1000, 8000),
+                conductor_threshold=self.rng.randint(1, 5),
+            )
+            for fuel in fuels
+            for _ in range(4)
+        ]
+        self.conductors = [
+            self.template("conductor", perk="speed", perk_boost=self.rng.randint(1, 10), conductor_level=level)
+            for level in range(1, 6)
+        ]
+        self.commodities = {
+            typ: self.template("commodity", type=typ, volume=self.rng.randint(1, 8), weight=self.rng.randint(1, 20))
+            for typ in config.commodity_types
+        }
+        self.railcars = {
+            typ: self.template(
+                "railcar", size="medium", type="freight", capacity=self.rng.randint(8, 20), commodity_type=typ
+            )
+            for typ in config.commodity_types
+        }
+        self.passengers = [
+            self.template(
+                "passenger",
+                tip=self.rng.randint(1, 50),
+                desc="",
+                criterion=criterion,
+                threshold=self.rng.randint(1, 100),
+                home_region="Centuryville",
+                home_regionid=1,
+            )
+            for criterion in criteria
+        ]
+        station_template = self.template("station", desc="")
+
+        self.railroaders = [self.account(i) for i in range(railroaders)]
+        self.stations = []
+        for i in range(stations):
+            name = f"Station {i}"
+            self.asset(station_template, img="", region=f"Region {i % 8}", region_id=i % 8, station_name=name)
+            # Most stations belong to active railroaders, a few to accounts that never run trains
+            owner = self.rng.choice(self.railroaders) if i % 10 else self.account(railroaders + i)
+            self.stations.append({"name": name, "owner": owner, "century": centuries[i % len(centuries)]})
+
+        self.trains = {}
+        self.activity = {}
+        for railroader in self.railroaders:
+            self.trains[railroader] = [self.train(railroader, n) for n in range(1, self.rng.randint(1, 3) + 1)]
+            # Pareto activity, a few railroaders run most of the trains like on chain. Mean is 1.
+            self.activity[railroader] = min(self.rng.paretovariate(1.5) / 3, 12)
+        self.positions = {}
+        # Station popularity falls off like on chain, the first few see most of the traffic
+        self.popularity = [1 / (i + 1) for i in range(stations)]
+
+    def account(self, i: int) -> str:
+        return f"{i:05d}rr.wam"
+
+    def template(self, schema: str, **fields) -> dict:
+        template = {
+            "template_id": self.next_template,
+            "schema_name": schema,
+            "name": f"{schema} {self.next_template}",
+            "cardid": self.next_template - first_template,
+            "rarity": self.rng.choice(["common", "uncommon", "rare", "epic", "legendary"]),
+            "img": "",
+            **fields,
+        }
+        self.next_template += 1
+        self.templates.append(template)
+        return template
+
+    def asset(self, template: dict, **fields) -> str:
+        asset_id = str(self.next_asset)
+        self.next_asset += 1
+        self.assets.append({"asset_id": asset_id, "template_id": template["template_id"], **fields})
+        return asset_id
+
+    def train(self, railroader: str, n: int) -> dict:
+        locomotive = self.rng.choice(self.locomotives)
+        cars = []
+        for _ in range(self.rng.randint(1, 4)):
+            typ = self.rng.choice(config.commodity_types)
+            commodity = self.commodities[typ]
+            cars.append(
+                {
+                    "railcar": self.asset(self.railcars[typ]),
+                    "loads": [self.asset(commodity) for _ in range(self.rng.randint(1, 3))],
+                    "type": typ,
+                    "weight": commodity["weight"],
+                }
+            )
+        return {
+            "name": f"train{n}",
+            "railroader": railroader,
+            "century": self.rng.choice(centuries),
+            "fuel": locomotive["fuel"],
+            "locomotive": self.asset(locomotive),
+            "conductor": self.asset(self.rng.choice(self.conductors)),
+            "cars": cars,
+        }
+
+    def trx_id(self) -> str:
+        return f"{self.rng.getrandbits(256):064x}"
+
+    def run(self, train: dict, start: int) -> dict:
+        depart = self.positions.get(id(train)) or self.rng.choice(self.stations)
+        arrive = depart
+        while arrive is depart:
+            arrive = self.rng.choices(self.stations, self.popularity)[0]
+        self.positions[id(train)] = arrive
+        distance = self.rng.randint(50, 1200)
+        weight = sum(car["weight"] * len(car["loads"]) for car in train["cars"])
+        reward = distance * weight * self.rng.randint(8, 12)
+        quantity = round(distance * weight / 100 * self.rng.uniform(0.8, 1.2), 2)
+        run = {
+            "railroader": train["railroader"],
+            "train": train,
+            "depart": depart["name"],
+            "arrive": arrive["name"],
+            "owner": arrive["owner"],
+            "century": train["century"],
+            "distance": distance,
+            "weight": weight,
+            "reward": reward,
+            "owner_reward": reward // 10,
+            "start": start,
+            "end": start + self.rng.randint(600, 7200),
+            "fuel": train["fuel"],
+            "quantity": quantity,
+            "depart_trx": self.trx_id(),
+            "trx": self.trx_id(),
+            "tips": None,
+            "npc": None,
+            "buy": None,
+        }
+        if self.rng.random() < 0.2:
+            run["tips"] = [
+                (passenger["template_id"], passenger["criterion"], self.rng.randint(1, passenger["tip"]))
+                for passenger in self.rng.sample(self.passengers, self.rng.randint(1, 3))
+            ]
+        if self.rng.random() < 0.05:
+            run["npc"] = (self.rng.choice(npcs), round(self.rng.uniform(1, 100), 4))
+        if self.rng.random() < 0.1:
+            run["buy"] = (
+                round(quantity * self.rng.randint(2, 10), 2),
+                round(quantity * self.rng.uniform(1, 3), 4),
+                self.trx_id(),
+            )
+        return run
+
+    def runs_on(self, day: int, runs_per_day: float, until: int) -> list:
+        # Runs that arrive during the day starting at `day` and before `until`, in arrival order. Runs still
+        # travelling at midnight are dropped.
+        runs = []
+        for railroader in self.railroaders:
+            rate = self.activity[railroader] * runs_per_day
+            count = int(rate) + (self.rng.random() < rate % 1)
+            for start in sorted(self.rng.randrange(day, day + 86400) for _ in range(count)):
+                run = self.run(self.rng.choice(self.trains[railroader]), start)
+                if run["end"] < min(day + 86400, until):
+                    runs.append(run)
+        return sorted(runs, key=lambda run: run["end"])
@@ -1,8 +1,28 @@
 import json
+import os
+import time
 
+import aioredis
 import redis
 
 conn = redis.Redis(host="redis", port=6379, db=1)
+aconn = aioredis.from_url("redis://redis:6379/1")
+# The celery broker, only read for queue depth
+abroker = aioredis.from_url(os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379"))
+
+# Counts the committed row and only ever moves a table watermark forward, concurrent writers may
+# commit out of order.
+raise_watermark = conn.register_script(
+    """
+    redis.call('INCR', KEYS[2])
+    local current = tonumber(redis.call('HGET', KEYS[1], 'action_seq') or '-1')
+    if tonumber(ARGV[1]) > current then
+        redis.call('HSET', KEYS[1], 'action_seq', ARGV[1], 'block_timestamp', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+)
 
 
 def set_cache(key, value):
@@ -17,3 +37,33 @@ def get_cache(key):
     if read:
         cache = json.loads(read)
     return cache
+
+
+def set_watermark(table, action_seq, block_timestamp):
+    return raise_watermark(keys=[f"watermark:{table}", f"count:{table}"], args=[action_seq, block_timestamp])
+
+
+def seed_count(table, exact, counted):
+    # exact is a count(*) of the table and counted what count:{table} held right after it. The writer
+    # INCRs from deploy on, so the difference is added instead of overwriting increments in flight.
+    pipe = conn.pipeline(transaction=True)
+    pipe.incrby(f"count:{table}", exact - counted)
+    pipe.set(f"count:{table}:seeded", 1)
+    pipe.execute()
+
+
+def get_watermark(table):
+    read = conn.hgetall(f"watermark:{table}")
+    return {key.decode(): int(value) for key, value in read.items()}
+
+
+async def aget_watermark(table):
+    read = await aconn.hgetall(f"watermark:{table}")
+    return {key.decode(): int(value) for key, value in read.items()}
+
+
+def set_ingest_head(account, pos, block_time):
+    state = {"pos": pos, "polled_at": int(time.time())}
+    if block_time:
+        state["block_time"] = block_time
+    conn.hset(f"ingest:{account}", mapping=state)
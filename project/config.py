@@ -1,3 +1,4 @@
+import os
 from enum import Enum
 
 server_name = "US-east"
@@ -5,6 +6,77 @@ discord_hook_key = ""
 role_to_ping = 123
 resource_key = "123abc"
 
+archive_path = "archive"
+archive_start = "2022-01"
+archive_chunk = 5000
+# A month is exported once both the clock and ingestion are this far past its end, late inserts land before that
+archive_grace_hours = 72
+export_chunk = 2000
+dashboard_top_k = 500
+# Response cache, entries are served fresh for the route's soft ttl and stale until the hard ttl
+cache_hard_factor = 6
+cache_jitter = 0.1
+# Query shapes kept warm by the leader api worker, path -> list of query params
+warm_routes = {
+    "/status": [{}],
+    "/stations": [{}],
+    "/railroaders": [{}],
+    "/admin_dash": [{}],
+}
+warm_interval = 5
+# Admission control, see admission.py. Requests with a key from api_keys get that quota instead of client_quota
+cost_classes = {
+    "cheap": {"concurrency": 40, "statement_timeout_ms": 5000, "tokens": 1},
+    "medium": {"concurrency": 16, "statement_timeout_ms": 15000, "tokens": 3},
+    "heavy": {"concurrency": 4, "statement_timeout_ms": 60000, "tokens": 20},
+}
+client_quota = {"rate": 2, "burst": 60}
+api_keys = {resource_key: {"rate": 50, "burst": 1000}}
+# Only set in docker-compose.bench.yml, bench.load sends it so the quota doesn't turn misses into 429s
+bench_api_key = os.getenv("BENCH_API_KEY")
+if bench_api_key:
+    api_keys[bench_api_key] = {"rate": 1_000_000, "burst": 1_000_000}
+# Proxies in front of the api (ips or networks), X-Forwarded-For is only believed when they send it
+trusted_proxies = [net for net in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if net]
+admission_wait_ms = 3000
+admission_lease_margin = 5
+# Ttl of the response cache's recompute lock, above the longest statement_timeout and renewed while the
+# recompute runs. Waiters give up with a 503 after one ttl.
+cache_lock_ms = max(spec["statement_timeout_ms"] for spec in cost_classes.values()) + 5000
+# Live feed of committed actions, see feed.py
+feed_maxlen = 100000
+feed_queue = 1000
+feed_block_ms = 5000
+feed_keepalive = 15
+# Responses smaller than this go out uncompressed
+compress_min_bytes = 1024
+gzip_level = 6
+brotli_quality = 5
+# Rendered template/asset cache, per api worker and in redis
+atomic_local_ttl = 600
+atomic_local_size = 100000
+atomic_ttl = 7 * 86400
+atomic_missing_ttl = 60
+atomic_batch_max = 500
+atomic_max_age = 3600
+# Tables filled from each account's action history, for the ingestion lag on /status
+account_tables = {
+    "rr.century": ["logrun", "npcencounter", "logtip"],
+    "m.century": ["usefuel", "buyfuel"],
+}
+# Sliding windows snap to this many seconds, hourly dashboard partials are kept for partial_ttl
+window_bucket_seconds = 60
+partial_ttl = 8 * 86400
+# An hour is only cached as a partial once the watermark is this many seconds past its end, runs from parallel
+# fetchers commit out of block order
+partial_seal_lag = 2 * 3600
+# Every api process keeps this many hours of logruns in memory for the rolling dashboards, 0 turns it off
+hot_window_hours = 48
+# Rows allocated at least, the window is sized from the runs it loads and doubles when it fills up
+hot_window_capacity = 65_536
+# Every this many seconds the hot window is checked against postgres for runs the feed did not deliver
+hot_window_reconcile_seconds = 300
+
 history_tags_metadata = [
     {
         "name": "status",
@@ -50,6 +122,44 @@ class OrderChoose(str, Enum):
     asc = "asc"
 
 
+class ExportAction(str, Enum):
+    logrun = "logrun"
+    usefuel = "usefuel"
+    buyfuel = "buyfuel"
+    npcencounter = "npcencounter"
+    logtips = "logtips"
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+commodity_types = [
+    "pallet",
+    "crate",
+    "liquid",
+    "gas",
+    "aggregate",
+    "ore",
+    "granule",
+    "grain",
+    "perishable",
+    "oversized",
+    "building_materials",
+    "automobile",
+    "top_secret",
+]
+
+LeaderboardMetric = Enum(
+    "LeaderboardMetric",
+    {name: name for name in ["runs", "miles", "reward"] + [f"miles_{typ}" for typ in commodity_types]},
+    type=str,
+)
+leaderboard_hours = 48
+leaderboard_window_ttl = 60
+
+
 wanted_actions = ["logrun", "logtips", "npcencounter"]
 wanted_templates = ["passengercar", "passenger", "locomotive", "conductor", "railcar", "commodity", "station"]
 
@@ -141,3 +251,17 @@ achv_mapped = {
     "Entity 9’s BFF 4": 85,
     "Entity 9’s BFF 5": 86,
 }
+
+
+def split_achv(key: str) -> tuple:
+    name, _, tier = key.rpartition(" ")
+    return (name, int(tier)) if tier.isdigit() else (key, None)
+
+
+# (name, tier) <-> achv_id, tier is None for the one-off badges
+achv_ids = {split_achv(key): achv_id for key, achv_id in achv_mapped.items()}
+achv_names = {achv_id: named for named, achv_id in achv_ids.items()}
+# Names the writer has always stored differently from achv_mapped, kept so existing rows still match
+achv_aliases = {"Entity 9s BFF": "Entity 9’s BFF"}
+for alias, named in achv_aliases.items():
+    achv_ids.update({(alias, tier): achv_id for (known, tier), achv_id in list(achv_ids.items()) if known == named})
@@ -1,19 +1,149 @@
+import base64
 import inspect
 import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 
+from sqlalchemy import text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlmodel import Session, SQLModel, create_engine, select
 
+import cachetool
 import config
 from disclog import postLog
 
-engine = create_engine(
-    f"postgresql://{os.getenv('DATABASE_URL','postgresql://postgres:postgres@db:5432/foo').split('://')[1]}",
-    pool_recycle=3600,
-    pool_size=5,
+
+def sync_url(url):
+    return f"postgresql://{url.split('://')[1]}"
+
+
+def async_url(url):
+    return f"postgresql+asyncpg://{url.split('://')[1]}"
+
+
+writer_url = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/foo")
+reader_url = os.getenv("DATABASE_READ_URL")
+
+# Every gunicorn worker, celery process and the filler opens its own pools, so per process sizes are
+# derived from one budget for the whole deployment instead of the sqlalchemy default of 5 + 10 overflow.
+connection_budget = int(os.getenv("DATABASE_CONNECTION_BUDGET", 90))
+connection_processes = int(os.getenv("DATABASE_PROCESSES", 31))
+pgbouncer = os.getenv("DATABASE_PGBOUNCER", "0") == "1"
+statement_cache_size = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", 500))
+
+
+def pool_options(size_env):
+    pool_size = int(os.getenv(size_env, max(1, connection_budget // connection_processes)))
+    return {
+        "pool_recycle": 3600,
+        "pool_size": pool_size,
+        "max_overflow": int(os.getenv("DATABASE_MAX_OVERFLOW", 0)),
+        "pool_timeout": int(os.getenv("DATABASE_POOL_TIMEOUT", 30)),
+    }
+
+
+def async_connect_args():
+    if pgbouncer:
+        # pgbouncer in transaction mode hands each transaction a different server connection,
+        # named prepared statements would not exist there.
+        return {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    return {"statement_cache_size": statement_cache_size, "prepared_statement_cache_size": statement_cache_size}
+
+
+writer_engine = create_engine(sync_url(writer_url), **pool_options("DATABASE_POOL_SIZE"))
+reader_engine = (
+    create_engine(sync_url(reader_url), **pool_options("DATABASE_READ_POOL_SIZE")) if reader_url else writer_engine
 )
+engine = writer_engine
 db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
+# The APIs only talk to postgres through asyncpg, the sync engines above are for celery and the filler.
+async_writer_engine = create_async_engine(
+    async_url(writer_url),
+    connect_args=async_connect_args(),
+    **pool_options("DATABASE_POOL_SIZE"),
+)
+async_reader_engine = (
+    create_async_engine(
+        async_url(reader_url),
+        connect_args=async_connect_args(),
+        **pool_options("DATABASE_READ_POOL_SIZE"),
+    )
+    if reader_url
+    else async_writer_engine
+)
+
+# Seconds the reader may trail the ingestion watermark before reads fall back to the writer, 0 disables the guard.
+read_max_lag = int(os.getenv("DATABASE_READ_MAX_LAG", 0))
+read_lag_check = int(os.getenv("DATABASE_READ_LAG_CHECK", 5))
+reader_state = {"checked": 0.0, "healthy": True}
+# Separate from the sync path, a process can run both
+async_reader_state = {"checked": 0.0, "healthy": True}
+
+
+def reader_lag():
+    watermark = cachetool.get_watermark("logrun")
+    if not watermark:
+        return 0
+    with reader_engine.connect() as conn:
+        newest = conn.execute(text("SELECT block_timestamp FROM logrun ORDER BY id DESC LIMIT 1")).scalar()
+    return watermark["block_timestamp"] - (newest or 0)
+
+
+def read_engine():
+    if reader_engine is writer_engine or read_max_lag == 0:
+        return reader_engine
+
+    if time.monotonic() - reader_state["checked"] > read_lag_check:
+        reader_state["checked"] = time.monotonic()
+        try:
+            reader_state["healthy"] = reader_lag() <= read_max_lag
+        except Exception as e:
+            postLog(e, "warn", f"{inspect.stack()[0][3]}:{inspect.stack()[0][2]}")
+            reader_state["healthy"] = False
+
+    return reader_engine if reader_state["healthy"] else writer_engine
+
+
+async def async_reader_lag():
+    watermark = await cachetool.aget_watermark("logrun")
+    if not watermark:
+        return 0
+    async with async_reader_engine.connect() as conn:
+        newest = (await conn.execute(text("SELECT block_timestamp FROM logrun ORDER BY id DESC LIMIT 1"))).scalar()
+    return watermark["block_timestamp"] - (newest or 0)
+
+
+async def async_read_engine():
+    if async_reader_engine is async_writer_engine or read_max_lag == 0:
+        return async_reader_engine
+
+    if time.monotonic() - async_reader_state["checked"] > read_lag_check:
+        async_reader_state["checked"] = time.monotonic()
+        try:
+            async_reader_state["healthy"] = await async_reader_lag() <= read_max_lag
+        except Exception as e:
+            postLog(e, "warn", f"{inspect.stack()[0][3]}:{inspect.stack()[0][2]}")
+            async_reader_state["healthy"] = False
+
+    return async_reader_engine if async_reader_state["healthy"] else async_writer_engine
+
+
+# Set by admission.admitted for the cost class of the running request, in milliseconds
+statement_timeout: ContextVar = ContextVar("statement_timeout", default=None)
+
+
+@asynccontextmanager
+async def read_session():
+    async with AsyncSession(await async_read_engine(), expire_on_commit=False) as session:
+        timeout = statement_timeout.get()
+        if timeout:
+            # Scoped to the session's transaction, also safe behind pgbouncer in transaction mode
+            await session.execute(text(f"SET LOCAL statement_timeout = {int(timeout)}"))
+        yield session
+
 
 def init_db():
     trying = True
@@ -31,6 +161,11 @@ def get_session():
         yield session
 
 
+async def get_read_session():
+    async with read_session() as session:
+        yield session
+
+
 def commit_or_rollback(session,new_obj):
         try:
             session.add(new_obj)
@@ -53,7 +188,60 @@ def commit_or_rollback_big(session,new_objs):
 
 
 
-def query_raw(
+class CursorError(ValueError):
+    pass
+
+
+class FieldError(ValueError):
+    pass
+
+
+def parse_fields(fields: str, allowed) -> list:
+    # Comma separated subset of allowed, in the order asked for, everything when not given.
+    if not fields:
+        return list(allowed)
+    wanted = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in wanted if field not in allowed]
+    if unknown:
+        raise FieldError(f"unknown fields: {', '.join(unknown)}, choose from {', '.join(allowed)}")
+    return wanted
+
+
+def encode_cursor(block_timestamp: int, id: int):
+    return base64.urlsafe_b64encode(f"{block_timestamp}:{id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        block_timestamp, id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(block_timestamp), int(id)
+    except Exception:
+        raise CursorError(f"invalid cursor: {cursor}")
+
+
+def keyset(query, model, cursor: str = None, order: config.OrderChoose = config.OrderChoose.desc):
+    # Pages are ordered by (block_timestamp, id) so a cursor seeks straight to its row instead of counting an offset.
+    if order.value == "desc":
+        if cursor:
+            query = query.where(tuple_(model.block_timestamp, model.id) < decode_cursor(cursor))
+        return query.order_by(model.block_timestamp.desc(), model.id.desc())
+
+    if cursor:
+        query = query.where(tuple_(model.block_timestamp, model.id) > decode_cursor(cursor))
+    return query.order_by(model.block_timestamp, model.id)
+
+
+def next_cursor(rows, limit: int, timestamp: str = "block_timestamp"):
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    if isinstance(last, dict):
+        return encode_cursor(last[timestamp], last["id"])
+    return encode_cursor(getattr(last, timestamp), last.id)
+
+
+def filter_raw(
+    query,
     model,
     railroader: str = None,
     train: str = None,
@@ -65,12 +253,7 @@ def query_raw(
     fuel_type: config.FuelType = None,
     before_timestamp: int = None,
     after_timestamp: int = None,
-    offset: int = 0,
-    limit: int = 10000,
-    order: config.OrderChoose = config.OrderChoose.desc,
 ):
-
-    query = select(model)
     if trx_id:
         query = query.where(model.trx_id == trx_id)
     if century:
@@ -94,12 +277,49 @@ def query_raw(
     if after_timestamp:
         query = query.where(model.block_timestamp > after_timestamp)
 
-    if order.value == "desc":
-        query = query.order_by(model.block_time.desc())
-    else:
-        query = query.order_by(model.block_time)
+    return query
 
-    with Session(engine) as session:
-        out = session.exec(query.offset(offset).limit(limit)).all()
 
-    return out
+async def query_raw(
+    model,
+    offset: int = 0,
+    limit: int = 10000,
+    order: config.OrderChoose = config.OrderChoose.desc,
+    cursor: str = None,
+    fields: str = None,
+    **filters,
+):
+    # Plain column tuples instead of orm instances, they are turned into dicts for the encoder and nothing else.
+    # Only the asked for columns are selected, plus the two the cursor is built from.
+    columns = parse_fields(fields, model.__table__.columns.keys())
+    selected = columns + [name for name in ("id", "block_timestamp") if name not in columns]
+    query = select(*[model.__table__.columns[name] for name in selected])
+    query = keyset(filter_raw(query, model, **filters), model, cursor, order)
+
+    async with read_session() as session:
+        rows = (await session.execute(query.offset(offset).limit(limit))).all()
+
+    out = [dict(zip(selected, row)) for row in rows]
+    page = next_cursor(out, limit)
+    if len(selected) > len(columns):
+        out = [{name: row[name] for name in columns} for row in out]
+    return out, page
+
+
+async def stream_raw(
+    model,
+    limit: int = None,
+    order: config.OrderChoose = config.OrderChoose.desc,
+    columns: list = None,
+    **filters,
+):
+    # Plain column rows over a server side cursor, memory stays at one chunk no matter how many rows match.
+    query = select(*[model.__table__.columns[name] for name in columns or model.__table__.columns.keys()])
+    query = keyset(filter_raw(query, model, **filters), model, None, order)
+    if limit:
+        query = query.limit(limit)
+
+    async with read_session() as session:
+        result = await session.stream(query.execution_options(yield_per=config.export_chunk))
+        async for chunk in result.partitions():
+            yield chunk
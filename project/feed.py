@@ -0,0 +1,167 @@
+import asyncio
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import config
+from cachetool import aconn, conn
+from db import parse_fields
+
+# Committed actions and newly reached achievements are appended by the writer to the redis stream
+# `feed`, capped at config.feed_maxlen entries. Stream ids are used as SSE event ids, so a client
+# reconnecting with Last-Event-ID gets what it missed from the stream itself.
+#
+# Each api process runs one reader on the stream and fans entries out to its subscribers, clients
+# don't hold a redis connection each.
+
+event_types = ["logrun", "npcencounter", "logtip", "achievement"]
+logrun_fields = [
+    "id",
+    "trx_id",
+    "block_time",
+    "block_timestamp",
+    "railroader",
+    "railroader_reward",
+    "arrive_station",
+    "depart_station",
+    "station_owner",
+    "station_owner_reward",
+    "train_name",
+    "century",
+    "distance",
+    "weight",
+    "fuel_type",
+    "quantity",
+]
+
+
+def publish(kind: str, data: dict, railroader: str, century: str = "", station: str = ""):
+    fields = {"type": kind, "railroader": railroader, "century": century or "", "station": station or ""}
+    conn.xadd("feed", {**fields, "data": orjson.dumps(data)}, maxlen=config.feed_maxlen, approximate=True)
+
+
+def publish_action(item):
+    table = item.__tablename__
+    if table == "logrun":
+        data = {field: getattr(item, field) for field in logrun_fields}
+        publish(table, data, item.railroader, item.century, item.arrive_station)
+    elif table in ("npcencounter", "logtip"):
+        publish(table, item.dict(), item.railroader, item.century)
+
+
+def publish_achievement(av, railroader: str):
+    data = {"railroader": railroader, **av.dict(exclude={"id", "railroader_id"})}
+    publish("achievement", data, railroader)
+
+
+def stream_id(raw) -> tuple:
+    ms, _, seq = (raw.decode() if isinstance(raw, bytes) else raw).partition("-")
+    return int(ms), int(seq or 0)
+
+
+class Hub:
+    def __init__(self):
+        self.subscribers = set()
+        self.reader = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=config.feed_queue)
+        self.subscribers.add(queue)
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    async def run(self):
+        last = None
+        while self.subscribers:
+            try:
+                if last is None:
+                    # A concrete id to read after, "$" would skip whatever is added between two reads
+                    newest = await aconn.xrevrange("feed", count=1)
+                    last = newest[0][0] if newest else "0-0"
+                read = await aconn.xread({"feed": last}, count=500, block=config.feed_block_ms)
+            except Exception as e:
+                print(f"feed reader: {e}")
+                await asyncio.sleep(1)
+                continue
+            for _, entries in read or []:
+                for event_id, fields in entries:
+                    last = event_id
+                    for queue in list(self.subscribers):
+                        try:
+                            queue.put_nowait((event_id, fields))
+                        except asyncio.QueueFull:
+                            # Too slow to keep up, end its stream, the client reconnects with its Last-Event-ID
+                            self.unsubscribe(queue)
+                            while not queue.empty():
+                                queue.get_nowait()
+                            queue.put_nowait(None)
+
+
+hub = Hub()
+
+
+def wanted(fields: dict, types: set, railroader: str, station: str, century: str) -> bool:
+    if types and fields[b"type"].decode() not in types:
+        return False
+    if railroader and fields[b"railroader"].decode() != railroader:
+        return False
+    if station and fields[b"station"].decode() != station:
+        return False
+    if century and fields[b"century"].decode() != century:
+        return False
+    return True
+
+
+def sse(event_id, fields) -> str:
+    return f"id: {event_id.decode()}\nevent: {fields[b'type'].decode()}\ndata: {fields[b'data'].decode()}\n\n"
+
+
+async def events(last_event_id: str, types: set, railroader: str, station: str, century: str):
+    queue = hub.subscribe()
+    try:
+        seen = (0, 0)
+        if last_event_id:
+            # Subscribed first so nothing falls between the backlog and the live entries
+            seen = stream_id(last_event_id)
+            backlog = await aconn.xrange("feed", min=f"({last_event_id}", count=config.feed_maxlen)
+            for event_id, fields in backlog:
+                seen = stream_id(event_id)
+                if wanted(fields, types, railroader, station, century):
+                    yield sse(event_id, fields)
+
+        while True:
+            try:
+                entry = await asyncio.wait_for(queue.get(), timeout=config.feed_keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if entry is None:
+                return
+            event_id, fields = entry
+            if stream_id(event_id) <= seen:
+                continue
+            if wanted(fields, types, railroader, station, century):
+                yield sse(event_id, fields)
+    finally:
+        hub.unsubscribe(queue)
+
+
+def response(request, type: str, railroader: str, station: str, century: str, last_event_id: str):
+    # Server-sent events, resumes after Last-Event-ID (header or query param) when given
+    resume = request.headers.get("last-event-id") or last_event_id
+    if resume:
+        try:
+            stream_id(resume)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"invalid Last-Event-ID: {resume}")
+    types = set(parse_fields(type, event_types)) if type else set()
+    return StreamingResponse(
+        events(resume, types, railroader, station, century),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
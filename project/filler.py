@@ -22,6 +22,8 @@ def filler(posrr, posm) -> str:
     while run:
         try:
             manager.fetch()
+            for account, pos in (("rr.century", manager.posrr), ("m.century", manager.posm)):
+                cachetool.set_ingest_head(account, pos, manager.heads.get(account))
             if len(manager.out) > 0:
 
                 writer.delay(manager.out, "action")
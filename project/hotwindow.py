@@ -0,0 +1,379 @@
+import asyncio
+import time
+
+import numpy as np
+import orjson
+from sqlalchemy import func
+from sqlmodel import select
+
+import config
+import feed
+from admission import local_slots
+from db import read_session
+from models import Logrun
+from partials import window_floor
+
+# The last config.hot_window_hours of logruns held by every api process as numpy columns, names
+# dictionary encoded to int32 codes. It's loaded from postgres once and then appended from the writer's
+# feed, every config.hot_window_reconcile_seconds the runs the feed missed are fetched by id. The rolling
+# dashboards are group-bys over it that never touch the database. Every process keeps its own copy, a row
+# is 81 bytes so a few hundred thousand runs are tens of MB each, plus a quarter of headroom.
+
+HOUR = 3600
+DAY = 86400
+FUELS = {"DIESEL": 1, "COAL": 2}
+
+columns = {
+    "id": np.int64,
+    "ts": np.int64,
+    "railroader": np.int32,
+    "owner": np.int32,
+    "arrive": np.int32,
+    "depart": np.int32,
+    "train": np.int32,
+    "century": np.int32,
+    "reward": np.int64,
+    "owner_reward": np.int64,
+    "distance": np.int64,
+    "weight": np.int64,
+    "quantity": np.float64,
+    "fuel": np.int8,
+}
+source = [
+    "id",
+    "block_timestamp",
+    "railroader",
+    "station_owner",
+    "arrive_station",
+    "depart_station",
+    "train_name",
+    "century",
+    "railroader_reward",
+    "station_owner_reward",
+    "distance",
+    "weight",
+    "quantity",
+    "fuel_type",
+]
+
+
+class Codes:
+    def __init__(self):
+        self.index = {}
+        self.names = []
+
+    def code(self, name: str) -> int:
+        found = self.index.get(name)
+        if found is None:
+            found = self.index[name] = len(self.names)
+            self.names.append(name)
+        return found
+
+    def get(self, name: str) -> int:
+        # -1 for names never seen, matches no row
+        return self.index.get(name, -1)
+
+
+def top_counts(codes, names: list, limit: int = None) -> dict:
+    keys, counts = np.unique(codes, return_counts=True)
+    order = np.argsort(-counts, kind="stable")[:limit]
+    return {names[keys[i]]: int(counts[i]) for i in order}
+
+
+def pair_counts(groups, keys, names: list, wanted=None) -> dict:
+    # {group code: {key name: count}}, each ordered by count like the grouped_counts query
+    width = int(keys.max()) + 1
+    pairs, counts = np.unique(groups.astype(np.int64) * width + keys, return_counts=True)
+    group, key = pairs // width, pairs % width
+    if wanted is not None:
+        keep = np.isin(group, wanted)
+        group, key, counts = group[keep], key[keep], counts[keep]
+    out = {}
+    for i in np.lexsort((-counts, group)):
+        out.setdefault(int(group[i]), {})[names[key[i]]] = int(counts[i])
+    return out
+
+
+def buckets(rows: dict, size: int, limit: int) -> list:
+    # (start, transports, owner reward, unique railroaders) per hour or day bucket, newest first
+    starts, index, transports = np.unique(rows["ts"] - rows["ts"] % size, return_inverse=True, return_counts=True)
+    rewards = np.bincount(index, weights=rows["owner_reward"], minlength=len(starts))
+    width = int(rows["railroader"].max()) + 1
+    visitors = np.unique(index.astype(np.int64) * width + rows["railroader"]) // width
+    unique = np.bincount(visitors, minlength=len(starts))
+    return [
+        (int(starts[i]), int(transports[i]), int(round(rewards[i])), int(unique[i]))
+        for i in range(len(starts) - 1, -1, -1)
+    ][:limit]
+
+
+class HotWindow:
+    def __init__(self):
+        self.task = None
+        self.reset()
+
+    def reset(self, capacity: int = config.hot_window_capacity):
+        self.names = Codes()
+        self.stations = Codes()
+        self.trains = Codes()
+        self.centuries = Codes()
+        self.cols = {name: np.zeros(capacity, dtype) for name, dtype in columns.items()}
+        self.size = 0
+        self.ready = False
+
+    def covers(self, timeframe: int) -> bool:
+        return self.ready and 0 < timeframe <= config.hot_window_hours
+
+    def encode(self, run: dict) -> tuple:
+        return (
+            run["id"],
+            run["block_timestamp"],
+            self.names.code(run["railroader"]),
+            self.names.code(run["station_owner"]),
+            self.stations.code(run["arrive_station"]),
+            self.stations.code(run["depart_station"]),
+            self.trains.code(run["train_name"]),
+            self.centuries.code(run["century"]),
+            run["railroader_reward"],
+            run["station_owner_reward"],
+            run["distance"],
+            run["weight"],
+            run["quantity"] or 0.0,
+            FUELS.get(run["fuel_type"], 0),
+        )
+
+    def append(self, rows: list):
+        if not rows:
+            return
+        if self.size + len(rows) > len(self.cols["id"]):
+            self.compact()
+        if self.size + len(rows) > len(self.cols["id"]):
+            grown = max(2 * len(self.cols["id"]), self.size + len(rows))
+            for name, col in self.cols.items():
+                self.cols[name] = np.concatenate([col[: self.size], np.zeros(grown - self.size, col.dtype)])
+        end = self.size + len(rows)
+        for col, values in zip(self.cols.values(), zip(*rows)):
+            col[self.size : end] = values
+        self.size = end
+
+    def compact(self):
+        keep = self.cols["ts"][: self.size] >= int(time.time()) - config.hot_window_hours * HOUR
+        kept = int(keep.sum())
+        for col in self.cols.values():
+            col[:kept] = col[: self.size][keep]
+        self.size = kept
+
+    def rows(self, timeframe: int, **equals) -> dict:
+        mask = self.cols["ts"][: self.size] >= window_floor(timeframe)
+        for column, code in equals.items():
+            mask &= self.cols[column][: self.size] == code
+        return {name: col[: self.size][mask] for name, col in self.cols.items()}
+
+    async def load(self):
+        # Takes a heavy slot of this process for the long read, like an export
+        since = int(time.time()) - config.hot_window_hours * HOUR
+        query = select(*[getattr(Logrun, field) for field in source]).where(Logrun.block_timestamp >= since)
+        async with local_slots["heavy"], read_session() as session:
+            counted = select(func.count()).select_from(Logrun).where(Logrun.block_timestamp >= since)
+            count = (await session.execute(counted)).scalar()
+            self.reset(max(config.hot_window_capacity, count + count // 4))
+            result = await session.stream(query.execution_options(yield_per=config.export_chunk))
+            async for chunk in result.mappings().partitions():
+                self.append([self.encode(row) for row in chunk])
+
+    def newest_id(self) -> int:
+        return int(self.cols["id"][: self.size].max(initial=0))
+
+    async def reconcile(self, since_id: int) -> set:
+        # Runs from since_id on that postgres has and the window doesn't, the feed is capped and a reader can miss
+        # entries. Returns the ids added so their feed entries, if they still arrive, are skipped.
+        floor = int(time.time()) - config.hot_window_hours * HOUR
+        async with read_session() as session:
+            query = select(Logrun.id).where(Logrun.id >= since_id).where(Logrun.block_timestamp >= floor)
+            ids = np.array((await session.execute(query)).scalars().all(), dtype=np.int64)
+            missing = np.setdiff1d(ids, self.cols["id"][: self.size]).tolist()
+            if missing:
+                query = select(*[getattr(Logrun, field) for field in source]).where(Logrun.id.in_(missing))
+                self.append([self.encode(row) for row in (await session.execute(query)).mappings().all()])
+        return set(missing)
+
+    async def run(self):
+        while True:
+            # Subscribed before loading, runs committed meanwhile wait in the queue and are deduplicated
+            queue = feed.hub.subscribe()
+            try:
+                await self.load()
+                pending = queue.qsize()
+                self.ready = True
+                # Each check starts at the newest id of the check before last, runs commit out of id order
+                checked = [self.newest_id()] * 2
+                recovered = set()
+                reconcile_at = time.monotonic() + config.hot_window_reconcile_seconds
+                while True:
+                    try:
+                        entry = await asyncio.wait_for(queue.get(), max(0, reconcile_at - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        recovered = await self.reconcile(checked.pop(0))
+                        checked.append(self.newest_id())
+                        reconcile_at = time.monotonic() + config.hot_window_reconcile_seconds
+                        continue
+                    if entry is None:
+                        break
+                    _, fields = entry
+                    if fields[b"type"] != b"logrun":
+                        continue
+                    run = orjson.loads(fields[b"data"])
+                    if run["id"] in recovered:
+                        continue
+                    if pending:
+                        pending -= 1
+                        if (self.cols["id"][: self.size] == run["id"]).any():
+                            continue
+                    self.append([self.encode(run)])
+            except Exception as e:
+                print(f"hot window: {e}")
+                await asyncio.sleep(5)
+            finally:
+                self.ready = False
+                feed.hub.unsubscribe(queue)
+
+    def start(self):
+        if config.hot_window_hours:
+            self.task = asyncio.ensure_future(self.run())
+
+    def admin_dash(self, century: str, timeframe: int) -> dict:
+        rows = self.rows(timeframe, **({"century": self.centuries.get(century)} if century else {}))
+        transports = len(rows["id"])
+        reward = int(rows["reward"].sum())
+        weight = int(rows["weight"].sum())
+        diesel = float(rows["quantity"][rows["fuel"] == FUELS["DIESEL"]].sum())
+        coal = float(rows["quantity"][rows["fuel"] == FUELS["COAL"]].sum())
+        return {
+            "total_transports": transports,
+            "total_distance": int(rows["distance"].sum()),
+            "total_reward": reward / 10000,
+            "avg_reward": reward // transports / 10000 if transports else 0,
+            "total_weight": weight,
+            "avg_weight": weight // transports if transports else 0,
+            "total_coal": round(coal, 2),
+            "avg_coal": round(coal / transports, 2) if transports else 0,
+            "total_diesel": round(diesel, 2),
+            "avg_diesel": round(diesel / transports, 2) if transports else 0,
+            "active_railroaders": len(np.unique(rows["railroader"])),
+            "active_trains": len(np.unique(rows["train"])),
+        }
+
+    def station(self, station: str, timeframe: int):
+        rows = self.rows(timeframe, arrive=self.stations.get(station))
+        transports = len(rows["id"])
+        if not transports:
+            return None
+        reward = int(rows["owner_reward"].sum())
+        recent = np.argsort(-rows["ts"], kind="stable")[: config.dashboard_top_k]
+        hours = buckets(rows, HOUR, 2000) if 0 < timeframe < 51 else []
+        days = buckets(rows, DAY, 1000) if timeframe > 50 else []
+        return {
+            "station": station,
+            "owner": self.names.names[rows["owner"][recent[0]]],
+            "total_transports": transports,
+            "total_comission": reward / 10000,
+            "avg_comission": reward // transports / 10000,
+            "top_visitors": top_counts(rows["railroader"], self.names.names, config.dashboard_top_k),
+            "refering_stations": top_counts(rows["depart"], self.stations.names, config.dashboard_top_k),
+            "days": [
+                {"day": day, "tocium": tocium, "unique_visitors": unique, "total_visitors": total}
+                for day, total, tocium, unique in days
+            ],
+            "hours": [
+                {"hour": hour, "tocium": tocium, "unique_visitors": unique, "total_visitors": total}
+                for hour, total, tocium, unique in hours
+            ],
+            "comissions_list": [
+                (int(rows["owner_reward"][i]), int(rows["ts"][i]), self.names.names[rows["railroader"][i]])
+                for i in recent
+            ],
+        }
+
+    def stations_board(self, owner: str, timeframe: int, limit: int) -> list:
+        rows = self.rows(timeframe, **({"owner": self.names.get(owner)} if owner else {}))
+        if not len(rows["id"]):
+            return []
+        width = len(self.stations.names)
+        transports = np.bincount(rows["arrive"], minlength=width)
+        rewards = np.bincount(rows["arrive"], weights=rows["owner_reward"], minlength=width)
+        weights = np.bincount(rows["arrive"], weights=rows["weight"], minlength=width)
+        top = np.argsort(-transports, kind="stable")[:limit]
+        top = top[transports[top] > 0]
+
+        # Newest owner per station: first occurrence of each station going backwards in time
+        newest = np.argsort(-rows["ts"], kind="stable")
+        seen, first = np.unique(rows["arrive"][newest], return_index=True)
+        owners = dict(zip(seen.tolist(), rows["owner"][newest][first].tolist()))
+        visitors = pair_counts(rows["arrive"], rows["railroader"], self.names.names, top)
+
+        out = []
+        for code in top.tolist():
+            total, reward, weight = int(transports[code]), int(round(rewards[code])), int(round(weights[code]))
+            out.append(
+                {
+                    "station": self.stations.names[code],
+                    "owner": self.names.names[owners[code]],
+                    "total_transports": total,
+                    "total_comission": reward / 10000,
+                    "avg_comission": reward // total / 10000,
+                    "total_weight": weight,
+                    "avg_weight": weight // total,
+                    "visitors": visitors.get(code, {}),
+                }
+            )
+        return out
+
+    def railroader_totals(self, rows: dict, limit: int = None):
+        # Rows shaped like the railroader_totals() query plus the visited stations per railroader
+        if not len(rows["id"]):
+            return [], {}
+        width = len(self.names.names)
+        transports = np.bincount(rows["railroader"], minlength=width)
+        top = np.argsort(-transports, kind="stable")[:limit]
+        top = top[transports[top] > 0]
+        sums = {
+            field: np.bincount(rows["railroader"], weights=rows[column], minlength=width)
+            for field, column in (("reward", "reward"), ("distance", "distance"), ("weight", "weight"))
+        }
+        for fuel in FUELS:
+            used = rows["fuel"] == FUELS[fuel]
+            sums[fuel] = np.bincount(rows["railroader"][used], weights=rows["quantity"][used], minlength=width)
+
+        totals = []
+        for code in top.tolist():
+            total = int(transports[code])
+            reward, weight = int(round(sums["reward"][code])), int(round(sums["weight"][code]))
+            totals.append(
+                {
+                    "name": self.names.names[code],
+                    "total_transports": total,
+                    "total_reward": reward,
+                    "total_distance": int(round(sums["distance"][code])),
+                    "avg_reward": reward // total,
+                    "total_weight": weight,
+                    "avg_weight": weight // total,
+                    "total_diesel": float(sums["DIESEL"][code]),
+                    "total_coal": float(sums["COAL"][code]),
+                }
+            )
+        stations = pair_counts(rows["railroader"], rows["arrive"], self.stations.names, top)
+        return totals, {self.names.names[code]: visited for code, visited in stations.items()}
+
+    def railroader(self, railroader: str, train: str, timeframe: int):
+        equals = {}
+        if railroader:
+            equals["railroader"] = self.names.get(railroader)
+        if train:
+            equals["train"] = self.trains.get(train)
+        return self.railroader_totals(self.rows(timeframe, **equals))
+
+    def railroaders(self, limit: int):
+        return self.railroader_totals(self.rows(24), limit)
+
+
+window = HotWindow()
@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import zlib
+from contextvars import ContextVar
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+import config
+
+# Compression and conditional GET for every response. Bodies sent in one piece get an ETag (unless the
+# route set one) and a 304 when it matches If-None-Match, and are compressed when at least
+# config.compress_min_bytes. Streamed bodies are compressed chunk by chunk. Responses that arrive
+# with a Content-Encoding, like cache hits stored precompressed, are passed through untouched.
+
+accepted_encoding: ContextVar = ContextVar("accepted_encoding", default=None)
+
+
+def pick_encoding(accept: str):
+    offered = {}
+    for part in accept.split(","):
+        name, _, params = part.strip().partition(";")
+        offered[name.strip()] = params.replace(" ", "") not in ("q=0", "q=0.0")
+    for encoding in ("br", "gzip"):
+        if offered.get(encoding):
+            return encoding
+    return None
+
+
+def etag_of(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=config.brotli_quality)
+    return gzip.compress(body, config.gzip_level)
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.inner = brotli.Compressor(quality=config.brotli_quality)
+        else:
+            self.inner = zlib.compressobj(config.gzip_level, zlib.DEFLATED, 31)
+
+    def chunk(self, body: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            return self.inner.process(body) + (self.inner.finish() if last else self.inner.flush())
+        return self.inner.compress(body) + self.inner.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def matches(tag: str, if_none_match: str) -> bool:
+    return if_none_match.strip() == "*" or tag in (part.strip() for part in if_none_match.split(","))
+
+
+class HttpCacheMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+
+        request_headers = Headers(scope=scope)
+        encoding = pick_encoding(request_headers.get("accept-encoding", ""))
+        if_none_match = request_headers.get("if-none-match")
+        accepted_encoding.set(encoding)
+        start = None
+        streaming = None
+
+        async def wrapped(message):
+            nonlocal start, streaming
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                passthrough = "content-encoding" in headers or start["status"] != 200
+                if not more:
+                    if not passthrough or "etag" in headers:
+                        await self.send_whole(send, start, headers, body, encoding, if_none_match, passthrough)
+                    else:
+                        await send(start)
+                        await send(message)
+                    start = None
+                    return
+                if encoding and not passthrough:
+                    streaming = StreamCompressor(encoding)
+                    del headers["content-length"]
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                await send(start)
+                start = None
+
+            if streaming:
+                body = streaming.chunk(body, last=not more)
+            await send({"type": "http.response.body", "body": body, "more_body": more})
+
+        await self.app(scope, receive, wrapped)
+
+    async def send_whole(self, send, start, headers, body, encoding, if_none_match, passthrough):
+        compressing = encoding and not passthrough and len(body) >= config.compress_min_bytes
+        if start["status"] == 200 and "etag" not in headers:
+            headers["ETag"] = etag_of(body)
+        if compressing:
+            # A strong tag belongs to one representation, the compressed one gets its own
+            headers["ETag"] = f'{headers["etag"][:-1]}-{encoding}"'
+            headers.add_vary_header("Accept-Encoding")
+        if start["status"] == 200 and if_none_match and matches(headers["etag"], if_none_match):
+            keep = [(k, v) for k, v in start["headers"] if k in (b"etag", b"cache-control", b"vary")]
+            await send({"type": "http.response.start", "status": 304, "headers": keep})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if compressing:
+            body = compress(encoding, body)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+        await send(start)
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,195 @@
+import time
+
+import orjson
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+import config
+from cachetool import aconn, conn
+from db import engine
+from models import Logrun, Railroader
+
+# Railroader rankings live in redis sorted sets maintained by the writer:
+#   lb:{metric}:all              all-time totals
+#   lb:{metric}:h:{hourstamp}    per hour buckets, kept for config.leaderboard_hours
+#   lb:{metric}:last:{hours}     union of the latest buckets, rebuilt every config.leaderboard_window_ttl seconds
+#   lb:seeded                    set once rebuild() backfilled the boards, until then they only have what the
+#                                writer recorded since it started
+
+
+def hour_of(timestamp: int) -> int:
+    return timestamp - timestamp % 3600
+
+
+def commodity_miles(run) -> dict:
+    coms = {str(load.template.type) for car in run.cars for load in car.loads if load.template.type}
+    return {f"miles_{typ}": run.distance for typ in coms if typ in config.commodity_types}
+
+
+def scores_for(run) -> dict:
+    return {"runs": 1, "miles": run.distance, "reward": run.railroader_reward, **commodity_miles(run)}
+
+
+record_scores = conn.register_script(
+    """
+    -- ARGV: railroader, hour bucket, bucket ttl, run id, then metric, score pairs
+    for i = 5, #ARGV, 2 do
+        redis.call('ZINCRBY', 'lb:' .. ARGV[i] .. ':all', ARGV[i + 1], ARGV[1])
+        local bucket = 'lb:' .. ARGV[i] .. ':h:' .. ARGV[2]
+        redis.call('ZINCRBY', bucket, ARGV[i + 1], ARGV[1])
+        redis.call('EXPIRE', bucket, ARGV[3])
+    end
+    -- A rebuild in progress replays these on top of its snapshot
+    if redis.call('EXISTS', 'lb:rebuilding') == 1 then
+        redis.call('RPUSH', 'lb:journal', cjson.encode(ARGV))
+    end
+    """
+)
+
+swap_boards = conn.register_script(
+    """
+    -- KEYS: the live boards to drop. ARGV: bucket ttl, seeded at, n, n rebuilt boards, then the run ids the
+    -- snapshot already has, their journal entries are skipped
+    local count = tonumber(ARGV[3])
+    local rebuilt, seen = {}, {}
+    for i = 4, 3 + count do rebuilt[ARGV[i]] = true end
+    for i = 4 + count, #ARGV do seen[ARGV[i]] = true end
+    for _, raw in ipairs(redis.call('LRANGE', 'lb:journal', 0, -1)) do
+        local run = cjson.decode(raw)
+        if not seen[run[4]] then
+            for i = 5, #run, 2 do
+                for _, key in ipairs({'lb:' .. run[i] .. ':all', 'lb:' .. run[i] .. ':h:' .. run[2]}) do
+                    redis.call('ZINCRBY', key .. ':rebuild', run[i + 1], run[1])
+                    rebuilt[key] = true
+                end
+            end
+        end
+    end
+    for _, key in ipairs(KEYS) do
+        redis.call('DEL', key)
+    end
+    for key in pairs(rebuilt) do
+        redis.call('RENAME', key .. ':rebuild', key)
+        if string.find(key, ':h:', 1, true) then
+            redis.call('EXPIRE', key, ARGV[1])
+        end
+    end
+    redis.call('DEL', 'lb:journal', 'lb:rebuilding')
+    redis.call('SET', 'lb:seeded', ARGV[2])
+    """
+)
+
+
+def record_logrun(run):
+    args = [run.railroader, hour_of(run.block_timestamp), (config.leaderboard_hours + 1) * 3600, run.id]
+    for metric, score in scores_for(run).items():
+        args += [metric, score]
+    record_scores(args=args)
+
+
+def rebuild():
+    # Backfill, totals from the railroader table and the hourly buckets from recent logruns, read from one
+    # snapshot of the primary. From before that snapshot until the swap the writer journals what it records,
+    # the swap replays the runs the snapshot doesn't have onto the rebuilt :rebuild keys and replaces all boards
+    # in one script. Returns None while another rebuild holds lb:rebuilding.
+    if not conn.set("lb:rebuilding", int(time.time()), nx=True, ex=3600):
+        return None
+    try:
+        conn.delete("lb:journal")
+        with Session(engine.execution_options(isolation_level="REPEATABLE READ")) as session:
+            roaders = session.exec(select(Railroader)).all()
+            rewards = session.exec(
+                select(Logrun.railroader, func.sum(Logrun.railroader_reward)).group_by(Logrun.railroader)
+            ).all()
+            newest = session.exec(select(func.max(Logrun.block_timestamp))).one() or 0
+            recent = session.exec(
+                select(Logrun).where(Logrun.block_timestamp >= hour_of(newest) - config.leaderboard_hours * 3600)
+            ).all()
+
+            boards = {}
+            for roader in roaders:
+                boards.setdefault("lb:runs:all", {})[roader.name] = roader.total_runs
+                boards.setdefault("lb:miles:all", {})[roader.name] = roader.total_miles
+                for typ in config.commodity_types:
+                    boards.setdefault(f"lb:miles_{typ}:all", {})[roader.name] = getattr(roader, f"total_miles_{typ}")
+            for name, reward in rewards:
+                boards.setdefault("lb:reward:all", {})[name] = reward
+            for run in recent:
+                bucket = hour_of(run.block_timestamp)
+                for metric, score in scores_for(run).items():
+                    board = boards.setdefault(f"lb:{metric}:h:{bucket}", {})
+                    board[run.railroader] = board.get(run.railroader, 0) + score
+
+            pipe = conn.pipeline(transaction=False)
+            for key, scores in boards.items():
+                pipe.delete(f"{key}:rebuild")
+                pipe.zadd(f"{key}:rebuild", scores)
+            pipe.execute()
+
+            # Runs journaled before the snapshot was taken are in it already. Whatever is journaled after this
+            # check committed long after the snapshot and is replayed.
+            journaled = [int(orjson.loads(raw)[3]) for raw in conn.lrange("lb:journal", 0, -1)]
+            seen = session.exec(select(Logrun.id).where(Logrun.id.in_(journaled))).all() if journaled else []
+
+        # The cached :last: unions go too, they are rebuilt from the new buckets on the next read
+        live = [key for key in conn.scan_iter("lb:*", count=1000) if not key.endswith(b":rebuild")]
+        ttl = (config.leaderboard_hours + 1) * 3600
+        swap_boards(keys=live, args=[ttl, int(time.time()), len(boards), *boards, *seen])
+    except Exception:
+        conn.delete("lb:rebuilding", "lb:journal")
+        raise
+
+    return len(roaders)
+
+
+async def seeded() -> bool:
+    return bool(await aconn.exists("lb:seeded"))
+
+
+async def board_key(metric: str, hours: int, now: int) -> str:
+    if hours == 0:
+        return f"lb:{metric}:all"
+
+    key = f"lb:{metric}:last:{hours}"
+    if not await aconn.exists(key):
+        current = hour_of(now)
+        buckets = [f"lb:{metric}:h:{current - 3600 * i}" for i in range(hours)]
+        await aconn.zunionstore(key, buckets)
+        await aconn.expire(key, config.leaderboard_window_ttl)
+    return key
+
+
+def format_entries(entries, first_rank: int) -> list:
+    return [
+        {"rank": first_rank + i + 1, "railroader": name.decode(), "score": score}
+        for i, (name, score) in enumerate(entries)
+    ]
+
+
+async def top(metric: str, hours: int, now: int, offset: int, limit: int) -> list:
+    key = await board_key(metric, hours, now)
+    entries = await aconn.zrevrange(key, offset, offset + limit - 1, withscores=True)
+    return format_entries(entries, offset)
+
+
+async def rank_of(metric: str, hours: int, now: int, railroader: str) -> dict:
+    key = await board_key(metric, hours, now)
+    rank = await aconn.zrevrank(key, railroader)
+    if rank is None:
+        return {}
+    return {
+        "rank": rank + 1,
+        "railroader": railroader,
+        "score": await aconn.zscore(key, railroader),
+        "total": await aconn.zcard(key),
+    }
+
+
+async def around(metric: str, hours: int, now: int, railroader: str, size: int) -> list:
+    key = await board_key(metric, hours, now)
+    rank = await aconn.zrevrank(key, railroader)
+    if rank is None:
+        return []
+    first = max(0, rank - size)
+    entries = await aconn.zrevrange(key, first, rank + size, withscores=True)
+    return format_entries(entries, first)
@@ -0,0 +1,44 @@
+"""block_timestamp, id indexes on the action tables
+
+Revision ID: 3f1c2a9d7b10
+Revises:
+Create Date: 2026-10-19 18:05:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f1c2a9d7b10"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# The keyset pages of the raw endpoints seek on these, create_all only adds them to new tables
+tables = ["logrun", "usefuel", "buyfuel", "npcencounter", "logtip"]
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = sa.inspect(bind).get_table_names()
+    # CONCURRENTLY doesn't block the writer but can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for table in tables:
+            if table not in existing:
+                continue
+            index = f"ix_{table}_block_timestamp_id"
+            # An interrupted build leaves an invalid index behind that IF NOT EXISTS would keep
+            invalid = bind.execute(
+                sa.text("SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:index) AND NOT indisvalid"),
+                {"index": index},
+            ).scalar()
+            if invalid:
+                op.execute(f"DROP INDEX CONCURRENTLY {index}")
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} (block_timestamp, id)")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table in tables:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_block_timestamp_id")
@@ -0,0 +1,36 @@
+"""achv_id on achievements, indexes for the /avs joins
+
+Revision ID: 8b4e6d2c1a57
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-19 18:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8b4e6d2c1a57"
+down_revision = "3f1c2a9d7b10"
+branch_labels = None
+depends_on = None
+
+indexes = [("achievement", "achv_id"), ("achievement", "railroader_id"), ("railroader", "name")]
+
+
+def upgrade():
+    # Schema only, the ids of existing rows are filled in by the next revision c5d9e3f7a2b4
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if "achievement" in existing:
+        op.execute("ALTER TABLE achievement ADD COLUMN IF NOT EXISTS achv_id INTEGER")
+    with op.get_context().autocommit_block():
+        for table, column in indexes:
+            if table in existing:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_{column} ON {table} ({column})")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, column in indexes:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_{column}")
+    op.execute("ALTER TABLE IF EXISTS achievement DROP COLUMN IF EXISTS achv_id")
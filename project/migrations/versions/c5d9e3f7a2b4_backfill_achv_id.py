@@ -0,0 +1,45 @@
+"""fill achv_id on the achievements written before the column existed
+
+Revision ID: c5d9e3f7a2b4
+Revises: 8b4e6d2c1a57
+Create Date: 2026-10-19 19:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import config
+
+
+# revision identifiers, used by Alembic.
+revision = "c5d9e3f7a2b4"
+down_revision = "8b4e6d2c1a57"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # One pass over the table, (name, tier) -> achv_id from config including the aliases the writer stores.
+    # Badges have no tier and match on the name alone.
+    if "achievement" not in sa.inspect(op.get_bind()).get_table_names():
+        return
+    rows, params = [], {}
+    for i, ((name, tier), achv_id) in enumerate(config.achv_ids.items()):
+        rows.append(f"(:name{i}, CAST(:tier{i} AS INTEGER), :achv_id{i})")
+        params.update({f"name{i}": name, f"tier{i}": tier, f"achv_id{i}": achv_id})
+    op.get_bind().execute(
+        sa.text(
+            f"""
+            UPDATE achievement SET achv_id = mapped.achv_id
+            FROM (VALUES {", ".join(rows)}) AS mapped (name, tier, achv_id)
+            WHERE achievement.achv_id IS NULL
+              AND achievement.name = mapped.name
+              AND (mapped.tier IS NULL OR achievement.tier = mapped.tier)
+            """
+        ),
+        params,
+    )
+
+
+def downgrade():
+    pass
@@ -1,6 +1,6 @@
 from typing import List, Optional
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Index, Integer, String
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -44,7 +44,9 @@ class LogrunNpcencounterLink(SQLModel, table=True):
 class Logrun(SQLModel, table=True):
     class Meta:
         load_instance = True
-        
+
+    __table_args__ = (Index("ix_logrun_block_timestamp_id", "block_timestamp", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
     trx_id: str
     action_seq: int
@@ -106,6 +108,7 @@ class Car(SQLModel, table=True):
 
 
 class Usefuel(SQLModel, table=True):
+    __table_args__ = (Index("ix_usefuel_block_timestamp_id", "block_timestamp", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
 
@@ -120,6 +123,7 @@ class Usefuel(SQLModel, table=True):
 
 
 class Buyfuel(SQLModel, table=True):
+    __table_args__ = (Index("ix_buyfuel_block_timestamp_id", "block_timestamp", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
 
@@ -136,6 +140,7 @@ class Buyfuel(SQLModel, table=True):
 
 
 class Npcencounter(SQLModel, table=True):
+    __table_args__ = (Index("ix_npcencounter_block_timestamp_id", "block_timestamp", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
 
@@ -153,6 +158,8 @@ class Npcencounter(SQLModel, table=True):
 
 
 class Logtip(SQLModel, table=True):
+    __table_args__ = (Index("ix_logtip_block_timestamp_id", "block_timestamp", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
 
     trx_id: str
@@ -251,7 +258,7 @@ class Asset(SQLModel, table=True):
 class Railroader(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
 
-    name: str
+    name: str = Field(index=True)
     first_run_stamp: int
 
     total_miles: int
@@ -284,8 +291,9 @@ class Railroader(SQLModel, table=True):
 class Achievement(SQLModel, table=True):
 
     id: Optional[int] = Field(default=None, primary_key=True, nullable=False)
-    railroader_id: Optional[int] = Field(default=None, foreign_key="railroader.id")
+    railroader_id: Optional[int] = Field(default=None, foreign_key="railroader.id", index=True)
     railroader: Optional[Railroader] = Relationship(back_populates="achievements")
+    achv_id: Optional[int] = Field(default=None, index=True)
 
     type: Optional[str]
     criteria: Optional[str]
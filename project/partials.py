@@ -0,0 +1,131 @@
+import time
+
+import orjson
+from sqlalchemy import and_, func, or_
+from sqlmodel import select
+
+import config
+from cachetool import aconn
+from db import read_session
+from models import Logrun
+
+# Sliding windows start at "now" snapped down to config.window_bucket_seconds, so every request within
+# a bucket shares the same boundaries, SQL literals and cache keys.
+#
+# The admin dashboard is additive per hour: a window is assembled from cached hourly partials for the
+# whole hours it covers plus one live query for the ragged head and the still open hours at the end.
+# An hour is cached only once the logrun watermark is config.partial_seal_lag past its end, so runs that commit
+# out of order still land in the live query and a cached partial does not change.
+
+HOUR = 3600
+
+
+def window_floor(timeframe: int) -> int:
+    now = int(time.time())
+    return now - now % config.window_bucket_seconds - timeframe * HOUR
+
+
+def empty_partial() -> dict:
+    return {
+        "transports": 0,
+        "reward": 0,
+        "distance": 0,
+        "weight": 0,
+        "diesel": 0.0,
+        "coal": 0.0,
+        "roaders": [],
+        "trains": [],
+    }
+
+
+def merge(partials) -> dict:
+    out = empty_partial()
+    roaders, trains = set(), set()
+    for part in partials:
+        for field in ("transports", "reward", "distance", "weight", "diesel", "coal"):
+            out[field] += part[field]
+        roaders.update(part["roaders"])
+        trains.update(part["trains"])
+    out["roaders"], out["trains"] = list(roaders), list(trains)
+    return out
+
+
+async def hourly(conds) -> dict:
+    hour = (Logrun.block_timestamp - Logrun.block_timestamp % HOUR).label("hour")
+    query = (
+        select(
+            hour,
+            func.count().label("transports"),
+            func.coalesce(func.sum(Logrun.railroader_reward), 0).label("reward"),
+            func.coalesce(func.sum(Logrun.distance), 0).label("distance"),
+            func.coalesce(func.sum(Logrun.weight), 0).label("weight"),
+            func.coalesce(func.sum(Logrun.quantity).filter(Logrun.fuel_type == "DIESEL"), 0).label("diesel"),
+            func.coalesce(func.sum(Logrun.quantity).filter(Logrun.fuel_type == "COAL"), 0).label("coal"),
+            func.array_agg(Logrun.railroader.distinct()).label("roaders"),
+            func.array_agg(Logrun.train_name.distinct()).label("trains"),
+        )
+        .where(*conds)
+        .group_by(hour)
+    )
+    async with read_session() as session:
+        rows = (await session.execute(query)).mappings().all()
+    return {row["hour"]: {k: v for k, v in row.items() if k != "hour"} for row in rows}
+
+
+async def sealed_partials(century: str, hours: list) -> list:
+    if not hours:
+        return []
+    keys = [f"partial:admin:{century or '*'}:{hour}" for hour in hours]
+    cached = await aconn.mget(keys)
+    missing = [hour for hour, hit in zip(hours, cached) if hit is None]
+    if missing:
+        conds = [Logrun.block_timestamp >= missing[0], Logrun.block_timestamp < missing[-1] + HOUR]
+        if century:
+            conds.append(Logrun.century == century)
+        computed = await hourly(conds)
+        pipe = aconn.pipeline(transaction=False)
+        for hour in missing:
+            pipe.set(
+                f"partial:admin:{century or '*'}:{hour}",
+                orjson.dumps(computed.get(hour, empty_partial())),
+                ex=config.partial_ttl,
+            )
+        await pipe.execute()
+    else:
+        computed = {}
+    return [
+        orjson.loads(hit) if hit is not None else computed.get(hour, empty_partial())
+        for hour, hit in zip(hours, cached)
+    ]
+
+
+async def admin_dash(century: str, timeframe: int) -> dict:
+    start = window_floor(timeframe)
+    first = start - start % HOUR + (HOUR if start % HOUR else 0)
+    # Hours that ended partial_seal_lag before the watermark are complete, anything after can still receive runs
+    watermark = int(await aconn.hget("watermark:logrun", "block_timestamp") or 0) - config.partial_seal_lag
+    sealed_to = max(first, watermark - watermark % HOUR)
+
+    live_conds = [
+        or_(and_(Logrun.block_timestamp >= start, Logrun.block_timestamp < first), Logrun.block_timestamp >= sealed_to)
+    ]
+    if century:
+        live_conds.append(Logrun.century == century)
+    live = await hourly(live_conds)
+    total = merge([*await sealed_partials(century, list(range(first, sealed_to, HOUR))), *live.values()])
+
+    transports = total["transports"]
+    return {
+        "total_transports": transports,
+        "total_distance": total["distance"],
+        "total_reward": total["reward"] / 10000,
+        "avg_reward": total["reward"] // transports / 10000 if transports else 0,
+        "total_weight": total["weight"],
+        "avg_weight": total["weight"] // transports if transports else 0,
+        "total_coal": round(total["coal"], 2),
+        "avg_coal": round(total["coal"] / transports, 2) if transports else 0,
+        "total_diesel": round(total["diesel"], 2),
+        "avg_diesel": round(total["diesel"] / transports, 2) if transports else 0,
+        "active_railroaders": len(total["roaders"]),
+        "active_trains": len(total["trains"]),
+    }
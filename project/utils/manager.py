@@ -13,6 +13,7 @@ class TrainManager:
         self.posrr = posrr
         self.posm = posm
         self.out = []
+        self.heads = {}
         self.sess = History(server="https://wax.greymass.com")
 
     def thread(self, n):
@@ -24,6 +25,8 @@ class TrainManager:
                         if res["action_trace"]["act"]["name"] in wanted_actions:
                             self.out.append(res)
                     self.posrr += len(resp)
+                    if resp:
+                        self.heads["rr.century"] = resp[-1]["block_time"]
                     if len(resp) == 0:
                         break
             else:
@@ -33,6 +36,8 @@ class TrainManager:
                         if res["action_trace"]["act"]["name"] in ["usefuel", "buyfuel"]:
                             self.out.append(res)
                     self.posm += len(resp)
+                    if resp:
+                        self.heads["m.century"] = resp[-1]["block_time"]
                     if len(resp) == 0:
                         break 
 
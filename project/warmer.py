@@ -0,0 +1,48 @@
+import asyncio
+import secrets
+
+import config
+from apicache import warm
+from cachetool import aconn
+
+# Every api worker runs the loop, the one holding warmer:leader does the work. The lease is a few
+# intervals long so a dead leader is replaced quickly, the others just keep retrying to take it.
+
+renew_lease = aconn.register_script(
+    """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+)
+
+
+async def is_leader(token: str, lease_ms: int) -> bool:
+    if await aconn.set("warmer:leader", token, nx=True, px=lease_ms):
+        return True
+    return bool(await renew_lease(keys=["warmer:leader"], args=[token, lease_ms]))
+
+
+def warm_targets(app) -> list:
+    endpoints = {route.path: route.endpoint for route in app.routes if hasattr(route, "endpoint")}
+    return [(endpoints[path], params) for path, shapes in config.warm_routes.items() for params in shapes]
+
+
+async def run(app):
+    token = secrets.token_hex(8)
+    lease_ms = config.warm_interval * 3000
+    targets = warm_targets(app)
+    while True:
+        try:
+            if await is_leader(token, lease_ms):
+                for endpoint, params in targets:
+                    # Refresh anything that would go stale before the next round
+                    await warm(endpoint, params, ahead=config.warm_interval * 2)
+        except Exception as e:
+            print(f"cache warmer: {e}")
+        await asyncio.sleep(config.warm_interval)
+
+
+def start(app):
+    app.state.warmer = asyncio.ensure_future(run(app))
@@ -7,8 +7,12 @@ from celery import Celery
 from sqlmodel import Session
 
 import random
+import archive
+import avstats
 import cachetool
 import config
+import feed
+import leaderboard
 from db import commit_or_rollback, db_session, engine, commit_or_rollback_big
 from disclog import postLog
 from models import Achievement, Asset, Buyfuel, Car, Logrun, Logtip, Npcencounter, Railroader, Template, Tip, Usefuel
@@ -29,6 +33,9 @@ class SqlAlchemyTask(celery.Task):
 @celery.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(120.0, Atomic.s(), name="routine to keep assets+templates updated")
+    sender.add_periodic_task(86400.0, Archive.s(), name="routine to export sealed months to parquet")
+    sender.add_periodic_task(300.0, RebuildLeaderboards.s(), name="routine to seed the leaderboards once")
+    sender.add_periodic_task(300.0, RebuildAvStats.s(), name="routine to seed the rarity counters once")
 
 
 @celery.task(base=SqlAlchemyTask)
@@ -42,6 +49,53 @@ def Atomic() -> str:
     return f"atomic routine done,took: {(time.perf_counter()-start)} "
 
 
+@celery.task(base=SqlAlchemyTask)
+def Archive() -> str:
+    start = time.perf_counter()
+    done = {}
+    try:
+        done = archive.export_sealed()
+    except Exception as e:
+        postLog(e, "error", f"{inspect.stack()[0][3]}:{inspect.stack()[0][2]}")
+
+    return f"archive routine done, exported {done}, took: {(time.perf_counter()-start)} "
+
+
+@celery.task(base=SqlAlchemyTask)
+def RebuildLeaderboards(force: bool = False) -> str:
+    # Seeds the boards once, the writer keeps them current from there. force=True rebuilds seeded boards too.
+    if not force and cachetool.conn.exists("lb:seeded"):
+        return "leaderboards already seeded"
+    start = time.perf_counter()
+    roaders = leaderboard.rebuild()
+    if roaders is None:
+        return "leaderboard rebuild already running"
+    return f"leaderboards rebuilt for {roaders} railroaders, took: {(time.perf_counter()-start)} "
+
+
+@celery.task(base=SqlAlchemyTask)
+def RebuildAvStats(force: bool = False) -> str:
+    # Seeds the counters once, the writer keeps them current from there. force=True rebuilds seeded counters too.
+    if not force and cachetool.conn.exists("avstats:seeded"):
+        return "rarity counters already seeded"
+    start = time.perf_counter()
+    achievements = avstats.rebuild()
+    return f"rarity counters rebuilt for {achievements} achievements, took: {(time.perf_counter()-start)} "
+
+
+@celery.task(base=SqlAlchemyTask)
+def SeedCounters() -> str:
+    # One-off exact counts for /status, the writer increments them from there on. Until a table is seeded
+    # /status reports the planner's estimate for it.
+    start = time.perf_counter()
+    counts = {}
+    with Session(engine) as session:
+        for table, spec in archive.archived_tables.items():
+            counts[table] = session.query(spec[0]).count()
+            cachetool.seed_count(table, counts[table], int(cachetool.conn.get(f"count:{table}") or 0))
+    return f"counters seeded {counts}, took: {(time.perf_counter()-start)} "
+
+
 def fetchRoutine(mode, server):
 
     fetcher = getattr(AH(server=server), mode)
@@ -337,43 +391,46 @@ def compareTime(last, current):
     ).total_seconds() / 3600
 
 
+# Achievement rules, also used by the benchmark datasets
+cuts = [5000, 10000, 20000, 35000, 50000]
+otto_cuts = [1, 5, 10, 18, 19]
+days = [7, 30, 90, 180, 365]
+days_dict = {"7": 1, "30": 2, "90": 3, "180": 4, "365": 5}
+miles_dict = {"5000": 1, "10000": 2, "20000": 3, "35000": 4, "50000": 5}
+otto_dict = {"1": 1, "5": 2, "10": 3, "18": 4, "19": 5}
+miles_av_names = {
+    "pallet": "Pallet Pusher",
+    "crate": "Crate Carrier",
+    "liquid": "Liquid Lifter",
+    "gas": "Mr. Gas",
+    "aggregate": "Woodchip King",
+    "ore": "Rock Hustler",
+    "granule": "Sugar Daddy",
+    "grain": "Grainasaurus Rex",
+    "perishable": "Icicle Jones",
+    "oversized": "Big Shit Express",
+    "building_materials": "Rob the Builder",
+    "automobile": "OttoMobile",
+    "top_secret": "Entity 9s BFF",
+}
+days_av_names = {
+    "7": "7 Day Streak",
+    "30": "30 Day Streak",
+    "90": "90 Day Streak",
+    "180": "180 Day Streak",
+    "365": "365 Day Streak",
+}
+otto_av_names = {
+    "1": "Otto’s Fellow",
+    "5": "Otto’s Colleague",
+    "10": "Otto’s Companion",
+    "18": "Otto’s Enemy",
+    "19": "Otto's Bro",
+}
+
+
 class AchievementProcessor:
     def process_logrun(self, session, act, typ):
-        cuts = [5000, 10000, 20000, 35000, 50000]
-        otto_cuts = [1, 5, 10, 18, 19]
-        days = [7, 30, 90, 180, 365]
-        days_dict = {"7": 1, "30": 2, "90": 3, "180": 4, "365": 5}
-        miles_dict = {"5000": 1, "10000": 2, "20000": 3, "35000": 4, "50000": 5}
-        otto_dict = {"1": 1, "5": 2, "10": 3, "18": 4, "19": 5}
-        miles_av_names = {
-            "pallet": "Pallet Pusher",
-            "crate": "Crate Carrier",
-            "liquid": "Liquid Lifter",
-            "gas": "Mr. Gas",
-            "aggregate": "Woodchip King",
-            "ore": "Rock Hustler",
-            "granule": "Sugar Daddy",
-            "grain": "Grainasaurus Rex",
-            "perishable": "Icicle Jones",
-            "oversized": "Big Shit Express",
-            "building_materials": "Rob the Builder",
-            "automobile": "OttoMobile",
-            "top_secret": "Entity 9s BFF",
-        }
-        days_av_names = {
-            "7": "7 Day Streak",
-            "30": "30 Day Streak",
-            "90": "90 Day Streak",
-            "180": "180 Day Streak",
-            "365": "365 Day Streak",
-        }
-        otto_av_names = {
-            "1": "Otto’s Fellow",
-            "5": "Otto’s Colleague",
-            "10": "Otto’s Companion",
-            "18": "Otto’s Enemy",
-            "19": "Otto's Bro",
-        }
         if typ == "logrun":
             existing = session.query(Railroader).filter(Railroader.name == act.railroader).first()
             distance = act.distance
@@ -416,10 +473,12 @@ class AchievementProcessor:
                                     tier=miles_dict[str(cut)],
                                     value=cut,
                                     name=miles_av_names[typ],
+                                    achv_id=config.achv_ids.get((miles_av_names[typ], miles_dict[str(cut)])),
                                     reached=True,
                                     reached_date_timestamp=act.block_timestamp,
                                 )
                                 session.add(new_av)
+                                self.reached.append(new_av)
 
                 for day in days:
                     if existing.conseq_day > day:
@@ -437,10 +496,12 @@ class AchievementProcessor:
                                 tier=days_dict[str(day)],
                                 value=day,
                                 name=days_av_names[str(day)],
+                                achv_id=config.achv_ids.get((days_av_names[str(day)], days_dict[str(day)])),
                                 reached=True,
                                 reached_date_timestamp=act.block_timestamp,
                             )
                             session.add(new_av)
+                            self.reached.append(new_av)
                 session.add(existing)
 
                 try:
@@ -448,6 +509,7 @@ class AchievementProcessor:
                 except Exception as e:
                     print(e)
                     session.rollback()
+                    self.reached = []
                 return None
             else:
                 return commit_or_rollback(session,
@@ -544,10 +606,24 @@ def writer(to_write,mode) -> str:
             commit_times += time.perf_counter()-start_commit
             start_achiv = time.perf_counter()
             if commited_item and mode == "action":
+                # Achievements the processor adds for this item, published once committed
+                processor.reached = []
                 if isinstance(commited_item, Logrun):
+                    leaderboard.record_logrun(commited_item)
                     processor.process_logrun(session,commited_item,"logrun")
                 if isinstance(commited_item, Npcencounter):
                     processor.process_logrun(session,commited_item,"npcencounter")
+                feed.publish_action(commited_item)
+                for av in processor.reached:
+                    avstats.record(av)
+                    feed.publish_achievement(av, commited_item.railroader)
+                # Raised after the achievements so cached responses keyed on it see those too
+                cachetool.set_watermark(
+                    commited_item.__tablename__, commited_item.action_seq, commited_item.block_timestamp
+                )
+            if commited_item and mode in ("asset", "template"):
+                # Drop a cached "unknown id" from the api's atomic cache
+                cachetool.conn.delete(f"atomic:{mode}:{getattr(commited_item, f'{mode}_id')}")
             achiv_times += time.perf_counter()-start_achiv
 
 